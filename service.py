@@ -10,6 +10,11 @@ from src.controllers.App.Service import Service
 # Instantiate Service class
 my_service = Service()
 
+# If 'prestage' argument is passed, pre-stage pending updates
+if len(sys.argv) > 1 and sys.argv[1] == 'prestage':
+    my_service.run_prestage()
+    sys.exit(0)
+
 # If an argument is passed, execute the corresponding module agent
 if len(sys.argv) > 1:
     my_service.run_agent(sys.argv[1])
@@ -9,6 +9,8 @@ from colorama import Fore, Style
 # Import classes
 from src.controllers.App.Config import Config
 from src.controllers.System import System
+from src.controllers.Lock import Lock, release_all_locks
+from src.controllers.App.Utils import STATE_DIR
 
 class App:
     #-----------------------------------------------------------------------------------------------
@@ -52,42 +54,28 @@ class App:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Create lock file
+    #   Acquire linupdate lock, held until exit to indicate that linupdate is running
+    #   It is shared, so that several linupdate processes can run at the same time (e.g. the agent and a manual run)
     #
     #-----------------------------------------------------------------------------------------------
     def set_lock(self):
         try:
-            Path('/tmp/linupdate.lock').touch()
+            Lock('/tmp/linupdate.lock', exclusive = False).acquire()
         except Exception as e:
-            raise Exception('Could not create lock file /tmp/linupdate.lock: ' + str(e))
+            raise Exception('Could not acquire lock /tmp/linupdate.lock: ' + str(e))
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Remove lock files
+    #   Release all locks held by linupdate
+    #   Locks are also released by the system if linupdate exits without calling this function (e.g. crash)
     #
     #-----------------------------------------------------------------------------------------------
     def remove_locks(self):
-        # All lock files
-        locks = [
-            '/tmp/linupdate.lock',
-            '/tmp/linupdate.update-running.lock'
-        ]
-
-        # Failed locks
-        failed_locks = []
-
-        # Try to remove lock files
-        for lock in locks:
-            if Path(lock).is_file():
-                try:
-                    Path(lock).unlink()
-                except Exception:
-                    failed_locks.append(lock)
-
-        # If there are failed locks, raise an exception
-        if failed_locks:
-            raise Exception(' Could not remove lock files: ' + ', '.join(failed_locks))
+        try:
+            release_all_locks()
+        except Exception as e:
+            raise Exception(' Could not release locks: ' + str(e))
 
 
     #-----------------------------------------------------------------------------------------------
@@ -102,6 +90,7 @@ class App:
             Path('/etc/linupdate/modules').mkdir(parents=True, exist_ok=True)
             Path('/opt/linupdate').mkdir(parents=True, exist_ok=True)
             Path('/var/log/linupdate').mkdir(parents=True, exist_ok=True)
+            Path(STATE_DIR).mkdir(parents=True, exist_ok=True)
         except Exception as e:
             raise Exception('Could not create base directories: ' + str(e))
 
@@ -112,6 +101,7 @@ class App:
             Path('/etc/linupdate').chmod(0o750)
             Path('/etc/linupdate/modules').chmod(0o750)
             Path('/var/log/linupdate').chmod(0o750)
+            Path(STATE_DIR).chmod(0o750)
         except Exception as e:
             raise Exception('Could not set permissions to base directories: ' + str(e))
 
@@ -2,6 +2,7 @@
 
 # Import libraries
 from pathlib import Path
+import re
 import shutil
 import yaml
 from colorama import Style
@@ -109,6 +110,33 @@ class Config:
                 configuration['main']['log_retention_days'] = 180
                 write_config = True
 
+            # If main.package_manager_lock_timeout is not set, default to 60 seconds
+            if 'package_manager_lock_timeout' not in configuration['main']:
+                configuration['main']['package_manager_lock_timeout'] = 60
+                write_config = True
+
+            # Check if main.package_manager_lock_timeout is a positive integer
+            if not isinstance(configuration['main']['package_manager_lock_timeout'], int) or configuration['main']['package_manager_lock_timeout'] < 1:
+                raise Exception('main.package_manager_lock_timeout key must be a positive integer in ' + self.config_file)
+
+            # If main.packages_lock_timeout is not set, default to 3600 seconds (an update can hold the packages lock for a long time)
+            if 'packages_lock_timeout' not in configuration['main']:
+                configuration['main']['packages_lock_timeout'] = 3600
+                write_config = True
+
+            # Check if main.packages_lock_timeout is a positive integer
+            if not isinstance(configuration['main']['packages_lock_timeout'], int) or configuration['main']['packages_lock_timeout'] < 1:
+                raise Exception('main.packages_lock_timeout key must be a positive integer in ' + self.config_file)
+
+            # If main.package_lists_ttl is not set, default to 60 minutes
+            if 'package_lists_ttl' not in configuration['main']:
+                configuration['main']['package_lists_ttl'] = 60
+                write_config = True
+
+            # Check if main.package_lists_ttl is a positive integer (0 = always refresh)
+            if not isinstance(configuration['main']['package_lists_ttl'], int) or configuration['main']['package_lists_ttl'] < 0:
+                raise Exception('main.package_lists_ttl key must be a positive integer in ' + self.config_file)
+
             # Check if modules is set
             if 'modules' not in configuration:
                 raise Exception('modules key is missing in ' + self.config_file)
@@ -145,6 +173,104 @@ class Config:
             if 'on_major_update' not in configuration['update']['packages']['exclude']:
                 raise Exception('update.packages.exclude.on_major_update key is missing in ' + self.config_file)
 
+            # If update.transaction is not set, default to one package update at a time
+            if 'transaction' not in configuration['update']:
+                configuration['update']['transaction'] = {
+                    'enabled': False,
+                    'chunk_size': 50
+                }
+                write_config = True
+
+            # If update.transaction.enabled is not set, default to False
+            if 'enabled' not in configuration['update']['transaction']:
+                configuration['update']['transaction']['enabled'] = False
+                write_config = True
+
+            # Check if update.transaction.enabled is set to True or False
+            if configuration['update']['transaction']['enabled'] not in [True, False]:
+                raise Exception('update.transaction.enabled key must be set to true or false in ' + self.update_file)
+
+            # If update.transaction.chunk_size is not set, default to 50 packages per transaction
+            if 'chunk_size' not in configuration['update']['transaction']:
+                configuration['update']['transaction']['chunk_size'] = 50
+                write_config = True
+
+            # Check if update.transaction.chunk_size is a positive integer
+            if not isinstance(configuration['update']['transaction']['chunk_size'], int) or configuration['update']['transaction']['chunk_size'] < 1:
+                raise Exception('update.transaction.chunk_size key must be a positive integer in ' + self.update_file)
+
+            # If update.partial_refresh is not set, default to False (all sources are refreshed)
+            if 'partial_refresh' not in configuration['update']:
+                configuration['update']['partial_refresh'] = False
+                write_config = True
+
+            # Check if update.partial_refresh is set to True or False
+            if configuration['update']['partial_refresh'] not in [True, False]:
+                raise Exception('update.partial_refresh key must be set to true or false in ' + self.update_file)
+
+            # If update.download_ahead is not set, default to packages being downloaded at install time
+            if 'download_ahead' not in configuration['update']:
+                configuration['update']['download_ahead'] = {
+                    'enabled': False,
+                    'parallel_downloads': 4
+                }
+                write_config = True
+
+            # If update.download_ahead.enabled is not set, default to False
+            if 'enabled' not in configuration['update']['download_ahead']:
+                configuration['update']['download_ahead']['enabled'] = False
+                write_config = True
+
+            # Check if update.download_ahead.enabled is set to True or False
+            if configuration['update']['download_ahead']['enabled'] not in [True, False]:
+                raise Exception('update.download_ahead.enabled key must be set to true or false in ' + self.update_file)
+
+            # If update.download_ahead.parallel_downloads is not set, default to 4 parallel downloads
+            # (dnf max_parallel_downloads, apt always downloads with one connection per mirror)
+            if 'parallel_downloads' not in configuration['update']['download_ahead']:
+                configuration['update']['download_ahead']['parallel_downloads'] = 4
+                write_config = True
+
+            # Check if update.download_ahead.parallel_downloads is a positive integer
+            if not isinstance(configuration['update']['download_ahead']['parallel_downloads'], int) or configuration['update']['download_ahead']['parallel_downloads'] < 1:
+                raise Exception('update.download_ahead.parallel_downloads key must be a positive integer in ' + self.update_file)
+
+            # If update.prestage is not set, default to pending updates not being downloaded in advance by the service
+            if 'prestage' not in configuration['update']:
+                configuration['update']['prestage'] = {
+                    'enabled': False,
+                    'schedule': '03:00',
+                    'max_age': 24
+                }
+                write_config = True
+
+            # If update.prestage.enabled is not set, default to False
+            if 'enabled' not in configuration['update']['prestage']:
+                configuration['update']['prestage']['enabled'] = False
+                write_config = True
+
+            # Check if update.prestage.enabled is set to True or False
+            if configuration['update']['prestage']['enabled'] not in [True, False]:
+                raise Exception('update.prestage.enabled key must be set to true or false in ' + self.update_file)
+
+            # If update.prestage.schedule is not set, default to 03:00
+            if 'schedule' not in configuration['update']['prestage']:
+                configuration['update']['prestage']['schedule'] = '03:00'
+                write_config = True
+
+            # Check if update.prestage.schedule is a time (HH:MM) or 'idle'
+            if not isinstance(configuration['update']['prestage']['schedule'], str) or not re.match(r'^(([01][0-9]|2[0-3]):[0-5][0-9]|idle)$', configuration['update']['prestage']['schedule']):
+                raise Exception('update.prestage.schedule key must be a time (HH:MM) or \'idle\' in ' + self.update_file)
+
+            # If update.prestage.max_age is not set, default to 24 hours
+            if 'max_age' not in configuration['update']['prestage']:
+                configuration['update']['prestage']['max_age'] = 24
+                write_config = True
+
+            # Check if update.prestage.max_age is a positive integer
+            if not isinstance(configuration['update']['prestage']['max_age'], int) or configuration['update']['prestage']['max_age'] < 1:
+                raise Exception('update.prestage.max_age key must be a positive integer in ' + self.update_file)
+
             # Check if post_update is set
             if 'post_update' not in configuration:
                 raise Exception('post_update key is missing in ' + self.update_file)
@@ -681,6 +807,54 @@ class Config:
         self.write_conf(configuration)
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get transaction mode status (update packages by chunks in a single transaction)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_update_transaction_enabled(self) -> bool:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return configuration['update']['transaction']['enabled']
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get the maximum number of packages to update in a single transaction
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_update_transaction_chunk_size(self) -> int:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return int(configuration['update']['transaction']['chunk_size'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get partial refresh status (only refresh the sources providing the packages to update, when a list is provided)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_update_partial_refresh(self) -> bool:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return configuration['update']['partial_refresh']
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get pre-stage settings (pending updates downloaded in advance by the service)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_update_prestage(self) -> dict:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return configuration['update']['prestage']
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Get log retention days from config file
@@ -693,6 +867,42 @@ class Config:
         return int(configuration['main']['log_retention_days'])
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get the maximum time to wait for the package manager (dpkg/dnf) lock to be released, in seconds
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_package_manager_lock_timeout(self) -> int:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return int(configuration['main']['package_manager_lock_timeout'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get the maximum time to wait for the linupdate packages lock (held during updates) to be released, in seconds
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_packages_lock_timeout(self) -> int:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return int(configuration['main']['packages_lock_timeout'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get the time during which refreshed package lists are reused without being refreshed again, in minutes
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_package_lists_ttl(self) -> int:
+        # Get current configuration
+        configuration = self.get_conf()
+
+        return int(configuration['main']['package_lists_ttl'])
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Set log retention days in config file
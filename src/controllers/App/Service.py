@@ -1,6 +1,8 @@
 # coding: utf-8
 
 # Import libraries
+import os
+import shutil
 import subprocess
 import signal
 import sys
@@ -14,6 +16,8 @@ from colorama import Fore, Style
 # Import classes
 from src.controllers.App.Config import Config
 from src.controllers.Module.Module import Module
+from src.controllers.Lock import Lock
+from src.controllers.Package.Package import Package
 
 class Service:
     def __init__(self):
@@ -34,6 +38,10 @@ class Service:
 
             # Track last date when logs were cleaned
             self.last_log_cleanup_date = None
+
+            # Pre-stage job process and last date when it was started
+            self.prestage_process = None
+            self.last_prestage_date = None
         except Exception as e:
             print('Fatal error in service initialization: ' + str(e))
             sys.exit(1)
@@ -60,24 +68,18 @@ class Service:
                     print('[reposerver-agent] Linupdate service restart is needed.')
 
                     try:
-                        # List of possible lock files (more could be added in the future)
-                        lock_files = ['/tmp/linupdate.reposerver.request.lock']
-
-                        # Wait a bit if there is a lock file to prevent data loss
-                        while True:
-                            lock_present = 0
-
-                            # Check if lock files are present, if so, wait
-                            for lock_file in lock_files:
-                                if Path(lock_file).is_file():
-                                    print('[reposerver-agent] Lock file ' + lock_file + ' is present, waiting...')
-                                    lock_present +=1
-
-                            # Break the loop if no lock file is present
-                            if (lock_present == 0):
-                                break
-
-                            time.sleep(2)
+                        # List of possible locks (more could be added in the future)
+                        locks = [Lock('/tmp/linupdate.reposerver.request.lock', exclusive = True, timeout = 10)]
+
+                        # Wait for the locks to be released to prevent data loss
+                        # Locks are kept until the restart, so that no new request can start in the meantime
+                        for lock in locks:
+                            while True:
+                                try:
+                                    lock.acquire()
+                                    break
+                                except Exception:
+                                    print('[reposerver-agent] Lock ' + lock.lock_file + ' is held' + lock.get_holders_message() + ', waiting...')
 
                         # First delete the restart file
                         Path(restart_file).unlink()
@@ -192,6 +194,13 @@ class Service:
                     # Be defensive: never let cleanup scheduling break the service loop
                     pass
 
+                # Pre-stage pending updates in background, at the configured time or when the system is idle
+                try:
+                    self.schedule_prestage()
+                except Exception as e:
+                    # Never let pre-stage scheduling break the service loop
+                    print('[linupdate] Pre-stage scheduling error: ' + str(e))
+
                 time.sleep(5)
 
         except Exception as e:
@@ -223,6 +232,82 @@ class Service:
             exit(1)
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Start the pre-stage job when it is due, once a day:
+    #   - at the configured time (HH:MM), or later that day if the service was not running at that time
+    #   - or when the system is idle
+    #   The job runs as a low priority child process (CPU and I/O), it does not install anything
+    #
+    #-----------------------------------------------------------------------------------------------
+    def schedule_prestage(self):
+        # Check if the previous pre-stage job has terminated
+        if self.prestage_process is not None:
+            retcode = self.prestage_process.poll()
+
+            if retcode is None:
+                return
+
+            if retcode != 0:
+                print('[linupdate] Pre-stage job terminated with return code ' + str(retcode))
+
+            self.prestage_process = None
+
+        prestage = self.config.get_update_prestage()
+
+        if not prestage['enabled']:
+            return
+
+        now = datetime.now()
+
+        # Already started today
+        if self.last_prestage_date is not None and self.last_prestage_date.date() == now.date():
+            return
+
+        if prestage['schedule'] == 'idle':
+            # System is considered idle when the 1 minute load average is below 0.2 per CPU
+            if os.getloadavg()[0] >= 0.2 * (os.cpu_count() or 1):
+                return
+        elif now.strftime('%H:%M') < prestage['schedule']:
+            return
+
+        # Do not pre-stage while packages are being updated, retry later
+        if Lock('/tmp/linupdate.update-running.lock').is_locked():
+            return
+
+        print('[linupdate] Starting pre-stage of pending updates')
+
+        # Lowest CPU priority, and idle I/O scheduling class if ionice is available
+        cmd = ['nice', '-n', '19']
+
+        if shutil.which('ionice') is not None:
+            cmd += ['ionice', '-c', '3']
+
+        self.prestage_process = subprocess.Popen(
+            cmd + ['/opt/linupdate/service.py', 'prestage'],
+            stdout=sys.stdout,
+            stderr=sys.stderr
+        )
+
+        self.last_prestage_date = now
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Pre-stage pending updates (executed as a child process by the service)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def run_prestage(self):
+        try:
+            packages = Package().prestage()
+
+            print('[linupdate] Pre-stage completed: ' + str(len(packages)) + ' packages downloaded')
+
+        except Exception as e:
+            print('[linupdate] Pre-stage error: ' + str(e))
+            exit(1)
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Cleanup logs older than configured retention
@@ -273,6 +358,15 @@ class Service:
     #
     #-----------------------------------------------------------------------------------------------
     def stop_child_processes(self):
+        # Stop the pre-stage job if running, packages being downloaded will be downloaded again next time
+        if self.prestage_process is not None and self.prestage_process.poll() is None:
+            self.prestage_process.terminate()
+
+            try:
+                self.prestage_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.prestage_process.kill()
+
         if not self.child_processes:
             return
 
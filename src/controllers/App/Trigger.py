@@ -3,9 +3,15 @@
 # Import libraries
 from pathlib import Path
 
+# Import classes
+from src.controllers.App.Utils import STATE_DIR
+
+# Directory of the trigger files, watched by the reposerver agent
+TRIGGER_DIR = STATE_DIR + '/triggers'
+
 class Trigger:
     def __init__(self):
-        self.trigger_path = '/tmp/linupdate.trigger'
+        self.trigger_dir = TRIGGER_DIR
 
     #-----------------------------------------------------------------------------------------------
     #
@@ -14,10 +20,12 @@ class Trigger:
     #-----------------------------------------------------------------------------------------------
     def create(self, name):
         try:
-            if not Path(self.trigger_path + '.' + name).is_file():
-                Path(self.trigger_path + '.' + name).touch()
+            Path(self.trigger_dir).mkdir(parents=True, exist_ok=True)
+
+            if not Path(self.trigger_dir + '/' + name).is_file():
+                Path(self.trigger_dir + '/' + name).touch()
         except Exception as e:
-            raise Exception('Could not create trigger file ' + self.trigger_path + '.' + name + ': ' + str(e))
+            raise Exception('Could not create trigger file ' + self.trigger_dir + '/' + name + ': ' + str(e))
 
 
     #-----------------------------------------------------------------------------------------------
@@ -27,10 +35,10 @@ class Trigger:
     #-----------------------------------------------------------------------------------------------
     def remove(self, name):
         try:
-            if Path(self.trigger_path + '.' + name).is_file():
-                Path(self.trigger_path + '.' + name).unlink()
+            if Path(self.trigger_dir + '/' + name).is_file():
+                Path(self.trigger_dir + '/' + name).unlink()
         except Exception as e:
-            raise Exception('Could not remove trigger file ' + self.trigger_path + '.' + name + ': ' + str(e))
+            raise Exception('Could not remove trigger file ' + self.trigger_dir + '/' + name + ': ' + str(e))
 
 
     #-----------------------------------------------------------------------------------------------
@@ -39,7 +47,7 @@ class Trigger:
     #
     #-----------------------------------------------------------------------------------------------
     def exists(self, name):
-        if Path(self.trigger_path + '.' + name).is_file():
+        if Path(self.trigger_dir + '/' + name).is_file():
             return True
 
         return False
@@ -1,13 +1,19 @@
 # coding: utf-8
 
 # Import libraries
+import os
 import json
 import re
+import time
 import tty
 import termios
 import sys
+from pathlib import Path
 from colorama import Fore, Style
 
+# Directory of the state files kept between linupdate runs (history cursor, refresh stamp, snapshots...)
+STATE_DIR = '/var/lib/linupdate'
+
 class Utils:
     #-----------------------------------------------------------------------------------------------
     #
@@ -51,6 +57,100 @@ class Utils:
 
         return text
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the lines of a log that are related to a package (e.g. from a multi-packages transaction log)
+    #   Error and warning lines are also kept if include_errors is True
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_package_log_slice(self, log: str, package: str, include_errors: bool = False):
+        lines = []
+
+        # Match the package name as a whole word (e.g. 'curl' must not match 'libcurl4' or 'curl-dev'), it can be
+        # followed by an architecture or a version (e.g. 'curl:amd64', 'curl_7.88.1-10_amd64.deb', 'curl-7.76.1-29.el9.x86_64')
+        package_regex = re.compile(r'(?<![\w.+-])' + re.escape(package) + r'(?=$|[\s:(),/]|[_-]\d|\.(?:x86_64|noarch|i686|aarch64|ppc64le|s390x|src)\b)')
+        error_regex = re.compile(r'^\|? *(E:|W:|Error|error|dpkg: error|Problem)')
+
+        for line in log.splitlines():
+            if package_regex.search(line):
+                lines.append(line)
+            elif include_errors and error_regex.search(line):
+                lines.append(line)
+
+        return '\n'.join(lines)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the path of a state file
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_state_file(self, name: str) -> str:
+        return STATE_DIR + '/' + name
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load a JSON state file, return None if there is no file, or if it is unreadable or lacks one of the
+    #   required keys: a state file only saves work, a corrupted one means starting over
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load_state_file(self, file: str, required_keys: list = []):
+        if not Path(file).is_file():
+            return None
+
+        try:
+            with open(file, 'r') as f:
+                content = json.load(f)
+        except Exception:
+            return None
+
+        if not isinstance(content, dict) or any(key not in content for key in required_keys):
+            return None
+
+        return content
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save a JSON state file
+    #   Write to a temporary file then rename it, to avoid leaving a partially written file
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save_state_file(self, file: str, content: dict):
+        try:
+            Path(file).parent.mkdir(parents=True, exist_ok=True)
+
+            with open(file + '.tmp', 'w') as f:
+                json.dump(content, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(file + '.tmp', file)
+        except Exception as e:
+            raise Exception('could not save ' + file + ': ' + str(e))
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove a state file, if it exists
+    #
+    #-----------------------------------------------------------------------------------------------
+    def remove_state_file(self, file: str):
+        try:
+            Path(file).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            raise Exception('could not remove ' + file + ': ' + str(e))
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if a timestamp is older than max_age seconds
+    #   A timestamp in the future means the clock has changed, it is not trusted and considered expired too
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_expired(self, timestamp: float, max_age: float) -> bool:
+        age = time.time() - timestamp
+
+        return age < 0 or age >= max_age
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Convert a string to a boolean
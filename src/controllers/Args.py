@@ -781,7 +781,7 @@ class Args:
                         '-u'
                     ],
                     'option': 'PACKAGE',
-                    'description': 'Update only the specified packages (separated by commas)'
+                    'description': 'Update only the specified packages (separated by commas, glob patterns like nginx* are allowed)'
                 },
                 {
                     'args': [
@@ -16,7 +16,7 @@ class Exit:
         my_app = App()
         my_mail = Mail()
 
-        # Remove all lock files
+        # Release all locks
         try:
             my_app.remove_locks()
         except Exception as e:
@@ -1,22 +1,100 @@
 # coding: utf-8
 
 # Import libraries
+import os
 import json
+import zlib
+import threading
 import requests
 from colorama import Fore, Style
 
-# Import classes
-from src.controllers.App.Utils import Utils
-
 class HttpRequest:
-    def __init__(self, verify_ssl: bool = True):
+    # Session shared by all the instances of the same thread, so that connections are kept alive and reused between requests
+    # (a session is not shared between threads, requests.Session is not thread-safe)
+    sessions = threading.local()
+
+    # Size of the chunks of downloaded files, and of the JSON chunks compressed at once
+    stream_chunk_size = 65536
+
+    def __init__(self, verify_ssl: bool = True, compress: bool = False):
         self.quiet = False
         self.verify_ssl = verify_ssl
 
+        # Compress request bodies (gzip), the server must support 'Content-Encoding: gzip' requests
+        self.compress = compress
+
         # If SSL verification is disabled, disable warnings
         if not self.verify_ssl:
             requests.packages.urllib3.disable_warnings()
 
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the session of the current thread, create it if needed
+    #   A forked process creates its own session, connections of the parent process must not be shared
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_session(self):
+        sessions = HttpRequest.sessions
+
+        if getattr(sessions, 'session', None) is None or sessions.pid != os.getpid():
+            session = requests.Session()
+
+            # Connection pool, a few connections per host are enough as requests are mostly sent to the reposerver
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 4, pool_maxsize = 8)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            sessions.session = session
+            sessions.pid = os.getpid()
+
+        return sessions.session
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Encode data to JSON request body, compressed if enabled
+    #   The body is returned as bytes so that it is sent with a Content-Length (some reverse proxies reject chunked requests)
+    #   When compressed, the JSON is compressed by chunks, without building the whole uncompressed JSON string in memory
+    #
+    #-----------------------------------------------------------------------------------------------
+    def encode_body(self, data) -> bytes:
+        if not self.compress:
+            return json.dumps(data).encode()
+
+        body = []
+        buffer = []
+        buffer_size = 0
+
+        # gzip format (wbits = 31)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        for chunk in json.JSONEncoder().iterencode(data):
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+
+            if buffer_size >= self.stream_chunk_size:
+                body.append(compressor.compress(''.join(buffer).encode()))
+                buffer = []
+                buffer_size = 0
+
+        body.append(compressor.compress(''.join(buffer).encode()))
+        body.append(compressor.flush())
+
+        return b''.join(body)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the headers of a request with a JSON body
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_body_headers(self, headers: dict) -> dict:
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+
+        return headers
+
     #-----------------------------------------------------------------------------------------------
     #
     #   GET request
@@ -25,12 +103,12 @@ class HttpRequest:
     def get(self, url: str, id: str, token: str, connectionTimeout: int = 5, readTimeout: int = 3):
         # If an Id and a token are provided, add them to the URL
         if id != "" and token != "":
-            response = requests.get(url,
-                                    headers = {'Authorization': 'Host ' + id + ':' + token},
-                                    timeout = (connectionTimeout, readTimeout),
-                                    verify = self.verify_ssl)
+            response = self.get_session().get(url,
+                                              headers = {'Authorization': 'Host ' + id + ':' + token},
+                                              timeout = (connectionTimeout, readTimeout),
+                                              verify = self.verify_ssl)
         else:
-            response = requests.get(url, timeout = (connectionTimeout, readTimeout), verify = self.verify_ssl)
+            response = self.get_session().get(url, timeout = (connectionTimeout, readTimeout), verify = self.verify_ssl)
 
         # Parse response and return results if 200
         return self.request_parse_result(response)
@@ -43,11 +121,11 @@ class HttpRequest:
     #-----------------------------------------------------------------------------------------------
     def post_token(self, url: str, apiKey: str, data, connectionTimeout: int = 5, readTimeout: int = 3):
         # Send POST request to URL with API key
-        response = requests.post(url,
-                                 data = json.dumps(data),
-                                 headers = {'Authorization': 'Bearer ' + apiKey, 'Content-Type': 'application/json'},
-                                 timeout = (connectionTimeout, readTimeout),
-                                 verify = self.verify_ssl)
+        response = self.get_session().post(url,
+                                           data = self.encode_body(data),
+                                           headers = self.get_body_headers({'Authorization': 'Bearer ' + apiKey, 'Content-Type': 'application/json'}),
+                                           timeout = (connectionTimeout, readTimeout),
+                                           verify = self.verify_ssl)
 
         del data, apiKey, url
 
@@ -62,11 +140,11 @@ class HttpRequest:
     def put(self, url: str, id: str, token: str, data, connectionTimeout: int = 5, readTimeout: int = 3):
         # Send PUT request to URL with Id and token
 
-        response = requests.put(url,
-                                data = json.dumps(data),
-                                headers = {'Authorization': 'Host ' + id + ':' + token},
-                                timeout = (connectionTimeout, readTimeout),
-                                verify = self.verify_ssl)
+        response = self.get_session().put(url,
+                                          data = self.encode_body(data),
+                                          headers = self.get_body_headers({'Authorization': 'Host ' + id + ':' + token}),
+                                          timeout = (connectionTimeout, readTimeout),
+                                          verify = self.verify_ssl)
 
         del data, id, token, url
 
@@ -81,10 +159,10 @@ class HttpRequest:
     #-----------------------------------------------------------------------------------------------
     def delete(self, url: str, id: str, token: str, connectionTimeout: int = 5, readTimeout: int = 3):
         # Send DELETE request to URL with Id and token
-        response = requests.delete(url,
-                                   headers = {'Authorization': 'Host ' + id + ':' + token},
-                                   timeout = (connectionTimeout, readTimeout),
-                                   verify = self.verify_ssl)
+        response = self.get_session().delete(url,
+                                             headers = {'Authorization': 'Host ' + id + ':' + token},
+                                             timeout = (connectionTimeout, readTimeout),
+                                             verify = self.verify_ssl)
 
         del id, token, url
 
@@ -99,14 +177,22 @@ class HttpRequest:
     #-----------------------------------------------------------------------------------------------
     def download(self, url: str, path: str, connectionTimeout: int = 5, readTimeout: int = 3):
         # Send GET request to URL
-        response = requests.get(url, timeout = (connectionTimeout, readTimeout), verify = self.verify_ssl)
+        response = self.get_session().get(url, timeout = (connectionTimeout, readTimeout), verify = self.verify_ssl, stream = True)
 
-        # Parse response and return results if 200
-        self.request_parse_result(response)
+        # Check is response is OK (200), the content is not parsed as it is a file
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            response.close()
+            raise Exception('HTTP request error: ' + str(e))
 
-        # Write content to file
-        with open(path, 'wb') as file:
-            file.write(response.content)
+        # Write content to file by chunks
+        try:
+            with open(path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size = self.stream_chunk_size):
+                    file.write(chunk)
+        finally:
+            response.close()
 
         del path, url, response
 
@@ -117,7 +203,14 @@ class HttpRequest:
     #
     #-----------------------------------------------------------------------------------------------
     def request_parse_result(self, response):
-        myUtils = Utils()
+        # Decode the JSON response once (None if the response is not a JSON object)
+        try:
+            content = response.json()
+        except ValueError:
+            content = None
+
+        if not isinstance(content, dict):
+            content = None
 
         # Check is response is OK (200)
         try:
@@ -126,20 +219,20 @@ class HttpRequest:
             # Print response message if not quiet
             if not self.quiet:
                 # If response is a JSON with a 'message' key, then print it
-                if myUtils.is_json(response.text) and 'message' in response.json():
-                    for message in response.json()['message']:
+                if content is not None and 'message' in content:
+                    for message in content['message']:
                         print('  ' + Fore.GREEN + '✔' + Style.RESET_ALL + ' ' + message)
 
             # If response is a JSON with a 'results' key, return it
-            if myUtils.is_json(response.text) and 'results' in response.json():
-                return response.json()['results']
+            if content is not None and 'results' in content:
+                return content['results']
 
             # Else return response
             return response
         except requests.exceptions.HTTPError as e:
             # If response is a JSON with a 'message_error' key, return it
-            if myUtils.is_json(response.text) and 'message_error' in response.json():
-                for message in response.json()['message_error']:
+            if content is not None and 'message_error' in content:
+                for message in content['message_error']:
                     print('  ' + Fore.YELLOW + '✕' + Style.RESET_ALL + ' ' + message)
                     raise Exception()
             else:
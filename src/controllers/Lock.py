@@ -0,0 +1,424 @@
+# coding: utf-8
+
+# Import libraries
+import os
+import fcntl
+import time
+import threading
+import select
+
+# Locks held by the current process (lock file => file descriptor and stack of held modes of each holder thread)
+# A lock file is opened only once per process, flock locks are attached to the open file: the threads of the process
+# share the same flock, so they are also synchronized between themselves (shared holders or a single exclusive holder)
+held_locks = {}
+
+# Protects the above registry, threads wait on the condition for another thread to release a lock
+# The mutex is never held while waiting for the flock
+held_locks_mutex = threading.Lock()
+held_locks_condition = threading.Condition(held_locks_mutex)
+
+class Lock:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Lock based on flock(), shared (readers) or exclusive (writers)
+    #   A flock lock is released by the kernel when its holder exits, so a crashed process never leaves a stale lock
+    #   behind: the lock file itself can stay on disk, only the flock on it matters
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, lock_file: str, exclusive: bool = True, timeout: int = 60):
+        self.lock_file = lock_file
+        self.exclusive = exclusive
+        self.timeout = timeout
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Acquire the lock, wait for it to be released by other processes if needed
+    #   Mode and timeout default to the ones given to the constructor, a timeout of None there means waiting forever
+    #
+    #-----------------------------------------------------------------------------------------------
+    def acquire(self, exclusive: bool = None, timeout: int = None):
+        if exclusive is None:
+            exclusive = self.exclusive
+
+        if timeout is None:
+            timeout = self.timeout
+
+        mode = 'exclusive' if exclusive else 'shared'
+        thread_id = threading.get_ident()
+        start_time = time.time()
+
+        with held_locks_condition:
+            # Wait for the other threads of the process: a shared lock waits for an exclusive holder, an exclusive lock
+            # waits for all the other holders. A thread already holding the lock gets it again if no other thread conflicts
+            while True:
+                held = held_locks.setdefault(self.lock_file, {'fd': None, 'holders': {}, 'busy': False})
+                other_modes = [held_mode for holder, modes in held['holders'].items() if holder != thread_id for held_mode in modes]
+
+                if not held['busy'] and (len(other_modes) == 0 or (not exclusive and 'exclusive' not in other_modes)):
+                    break
+
+                remaining = None if timeout is None else timeout - (time.time() - start_time)
+
+                if remaining is not None and remaining <= 0:
+                    raise Exception('could not acquire lock ' + self.lock_file + ' within ' + str(timeout) + ' seconds (held by another thread of this process)')
+
+                held_locks_condition.wait(remaining)
+
+            # The process already holds the flock in a sufficient mode, only count it
+            held_modes = [held_mode for modes in held['holders'].values() for held_mode in modes]
+
+            if held['fd'] is not None and ('exclusive' in held_modes or not exclusive):
+                held['holders'].setdefault(thread_id, []).append(mode)
+                return
+
+            # Other threads wait until the flock is acquired (or not)
+            held['busy'] = True
+
+        fd = held['fd']
+
+        try:
+            if fd is None:
+                try:
+                    fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+                except Exception as e:
+                    raise Exception('could not open lock file ' + self.lock_file + ': ' + str(e))
+
+            # If the thread already holds the lock (shared, upgraded to exclusive), it keeps holding it on timeout
+            self.wait(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, None if timeout is None else timeout - (time.time() - start_time), held['fd'] is not None)
+
+        except Exception:
+            with held_locks_condition:
+                held['busy'] = False
+
+                if len(held['holders']) == 0:
+                    if fd is not None:
+                        os.close(fd)
+                    del held_locks[self.lock_file]
+
+                held_locks_condition.notify_all()
+            raise
+
+        with held_locks_condition:
+            held['fd'] = fd
+            held['holders'].setdefault(thread_id, []).append(mode)
+            held['busy'] = False
+            held_locks_condition.notify_all()
+
+        # Write the PID of the holder in the lock file (only an exclusive holder can own the content)
+        if exclusive:
+            try:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, (str(os.getpid()) + '\n').encode(), 0)
+            except OSError:
+                pass
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Wait for the flock to be acquired, the thread sleeps in a blocking flock() until the lock is released
+    #   With a timeout, the blocking flock() is done by a helper thread on a duplicate of the file descriptor (same open
+    #   file, so the lock is acquired on fd). If the timeout expires, the helper keeps waiting and gives the lock back as
+    #   soon as it gets it (by closing its duplicate, or by restoring the shared lock still held by the caller)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def wait(self, fd: int, operation: int, timeout: int, keep_shared: bool = False):
+        # Most of the time the lock is free
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            raise Exception('could not acquire lock ' + self.lock_file + ': ' + str(e))
+
+        if timeout is None:
+            try:
+                fcntl.flock(fd, operation)
+                return
+            except OSError as e:
+                raise Exception('could not acquire lock ' + self.lock_file + ': ' + str(e))
+
+        state = {'acquired': False, 'abandoned': False, 'error': None}
+        state_mutex = threading.Lock()
+        helper_fd = os.dup(fd)
+
+        def helper():
+            try:
+                fcntl.flock(helper_fd, operation)
+
+                with state_mutex:
+                    if not state['abandoned']:
+                        state['acquired'] = True
+
+                    # The caller has given up, it only holds the shared lock it had before (if any)
+                    elif keep_shared:
+                        fcntl.flock(helper_fd, fcntl.LOCK_SH)
+            except OSError as e:
+                with state_mutex:
+                    state['error'] = e
+            finally:
+                os.close(helper_fd)
+
+        thread = threading.Thread(target = helper, daemon = True)
+        thread.start()
+        thread.join(max(timeout, 0))
+
+        with state_mutex:
+            if state['acquired']:
+                return
+
+            if state['error'] is not None:
+                raise Exception('could not acquire lock ' + self.lock_file + ': ' + str(state['error']))
+
+            state['abandoned'] = True
+
+        raise Exception('could not acquire lock ' + self.lock_file + ' within ' + str(timeout) + ' seconds' + self.get_holders_message())
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Release the lock (once per acquire), the flock is released when the last acquire is released
+    #   Only the thread holding the lock can release it
+    #
+    #-----------------------------------------------------------------------------------------------
+    def release(self):
+        thread_id = threading.get_ident()
+
+        with held_locks_condition:
+            held = held_locks.get(self.lock_file)
+
+            if held is None or thread_id not in held['holders']:
+                return
+
+            held['holders'][thread_id].pop()
+
+            if len(held['holders'][thread_id]) == 0:
+                del held['holders'][thread_id]
+
+            held_modes = [held_mode for modes in held['holders'].values() for held_mode in modes]
+
+            try:
+                # Still held by the process, downgrade the flock to shared if there is no exclusive acquire left
+                if len(held_modes) > 0:
+                    if 'exclusive' not in held_modes:
+                        fcntl.flock(held['fd'], fcntl.LOCK_SH)
+
+                # Another thread is acquiring the flock, it is now in charge of the file descriptor
+                elif not held['busy']:
+                    try:
+                        fcntl.flock(held['fd'], fcntl.LOCK_UN)
+                    finally:
+                        os.close(held['fd'])
+                        del held_locks[self.lock_file]
+            finally:
+                held_locks_condition.notify_all()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the lock is exclusively held (by another process, or by a thread of this process)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_locked(self) -> bool:
+        with held_locks_mutex:
+            if self.lock_file in held_locks:
+                return any('exclusive' in modes for modes in held_locks[self.lock_file]['holders'].values())
+
+        try:
+            fd = os.open(self.lock_file, os.O_RDONLY | os.O_NOFOLLOW)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return False
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the PIDs of the processes holding a flock on the lock file
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_holders(self) -> list:
+        holders = []
+        locks = get_file_locks(self.lock_file)
+
+        if locks is not None:
+            for lock_type, pid in locks:
+                if lock_type == 'FLOCK' and pid > 0:
+                    holders.append(pid)
+
+        # If /proc/locks is not readable, fallback to the PID written in the lock file by the last exclusive holder
+        else:
+            try:
+                with open(self.lock_file, 'r') as file:
+                    pid = file.read().strip()
+
+                if pid.isnumeric() and os.path.isdir('/proc/' + pid):
+                    holders.append(int(pid))
+            except OSError:
+                pass
+
+        return holders
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return a message listing the processes holding the lock, for error messages
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_holders_message(self) -> str:
+        holders = self.get_holders()
+
+        if len(holders) == 0:
+            return ''
+
+        return ' (held by PID ' + ', '.join(str(pid) for pid in holders) + ')'
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Release all the locks held by the current process
+#
+#-----------------------------------------------------------------------------------------------
+def release_all_locks():
+    with held_locks_condition:
+        for lock_file in list(held_locks.keys()):
+            held = held_locks.pop(lock_file)
+
+            if held['fd'] is None:
+                continue
+
+            try:
+                fcntl.flock(held['fd'], fcntl.LOCK_UN)
+                os.close(held['fd'])
+            except OSError:
+                pass
+
+        held_locks_condition.notify_all()
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Return the locks held on a file as a list of (type, pid), read from /proc/locks
+#   e.g. '1: POSIX  ADVISORY  WRITE 1234 08:01:1311746 0 EOF' => ('POSIX', 1234)
+#   Type is FLOCK, POSIX or OFDLCK, PID is -1 for OFD locks. Return None if /proc/locks cannot be read
+#
+#-----------------------------------------------------------------------------------------------
+def get_file_locks(file: str):
+    locks = []
+
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return locks
+
+    device = '%02x:%02x:%d' % (os.major(stat.st_dev), os.minor(stat.st_dev), stat.st_ino)
+
+    try:
+        with open('/proc/locks', 'r') as proc_locks:
+            for line in proc_locks:
+                fields = line.split()
+
+                # Skip blocked lock requests ('1: -> POSIX ...'), they are not holding the lock
+                if len(fields) < 6 or fields[1] == '->':
+                    continue
+
+                if fields[5] != device:
+                    continue
+
+                try:
+                    locks.append((fields[1], int(fields[4])))
+                except ValueError:
+                    continue
+    except OSError:
+        return None
+
+    return locks
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Return the name of a process (e.g. 'unattended-upgr'), or an empty string if it does not exist anymore
+#
+#-----------------------------------------------------------------------------------------------
+def get_process_name(pid: int) -> str:
+    try:
+        with open('/proc/' + str(pid) + '/comm', 'r') as file:
+            return file.read().strip()
+    except OSError:
+        return ''
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Return True if a process is running (zombie processes are considered as exited)
+#
+#-----------------------------------------------------------------------------------------------
+def is_process_running(pid: int) -> bool:
+    try:
+        with open('/proc/' + str(pid) + '/stat', 'r') as file:
+            # e.g. '1234 (dnf) S 1 ...', state is the field following the process name
+            state = file.read().rsplit(')', 1)[1].split()[0]
+    except (OSError, IndexError):
+        return False
+
+    return state not in ['Z', 'X']
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Wait for a process to exit, at most timeout seconds. Return True if the process has exited
+#   Use a pidfd when available (Python 3.9+, Linux 5.3+) to be woken up as soon as the process exits
+#
+#-----------------------------------------------------------------------------------------------
+def wait_for_process_exit(pid: int, timeout: float) -> bool:
+    if not is_process_running(pid):
+        return True
+
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            pidfd = None
+
+        if pidfd is not None:
+            try:
+                poller = select.poll()
+                poller.register(pidfd, select.POLLIN)
+                poller.poll(max(timeout, 0) * 1000)
+            finally:
+                os.close(pidfd)
+
+            return not is_process_running(pid)
+
+    # Fallback to polling
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+
+    while time.monotonic() < deadline:
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+
+        if not is_process_running(pid):
+            return True
+
+        delay = min(delay * 2, 0.5)
+
+    return False
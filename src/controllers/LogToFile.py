@@ -2,20 +2,56 @@
 
 import traceback
 import sys
+import threading
 
 # https://stackoverflow.com/a/57008553
 
+# Log files opened by each thread (a LogToFile can be nested in another one)
+local = threading.local()
+stdout_mutex = threading.Lock()
+
+# Replacement of sys.stdout that writes to the current log file of the calling thread, or to the real stdout
+# This allows several threads to log to their own file at the same time (e.g. reposerver agent requests)
+class ThreadStdout(object):
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def get_target(self):
+        stack = getattr(local, 'stack', None)
+
+        if stack:
+            return stack[-1]
+
+        return self.stdout
+
+    def write(self, data):
+        return self.get_target().write(data)
+
+    def flush(self):
+        self.get_target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
 # Context manager that copies stdout and any exceptions to a log file
 class LogToFile(object):
     def __init__(self, filename):
         self.file = open(filename, 'w')
-        self.stdout = sys.stdout
 
     def __enter__(self):
-        sys.stdout = self
+        with stdout_mutex:
+            if not isinstance(sys.stdout, ThreadStdout):
+                sys.stdout = ThreadStdout(sys.stdout)
+
+        if not hasattr(local, 'stack'):
+            local.stack = []
+
+        # Output is also written to the enclosing log file of the thread, if any
+        self.stdout = sys.stdout.get_target()
+        local.stack.append(self)
 
     def __exit__(self, exc_type, exc_value, tb):
-        sys.stdout = self.stdout
+        local.stack.remove(self)
         if exc_type is not None:
             self.file.write(traceback.format_exc())
         self.file.close()
@@ -31,4 +67,3 @@ class LogToFile(object):
 
     def getContent(self):
         return self.stdout
-        
\ No newline at end of file
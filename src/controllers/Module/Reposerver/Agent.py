@@ -2,10 +2,11 @@
 
 # Import libraries
 import sys
-import os
 import time
 import threading
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from shutil import rmtree
 import pyinotify
@@ -13,12 +14,15 @@ import websocket
 
 # Import classes
 from src.controllers.LogToFile import LogToFile
+from src.controllers.Lock import Lock
 from src.controllers.Module.Module import Module
 from src.controllers.Module.Reposerver.Status import Status
 from src.controllers.Module.Reposerver.Config import Config
+from src.controllers.Module.Reposerver.Outbox import Outbox
+from src.controllers.Module.Reposerver.RequestExecutor import RequestExecutor
 from src.controllers.Package.Package import Package
 from src.controllers.App.Utils import Utils
-from src.controllers.App.Trigger import Trigger
+from src.controllers.App.Trigger import Trigger, TRIGGER_DIR
 
 class Agent:
     def __init__(self):
@@ -26,10 +30,17 @@ class Agent:
         self.configController = Config()
         self.reposerverStatusController = Status()
         self.packageController = Package()
+        self.outboxController = Outbox()
 
         # Set default values
         self.authenticated = False
 
+        # Requests modifying packages or configuration, executed one at a time (other requests are read-only)
+        self.exclusive_requests = ['request-all-packages-update', 'request-packages-update', 'update-profile']
+
+        # Read-only requests querying the package manager, they cannot run during an exclusive request
+        self.packages_requests = ['request-packages-infos']
+
         # Root directory for the requests logs
         self.request_dir = '/opt/linupdate/tmp/reposerver/requests'
 
@@ -89,7 +100,7 @@ class Agent:
     #-----------------------------------------------------------------------------------------------
     def on_inotify_change(self, ev):
         # If an update is running by linupdate, then do nothing for now
-        if Path('/tmp/linupdate.update-running.lock').is_file():
+        if Lock('/tmp/linupdate.update-running.lock').is_locked():
             return
 
         # Message for debugging
@@ -99,28 +110,92 @@ class Agent:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Run inotify process to scan for package events
+    #   Wake up the trigger processing when a trigger file is created (by the agent or by another linupdate process)
     #
     #-----------------------------------------------------------------------------------------------
-    def run_inotify_package_event(self):
+    def on_trigger_change(self, ev):
+        if ev.name == 'package-info':
+            self.trigger_event.set()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Check the configuration again when a configuration file is modified
+    #
+    #-----------------------------------------------------------------------------------------------
+    def on_config_change(self, ev):
+        if ev.name in ['linupdate.yml', 'reposerver.yml']:
+            self.loop.call_soon(self.apply_configuration)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Start inotify monitoring of package events, trigger files and configuration files
+    #   Events are read from the inotify file descriptor by the event loop, no thread is needed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def start_inotify(self):
         print('[reposerver-agent] Starting package event monitoring from ' + self.log_file)
 
         try:
-            # Set inotify process as running to prevent multiple processes from running
-            self.inotify_is_running = True
-            self.last_inotify_event_time = None
+            self.watch_manager = pyinotify.WatchManager()
 
-            watch_manager = pyinotify.WatchManager()
             # quiet=False => raise Exception
-            watch_manager.add_watch(self.log_file, pyinotify.IN_CLOSE_WRITE, self.on_inotify_change, quiet=False)
-            notifier = pyinotify.Notifier(watch_manager)
-            notifier.loop()
+            self.watch_manager.add_watch(self.log_file, pyinotify.IN_CLOSE_WRITE, self.on_inotify_change, quiet=False)
+
+            # Only the trigger files directory is watched, so that other temporary files do not wake up the agent
+            Path(TRIGGER_DIR).mkdir(parents=True, exist_ok=True)
+            self.watch_manager.add_watch(TRIGGER_DIR, pyinotify.IN_CREATE, self.on_trigger_change, quiet=False)
+
+            # Configuration files can be replaced (e.g. by an editor), watch their directory
+            for config_dir in ['/etc/linupdate', '/etc/linupdate/modules']:
+                if Path(config_dir).is_dir():
+                    self.watch_manager.add_watch(config_dir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO, self.on_config_change, quiet=False)
+
+            self.notifier = pyinotify.Notifier(self.watch_manager)
+            self.loop.add_reader(self.watch_manager.get_fd(), self.read_inotify_events)
 
-        # If an exception is raised, then set inotify process as not running and store the exception to
-        # be read by the main function (cannot raise an exception to be read by the main function, it does not work, so store it instead)
         except (pyinotify.WatchManagerError, Exception) as e:
-            self.inotify_is_running = False
-            self.inotify_exception = str(e)
+            raise Exception('package event monitoring failed: ' + str(e))
+
+
+    def read_inotify_events(self):
+        self.notifier.read_events()
+        self.notifier.process_events()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Check the configuration and start the websocket connection if agent listening is enabled
+    #
+    #-----------------------------------------------------------------------------------------------
+    def apply_configuration(self):
+        # Checking that all the necessary elements are present for the agent execution (quit if not)
+        self.run_general_checks()
+
+        # If agent listening is enabled, open websocket
+        if self.configuration['agent']['listen']['enabled'] and not self.websocket_is_running:
+            self.websocket_is_running = True
+            self.start_task(self.run_websocket())
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Start a task on the event loop, the agent stops if the task fails
+    #
+    #-----------------------------------------------------------------------------------------------
+    def start_task(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        task.add_done_callback(self.on_task_done)
+        self.tasks.append(task)
+
+
+    def on_task_done(self, task):
+        if task.cancelled() or self.stopped.done():
+            return
+
+        if task.exception() is not None:
+            self.stopped.set_exception(task.exception())
 
 
     #-----------------------------------------------------------------------------------------------
@@ -144,15 +219,15 @@ class Agent:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Send remaining requests logs to the reposerver
+    #   Queue the responses of the requests that were interrupted (e.g. the agent has been stopped while processing them)
+    #   or whose response was not queued by a previous version of the agent
+    #   Executed once when the agent starts
     #
     #-----------------------------------------------------------------------------------------------
-    def send_remaining_requests_logs(self):
-        try:
-            # Quit if not authenticated to the reposerver
-            if not self.authenticated:
-                return
+    def queue_interrupted_requests(self):
+        requests_dirs = []
 
+        try:
             # Get all requests logs directories
             requests_dirs = Path(self.request_dir).iterdir()
 
@@ -171,10 +246,6 @@ class Agent:
                     if not request_dir.is_dir():
                         continue
 
-                    # Only process directories with a creation time older than 5 minutes
-                    if time.time() - os.path.getmtime(request_dir) < 300:
-                        continue
-
                     # If the directory is empty, then delete it
                     if not any(request_dir.iterdir()):
                         rmtree(request_dir)
@@ -224,9 +295,9 @@ class Agent:
                     if logcontent:
                         json_response['response-to-request']['log'] = logcontent
 
-                    # Send the response
-                    print('[reposerver-agent] Sending remaining requests logs for request id #' + request_id + ' with status: ' + status)
-                    self.websocket.send(json.dumps(json_response))
+                    # Queue the response, it will be sent once authenticated to the reposerver
+                    print('[reposerver-agent] Queuing remaining requests logs for request id #' + request_id + ' with status: ' + status)
+                    self.outboxController.put('websocket', 'response-to-request', json_response, 'request-' + request_id)
 
                     # Delete the directory and all its content
                     if Path(self.request_dir + '/' + request_id).is_dir():
@@ -234,7 +305,7 @@ class Agent:
 
                     del status, summary, error, logcontent, request_id, json_response
                 except Exception as e:
-                    raise Exception('could not send remaining requests logs for request id #' + request_id + ': ' + str(e))
+                    raise Exception('could not queue remaining requests logs for request id #' + request_id + ': ' + str(e))
 
         except Exception as e:
             print('[reposerver-agent] Error: ' + str(e))
@@ -242,6 +313,43 @@ class Agent:
         del requests_dirs
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send the requests responses waiting in the outbox to the reposerver
+    #   A response stays in the outbox until the reposerver acknowledges it ('Request response received'), it is sent
+    #   again with an increasing delay meanwhile
+    #
+    #-----------------------------------------------------------------------------------------------
+    def send_outbox_responses(self):
+        try:
+            # Quit if not authenticated to the reposerver
+            if not self.authenticated:
+                return
+
+            for entry in self.outboxController.get_due('websocket'):
+                try:
+                    json_response = self.outboxController.read(entry['id'])
+                except Exception as e:
+                    # Keep the response, it is read again later
+                    self.outboxController.retry_later(entry['id'], pause_kind = False)
+                    print('[reposerver-agent] Error: ' + str(e))
+                    continue
+
+                # Already acknowledged or superseded meanwhile
+                if json_response is None:
+                    continue
+
+                print('[reposerver-agent] Sending response for request id #' + str(json_response['response-to-request'].get('request-id', '')) + ' again')
+
+                self.websocket.send(json.dumps(json_response))
+                self.outboxController.retry_later(entry['id'], pause_kind = False)
+
+                del json_response
+
+        except Exception as e:
+            print('[reposerver-agent] Error: ' + str(e))
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   On message received from the websocket
@@ -260,14 +368,12 @@ class Agent:
         keep_oldconf = True
         full_upgrade = False
 
-        # Decode JSON message
-        message = json.loads(message)
-
         # Default log file path, could be overwritten if request id is present
         log = '/opt/linupdate/tmp/reposerver/requests/log'
 
         # Lock to prevent service restart while processing the request
-        lock = '/tmp/linupdate.reposerver.request.lock'
+        # Shared, as several requests can be processed at the same time, the service takes it exclusively to restart
+        lock = Lock('/tmp/linupdate.reposerver.request.lock', exclusive = False, timeout = None)
 
         # Default json response
         json_response = {
@@ -280,9 +386,8 @@ class Agent:
         }
 
         try:
-            # Create a lock file to prevent service restart while processing the request
-            if not Path(lock).is_file():
-                Path(lock).touch()
+            # Acquire the lock to prevent service restart while processing the request
+            lock.acquire()
 
             # If the message contains 'request'
             if 'request' in message:
@@ -295,11 +400,8 @@ class Agent:
                         if not Path(self.request_dir + '/' + request_id).is_dir():
                             Path(self.request_dir + '/' + request_id).mkdir(parents=True, exist_ok=True)
 
-                        # Set new log files path for the request id
-                        log         = self.request_dir + '/' + request_id + '/log'
-                        log_status  = self.request_dir + '/' + request_id + '/status'
-                        log_error   = self.request_dir + '/' + request_id + '/error'
-                        log_summary = self.request_dir + '/' + request_id + '/summary'
+                        # Set new log file path for the request id
+                        log = self.request_dir + '/' + request_id + '/log'
 
                     # Case the request is 'authenticate', then authenticate to the reposerver
                     if message['request'] == 'authenticate':
@@ -325,12 +427,19 @@ class Agent:
                     elif message['request'] == 'request-packages-infos':
                         print('[reposerver-agent] Reposerver requested packages informations')
 
+                        # By default only the new history events are sent, unless the reposerver requests the full history
+                        full_history = False
+
+                        if 'data' in message:
+                            if 'full-history' in message['data']:
+                                full_history = Utils().stringToBoolean(str(message['data']['full-history']))
+
                         # Send a response to the reposerver to make the request as running
                         self.set_request_status(request_id, 'running')
 
                         # Log everything to the log file
                         with LogToFile(log):
-                            self.reposerverStatusController.send_packages_info()
+                            self.reposerverStatusController.send_packages_info(full_history)
 
                     # Case the request is 'request-all-packages-update', then update all packages
                     elif message['request'] == 'request-all-packages-update':
@@ -423,25 +532,7 @@ class Agent:
                 finally:
                     # If there was a request id, then send a response to reposerver to make the request as completed
                     if request_id:
-                        # First, save the log, status, summary and error to a file, in case the message cannot be sent
-                        # It will be sent later when the agent is running again
-                        if status:
-                            with open(log_status, 'w') as file:
-                                file.write(status)
-                            del file
-                        if summary:
-                            with open(log_summary, 'w') as file:
-                                # Convert summary to string to write it to the file
-                                json.dump(summary, file)
-                            del file
-                        if error:
-                            with open(log_error, 'w') as file:
-                                file.write(error)
-                            del file
-
-                        # Then try to send the response
-
-                        # Set request id
+                        # Set request id
                         json_response['response-to-request']['request-id'] = request_id
 
                         # Set status
@@ -470,10 +561,7 @@ class Agent:
 
                             del logcontent
 
-                        # Try to send the response to the reposerver
-                        # Note: impossible to use try/except here, because no exception is raised directly,
-                        # if there is an error then it is the on_error function that is called
-                        self.websocket.send(json.dumps(json_response))
+                        self.send_request_response(request_id, json_response)
 
             # If the message contains 'info'
             if 'info' in message:
@@ -483,32 +571,124 @@ class Agent:
                 if message['info'] == 'Authentication successful':
                     self.authenticated = True
 
-                # If the message is 'Request response received', then delete the remaining logs
+                # If the message is 'Request response received', then remove the response from the outbox
                 if message['info'] == 'Request response received':
                     # First retrieve the request id
                     if 'request-id' in message:
-                        request_id = message['request-id']
-
-                        # If the server has tell what kinf of data it has received, then delete the corresponding files if they exist
-                        if 'data' in message:
-                            for data in message['data']:
-                                if Path(self.request_dir + '/' + request_id + '/' + data).is_file():
-                                    Path(self.request_dir + '/' + request_id + '/' + data).unlink()
-                            del data
+                        request_id = str(message['request-id'])
+                        self.outboxController.ack_key('request-' + request_id)
 
             # If the message contains 'error'
             if 'error' in message:
                 print('[reposerver-agent] Received error message from reposerver: ' + message['error'])
 
             del request_id, summary, status, error, dry_run, ignore_exclusions, keep_oldconf, full_upgrade, message, log, json_response
-        # If all goes well or if an exception is raised, then delete the lock file
+        # If all goes well or if an exception is raised, then release the lock
         finally:
-            # Delete the lock file
-            if Path(lock).is_file():
-                Path(lock).unlink()
+            # Release the lock
+            lock.release()
             del lock
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send the final response of a request to the reposerver
+    #
+    #-----------------------------------------------------------------------------------------------
+    def send_request_response(self, request_id: str, json_response: dict):
+        # First, queue the response in the outbox, in case the message cannot be sent
+        # It is sent again later until the reposerver acknowledges it, even if the agent is restarted meanwhile
+        entry_id = self.outboxController.put('websocket', 'response-to-request', json_response, 'request-' + request_id)
+
+        # The log is now in the outbox
+        if Path(self.request_dir + '/' + request_id).is_dir():
+            rmtree(self.request_dir + '/' + request_id)
+
+        # Then try to send the response to the reposerver
+        # Note: impossible to use try/except here, because no exception is raised directly,
+        # if there is an error then it is the on_error function that is called
+        self.websocket.send(json.dumps(json_response))
+        self.outboxController.retry_later(entry_id, pause_kind = False)
+
+        # Wake up the outbox processing, to send the response again if it is not acknowledged
+        self.loop.call_soon_threadsafe(self.outbox_event.set)
+
+        del entry_id
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Dispatch a message received from the websocket
+    #   Requests with an id are executed by the request executor, the reposerver is immediately told if they are queued
+    #   Other messages (authentication, informations, cancellation) are quick to process
+    #   Returns a future if the message must be processed now
+    #
+    #-----------------------------------------------------------------------------------------------
+    def dispatch_websocket_message(self, message: dict):
+        if 'request' in message and message['request'] == 'cancel-request':
+            self.cancel_request(message)
+            return None
+
+        if 'request' not in message or 'request-id' not in message:
+            return self.loop.run_in_executor(None, self.websocket_on_message, self.websocket, message)
+
+        request_id = str(message['request-id'])
+
+        # The request has already been executed and its response is waiting to be acknowledged: do not execute it twice
+        if self.outboxController.has_key('request-' + request_id):
+            print('[reposerver-agent] Request id #' + request_id + ' has already been executed, its response will be sent again')
+            return None
+
+        exclusive = message['request'] in self.exclusive_requests
+        reads_packages = message['request'] in self.packages_requests
+        status = self.requestExecutor.submit(request_id, exclusive, reads_packages, self.websocket_on_message, self.websocket, message)
+
+        if status == 'duplicate':
+            print('[reposerver-agent] Request id #' + request_id + ' is already queued or running')
+
+        elif status == 'queued':
+            print('[reposerver-agent] Request id #' + request_id + ' (' + message['request'] + ') is queued')
+            self.set_request_status(request_id, 'queued')
+
+        elif status == 'rejected':
+            print('[reposerver-agent] Request id #' + request_id + ' (' + message['request'] + ') is rejected: too many requests queued')
+            self.send_request_response(request_id, {
+                'response-to-request': {
+                    'request-id': request_id,
+                    'status': 'failed',
+                    'error': 'too many requests queued on the host'
+                }
+            })
+
+        return None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Cancel a queued request, a running request cannot be cancelled
+    #
+    #-----------------------------------------------------------------------------------------------
+    def cancel_request(self, message: dict):
+        if 'data' not in message or 'request-id' not in message['data']:
+            print('[reposerver-agent] Error: no request id to cancel')
+            return
+
+        request_id = str(message['data']['request-id'])
+
+        if not self.requestExecutor.cancel(request_id):
+            print('[reposerver-agent] Request id #' + request_id + ' cannot be cancelled: it is not queued')
+            return
+
+        print('[reposerver-agent] Request id #' + request_id + ' cancelled')
+
+        self.send_request_response(request_id, {
+            'response-to-request': {
+                'request-id': request_id,
+                'status': 'canceled'
+            }
+        })
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   On error from the websocket
@@ -558,17 +738,15 @@ class Agent:
             # Replace http by ws, or https by wss
             reposerver_ws_url = self.configuration['reposerver']['url'].replace('http', 'ws').replace('https', 'wss')
 
-            # Set websocket process as running to prevent multiple processes from running
-            self.websocket_is_running = True
-
             # Set to True for debugging
             websocket.enableTrace(False)
 
             # Open websocket connection
             # Using lambda to pass arguments to the functions, this is necessary for older versions of python websocket
+            # Messages are passed to the event loop, to be processed one at a time outside of the websocket thread
             self.websocket = websocket.WebSocketApp(reposerver_ws_url + '/ws',
                             on_open=lambda ws: self.websocket_on_open(ws),
-                            on_message=lambda ws, message: self.websocket_on_message(ws, message),
+                            on_message=lambda ws, message: self.loop.call_soon_threadsafe(self.websocket_messages.put_nowait, message),
                             on_error=lambda ws, error: self.websocket_on_error(ws, error),
                             on_close=lambda ws, close_status_code, close_msg: self.websocket_on_close(ws, close_status_code, close_msg))
 
@@ -585,84 +763,227 @@ class Agent:
             self.websocket.run_forever()
 
         except KeyboardInterrupt as e:
-            self.websocket_is_running = False
             self.websocket_exception = str(e)
             self.authenticated = False
         except Exception as e:
-            self.websocket_is_running = False
             self.websocket_exception = str(e)
             self.authenticated = False
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Run the websocket client in a thread (the websocket library is blocking), and process its messages
+    #   The agent stops when the connection is closed, it is then restarted by linupdate service
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def run_websocket(self):
+        closed = self.loop.create_future()
+
+        def on_closed():
+            if not closed.done():
+                closed.set_result(None)
+
+        def run():
+            try:
+                self.websocket_client()
+            finally:
+                # The event loop may already be closed if the agent is stopping
+                try:
+                    self.loop.call_soon_threadsafe(on_closed)
+                except RuntimeError:
+                    pass
+
+        # Daemon thread, it must not prevent the agent from exiting
+        thread = threading.Thread(target = run)
+        thread.daemon = True
+        thread.start()
+
+        messages = self.loop.create_task(self.process_websocket_messages())
+
+        try:
+            await closed
+        finally:
+            messages.cancel()
+            self.websocket_is_running = False
+
+        if self.websocket_exception:
+            raise Exception('reposerver websocket connection failed: ' + self.websocket_exception)
+
+        raise Exception('reposerver websocket connection failed: connection closed')
+
+
+    async def process_websocket_messages(self):
+        while True:
+            message = await self.websocket_messages.get()
+
+            try:
+                future = self.dispatch_websocket_message(json.loads(message))
+
+                if future is not None:
+                    await future
+            except Exception as e:
+                print('[reposerver-agent] Error: ' + str(e))
+
+            # Responses may have been queued, or the agent may have just been authenticated
+            self.outbox_event.set()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Periodically send informations about this host to the reposerver (every hour)
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def periodic_refresh(self):
+        while True:
+            print('[reposerver-agent] Periodically sending informations about this host to the repomanager server')
+            await self.loop.run_in_executor(self.status_executor, self.reposerverStatusController.send_general_info)
+            await self.send_packages_info()
+            await asyncio.sleep(3600)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send packages informations, postponed until the end of a running request using the packages (e.g. update)
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def send_packages_info(self):
+        if self.requestExecutor.packages_lock.locked():
+            print('[reposerver-agent] A request is using the packages, packages informations will be sent when it is completed')
+
+        async with self.requestExecutor.packages_lock:
+            await self.loop.run_in_executor(self.status_executor, self.reposerverStatusController.send_packages_info)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send packages informations when triggered (package event, update made by linupdate...)
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def process_triggers(self):
+        while True:
+            await self.trigger_event.wait()
+            self.trigger_event.clear()
+
+            if not Trigger().exists('package-info'):
+                continue
+
+            # Remove the trigger before sending, so that an event occuring meanwhile triggers a new sending
+            Trigger().remove('package-info')
+
+            print('[reposerver-agent] Package informations triggered. Sending them to the reposerver')
+            await self.send_packages_info()
+
+            # Let the package manager finish its work if several events are generated in a row (e.g. multiple transactions)
+            await asyncio.sleep(5)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send the data and the requests responses waiting in the outbox, when their retry delay has expired
+    #   Sleep until the next retry, or until new data is queued
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def process_outbox(self):
+        while True:
+            self.outbox_event.clear()
+
+            await self.loop.run_in_executor(self.status_executor, self.reposerverStatusController.flush_outbox)
+
+            # If some requests responses were not acknowledged (because the reposerver was unavailable for eg), then send them again
+            if self.websocket_is_running:
+                await self.loop.run_in_executor(self.status_executor, self.send_outbox_responses)
+
+            next_attempts = [self.outboxController.get_next_attempt('http')]
+
+            if self.authenticated:
+                next_attempts.append(self.outboxController.get_next_attempt('websocket'))
+
+            next_attempts = [next_attempt for next_attempt in next_attempts if next_attempt is not None]
+
+            if len(next_attempts) > 0:
+                delay = min(max(min(next_attempts) - time.time(), 1), 3600)
+            else:
+                delay = 3600
+
+            try:
+                await asyncio.wait_for(self.outbox_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Reposerver agent event loop
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def run(self):
+        self.stopped = self.loop.create_future()
+        self.tasks = []
+        self.watch_manager = None
+        self.websocket_messages = asyncio.Queue()
+        self.trigger_event = asyncio.Event()
+        self.outbox_event = asyncio.Event()
+
+        # Requests modifying packages run in their own thread, read-only requests run in the status thread
+        self.requestExecutor = RequestExecutor(self.loop, self.request_executor, self.status_executor)
+
+        # Check the configuration and open the websocket if agent listening is enabled
+        self.apply_configuration()
+
+        # Queue the responses of the requests that were not completed by a previous agent
+        self.queue_interrupted_requests()
+
+        self.start_inotify()
+
+        # Process a trigger created while the agent was not running
+        if Trigger().exists('package-info'):
+            self.trigger_event.set()
+
+        self.start_task(self.periodic_refresh())
+        self.start_task(self.process_triggers())
+        self.start_task(self.process_outbox())
+
+        try:
+            # Run until a task fails
+            await self.stopped
+        finally:
+            if self.watch_manager is not None:
+                self.loop.remove_reader(self.watch_manager.get_fd())
+
+            # Queued requests will not be executed, running ones cannot be interrupted
+            self.requestExecutor.cancel_all()
+
+            for task in self.tasks:
+                task.cancel()
+
+            await asyncio.gather(*self.tasks, return_exceptions = True)
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Reposerver agent main function
     #
     #-----------------------------------------------------------------------------------------------
     def main(self):
-        counter = 0
-        self.delayed_processes = []
-        self.inotify_is_running = False
-        self.inotify_exception = None
+        self.websocket = None
         self.websocket_is_running = False
         self.websocket_exception = None
 
-        # Executing regular tasks
-        while True:
-            # Checking that all the necessary elements are present for the agent execution.
-            # This is checked every time in case that a configuration change has been made in the configuration file
-            self.run_general_checks()
-
-            # Regulary sending data to the Repomanager server (every hour)
-            # 3600 / 5sec (sleep 5) = 720
-            if counter == 0 or counter == 720:
-                # Sending full status
-                print('[reposerver-agent] Periodically sending informations about this host to the repomanager server')
-                self.reposerverStatusController.send_general_info()
-                self.reposerverStatusController.send_packages_info()
-
-                # Reset counter
-                counter = 0
-
-            # If no inotify process is running, then execute it in background
-            if not self.inotify_is_running:
-                try:
-                    # If there was an exception in the last inotify process, then raise it
-                    if self.inotify_exception:
-                        raise Exception(self.inotify_exception)
+        # Requests from the reposerver and status sendings are blocking, they are executed in their own thread, one at a time,
+        # so that a long request (e.g. packages update) does not delay read-only requests, periodic sendings nor the event loop
+        self.request_executor = ThreadPoolExecutor(max_workers = 1)
+        self.status_executor = ThreadPoolExecutor(max_workers = 1)
+
+        # Python 3.6 compatible (no asyncio.run)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self.run())
+        finally:
+            self.loop.close()
+
+            # Do not wait for a running request or sending, the agent is stopping
+            self.request_executor.shutdown(wait = False)
+            self.status_executor.shutdown(wait = False)
 
-                    thread = threading.Thread(target=self.run_inotify_package_event)
-                    thread.daemon = True
-                    thread.start()
-                except Exception as e:
-                    raise Exception('package event monitoring failed: ' + str(e))
-
-            # If agent listening is enabled, open websocket
-            if self.configuration['agent']['listen']['enabled']:
-                if not self.websocket_is_running:
-                    try:
-                        # If there was an exception in the last websocket process, then raise it
-                        if self.websocket_exception:
-                            raise Exception(self.websocket_exception)
-
-                        thread = threading.Thread(target=self.websocket_client)
-                        thread.daemon = True
-                        thread.start()
-                    except Exception as e:
-                        raise Exception('reposerver websocket connection failed: ' + str(e))
-
-                # If some requests logs were not sent (because the program crashed or the reposerver was unavailable for eg), then send them now
-                self.send_remaining_requests_logs()
-
-            # Trigger files
-            # If package-info has been triggered, then send it
-            if Trigger().exists('package-info'):
-                print('[reposerver-agent] Package informations triggered. Sending them to the reposerver')
-                self.reposerverStatusController.send_packages_info()
-                time.sleep(5)
-                Trigger().remove('package-info')
-
-            # Sleep 5 seconds before next loop
-            time.sleep(5)
-
-            counter+=1
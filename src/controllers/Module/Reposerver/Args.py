@@ -259,7 +259,7 @@ class Args:
                 # Send full status including general status, available packages status, installed packages status and full history
                 status = Status()
                 status.send_general_info()
-                status.send_packages_info()
+                status.send_packages_info(full_history = True)
                 self.exitController.clean_exit()
 
         # Catch exceptions
@@ -393,7 +393,7 @@ class Args:
                     'args': [
                         '--send-all-info',
                     ],
-                    'description': 'Send all of the previous informations to the reposerver'
+                    'description': 'Send all of the previous informations to the reposerver, including the full packages history'
                 },
                 {
                     'args': [
@@ -21,7 +21,7 @@ class Config:
         self.systemController = System()
         self.appConfigController = appConfig()
         self.packageController = Package()
-        self.httpRequestController = HttpRequest(self.get_verify_ssl())
+        self.httpRequestController = HttpRequest(self.get_verify_ssl(), self.get_compress_requests())
 
     #-----------------------------------------------------------------------------------------------
     #
@@ -198,6 +198,41 @@ class Config:
             configuration['client']['verify_ssl'] = True
             write_config = True
 
+        # If client.compress_requests is not set, default to False
+        if 'compress_requests' not in configuration['client']:
+            configuration['client']['compress_requests'] = False
+            write_config = True
+
+        # Check if client.compress_requests is set (True or False)
+        if configuration['client']['compress_requests'] not in [True, False]:
+            raise Exception('client.compress_requests key must be set to true or false')
+
+        # If client.packages_inventory is not set, default to packages lists being fully sent every time
+        if 'packages_inventory' not in configuration['client']:
+            configuration['client']['packages_inventory'] = {
+                'delta': False,
+                'full_sync_interval': 24
+            }
+            write_config = True
+
+        # If client.packages_inventory.delta is not set, default to False
+        if 'delta' not in configuration['client']['packages_inventory']:
+            configuration['client']['packages_inventory']['delta'] = False
+            write_config = True
+
+        # Check if client.packages_inventory.delta is set (True or False)
+        if configuration['client']['packages_inventory']['delta'] not in [True, False]:
+            raise Exception('client.packages_inventory.delta key must be set to true or false')
+
+        # If client.packages_inventory.full_sync_interval is not set, default to 24 hours
+        if 'full_sync_interval' not in configuration['client']['packages_inventory']:
+            configuration['client']['packages_inventory']['full_sync_interval'] = 24
+            write_config = True
+
+        # Check if client.packages_inventory.full_sync_interval is a positive integer
+        if not isinstance(configuration['client']['packages_inventory']['full_sync_interval'], int) or configuration['client']['packages_inventory']['full_sync_interval'] < 1:
+            raise Exception('client.packages_inventory.full_sync_interval key must be a positive integer')
+
         # If client.get_repos_from_reposerver.format is not set, then set it to legacy
         if 'format' not in configuration['client']['get_repos_from_reposerver']:
             configuration['client']['get_repos_from_reposerver']['format'] = 'legacy'
@@ -725,8 +760,8 @@ class Config:
             # Set file permissions
             Path(repo_file).chmod(0o660)
 
-        # Update package cache
-        self.packageController.update_cache()
+        # Update package cache (forced, as repositories have just been modified)
+        self.packageController.update_cache(force = True)
 
         print('[' + Fore.GREEN + ' OK ' + Style.RESET_ALL + ']')
 
@@ -794,6 +829,36 @@ class Config:
         return configuration['client']['verify_ssl']
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get compress_requests for reposerver client (gzip request bodies)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_compress_requests(self) -> bool:
+        configuration = self.get_conf()
+
+        # Default to False if not present
+        if 'compress_requests' not in configuration['client']:
+            return False
+
+        return configuration['client']['compress_requests']
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get packages inventory settings (only send the changes since the last sending, full resend interval in hours)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_packages_inventory(self) -> dict:
+        configuration = self.get_conf()
+
+        # Default to full lists if not present
+        if 'packages_inventory' not in configuration['client']:
+            return {'delta': False, 'full_sync_interval': 24}
+
+        return configuration['client']['packages_inventory']
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Set verify_ssl for reposerver client
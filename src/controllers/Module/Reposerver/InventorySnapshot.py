@@ -0,0 +1,111 @@
+# coding: utf-8
+
+# Import libraries
+import json
+import hashlib
+
+# Import classes
+from src.controllers.App.Utils import Utils
+
+class InventorySnapshot:
+    def __init__(self, name: str):
+        # The snapshot remembers the last packages list successfully sent to the reposerver
+        self.snapshot_file = Utils().get_state_file('reposerver-' + name + '.snapshot.json')
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the sha256 hash of a packages list
+    #   The list is sorted and serialized in a canonical way, so that the reposerver can compute the same hash
+    #   from the list it holds for the host
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_hash(self, packages: list) -> str:
+        entries = sorted(json.dumps(package, sort_keys = True, separators = (',', ':')) for package in packages)
+
+        return hashlib.sha256(('[' + ','.join(entries) + ']').encode()).hexdigest()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load the snapshot, return None if there is no snapshot yet (or if it is unreadable, meaning a full resend)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load(self):
+        return Utils().load_state_file(self.snapshot_file, ['last_full_sync', 'hash', 'packages'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the differences between the snapshot and the current packages list
+    #   A package whose single entry has changed (e.g. new version) is reported as changed, other entries are
+    #   reported as added or removed (e.g. a new kernel version installed alongside the current one)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_delta(self, snapshot: dict, packages: list) -> dict:
+        delta = {
+            'added': [],
+            'removed': [],
+            'changed': []
+        }
+
+        previous_by_name = {}
+        current_by_name = {}
+
+        for package in snapshot['packages']:
+            previous_by_name.setdefault(package['name'], []).append(package)
+
+        for package in packages:
+            current_by_name.setdefault(package['name'], []).append(package)
+
+        for name in sorted(set(previous_by_name) | set(current_by_name)):
+            previous = previous_by_name.get(name, [])
+            current = current_by_name.get(name, [])
+
+            if previous == current:
+                continue
+
+            if len(previous) == 1 and len(current) == 1:
+                delta['changed'].append(current[0])
+                continue
+
+            delta['added'] += [package for package in current if package not in previous]
+            delta['removed'] += [package for package in previous if package not in current]
+
+        return delta
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the packages list must be fully sent: no snapshot, or last full sync older than interval hours
+    #
+    #-----------------------------------------------------------------------------------------------
+    def full_sync_needed(self, snapshot: dict, interval: int) -> bool:
+        if snapshot is None:
+            return True
+
+        return Utils().is_expired(snapshot['last_full_sync'], interval * 3600)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save the snapshot after a successful sending
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save(self, packages: list, last_full_sync: float):
+        snapshot = {
+            'last_full_sync': last_full_sync,
+            'hash': self.get_hash(packages),
+            'packages': packages
+        }
+
+        Utils().save_state_file(self.snapshot_file, snapshot)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the snapshot, next sending will be a full resend
+    #
+    #-----------------------------------------------------------------------------------------------
+    def reset(self):
+        Utils().remove_state_file(self.snapshot_file)
@@ -0,0 +1,345 @@
+# coding: utf-8
+
+# Import libraries
+import os
+import json
+import time
+import random
+from contextlib import contextmanager
+from pathlib import Path
+
+# Import classes
+from src.controllers.Lock import Lock
+
+class Outbox:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Durable outbox for the data sent to the reposerver (HTTP uploads and websocket responses)
+    #   Payloads are appended to a spool file, an index lists the pending entries with their position in the spool
+    #   and their next attempt time. An entry is removed from the index once sent, the spool is compacted when most
+    #   of it is made of sent entries
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, outbox_dir: str = '/var/lib/linupdate/outbox', max_size: int = 50 * 1024 * 1024):
+        self.outbox_dir = outbox_dir
+        self.index_file = outbox_dir + '/index.json'
+        self.lock_file = outbox_dir + '/outbox.lock'
+        self.flush_lock_file = outbox_dir + '/flush.lock'
+
+        # Maximum size of the pending payloads, the oldest entries are dropped above it
+        self.max_size = max_size
+
+        # Delay before retrying a failed entry: doubled on each attempt (with jitter), up to 1 hour
+        self.backoff_base = 30
+        self.backoff_max = 3600
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Lock the outbox (threads of the process and other processes)
+    #
+    #-----------------------------------------------------------------------------------------------
+    @contextmanager
+    def locked(self):
+        Path(self.outbox_dir).mkdir(parents = True, exist_ok = True)
+
+        with Lock(self.lock_file, exclusive = True, timeout = 30):
+            yield
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Lock the outbox for sending, yield False if another thread or process is already sending
+    #
+    #-----------------------------------------------------------------------------------------------
+    @contextmanager
+    def flushing(self):
+        Path(self.outbox_dir).mkdir(parents = True, exist_ok = True)
+
+        lock = Lock(self.flush_lock_file, exclusive = True, timeout = 0)
+
+        try:
+            lock.acquire()
+        except Exception:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            lock.release()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load the index, start with an empty outbox if there is no index (or if it is unreadable)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load_index(self) -> dict:
+        index = None
+
+        if Path(self.index_file).is_file():
+            try:
+                with open(self.index_file, 'r') as file:
+                    index = json.load(file)
+            except Exception:
+                index = None
+
+        if not isinstance(index, dict) or 'spool' not in index or 'entries' not in index:
+            index = {
+                'spool': 'spool.0',
+                'next_id': 1,
+                'entries': [],
+                'paused_until': {}
+            }
+
+        return index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save the index (atomic write)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save_index(self, index: dict):
+        try:
+            with open(self.index_file + '.tmp', 'w') as file:
+                json.dump(index, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(self.index_file + '.tmp', self.index_file)
+        except Exception as e:
+            raise Exception('could not save outbox index ' + self.index_file + ': ' + str(e))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Add a payload to the outbox, return the entry id
+    #   kind is the way the payload is sent ('http' or 'websocket'), target is where it is sent (e.g. API route)
+    #   If a key is provided, a pending entry with the same key is superseded by the new one (e.g. a newer packages list)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def put(self, kind: str, target: str, payload, key: str = None) -> int:
+        record = (json.dumps(payload) + '\n').encode()
+
+        with self.locked():
+            index = self.load_index()
+            spool_file = self.outbox_dir + '/' + index['spool']
+
+            # Append the payload to the spool
+            try:
+                with open(spool_file, 'ab') as file:
+                    offset = file.tell()
+                    file.write(record)
+                    file.flush()
+                    os.fsync(file.fileno())
+            except Exception as e:
+                raise Exception('could not write to outbox spool ' + spool_file + ': ' + str(e))
+
+            # Remove the superseded entry
+            if key is not None:
+                index['entries'] = [entry for entry in index['entries'] if entry['key'] != key]
+
+            entry_id = index['next_id']
+            index['next_id'] += 1
+
+            index['entries'].append({
+                'id': entry_id,
+                'kind': kind,
+                'target': target,
+                'key': key,
+                'offset': offset,
+                'length': len(record),
+                'created': time.time(),
+                'attempts': 0,
+                'next_attempt': 0
+            })
+
+            # Keep the outbox within its disk budget, drop the oldest entries
+            while len(index['entries']) > 1 and sum(entry['length'] for entry in index['entries']) > self.max_size:
+                dropped = index['entries'].pop(0)
+                print('[reposerver-agent] Outbox is full, dropping ' + dropped['kind'] + ' entry #' + str(dropped['id']) + ' (' + dropped['target'] + ')')
+
+            self.compact(index)
+            self.save_index(index)
+
+        return entry_id
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the entries of a kind that are due for sending, oldest first
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_due(self, kind: str) -> list:
+        now = time.time()
+
+        with self.locked():
+            index = self.load_index()
+
+        # Sending of this kind is paused (reposerver unavailable)
+        if index['paused_until'].get(kind, 0) > now:
+            return []
+
+        return [entry for entry in index['entries'] if entry['kind'] == kind and entry['next_attempt'] <= now]
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the payload of an entry, None if the entry is not pending anymore (sent or superseded meanwhile)
+    #   The entry position is read from the current index, the spool may have been compacted since the entry was listed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def read(self, entry_id: int):
+        with self.locked():
+            index = self.load_index()
+
+            for entry in index['entries']:
+                if entry['id'] == entry_id:
+                    break
+            else:
+                return None
+
+            try:
+                with open(self.outbox_dir + '/' + index['spool'], 'rb') as file:
+                    file.seek(entry['offset'])
+                    return json.loads(file.read(entry['length']).decode())
+            except Exception as e:
+                raise Exception('could not read outbox entry #' + str(entry_id) + ': ' + str(e))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove a sent entry, by id or by key
+    #
+    #-----------------------------------------------------------------------------------------------
+    def ack(self, entry_id: int):
+        with self.locked():
+            index = self.load_index()
+
+            for entry in index['entries']:
+                if entry['id'] == entry_id:
+                    index['entries'].remove(entry)
+
+                    # The reposerver is reachable again
+                    index['paused_until'].pop(entry['kind'], None)
+                    break
+
+            self.compact(index)
+            self.save_index(index)
+
+
+    def ack_key(self, key: str):
+        with self.locked():
+            index = self.load_index()
+            index['entries'] = [entry for entry in index['entries'] if entry['key'] != key]
+            self.compact(index)
+            self.save_index(index)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Schedule the next attempt of an entry, with exponential backoff and jitter
+    #   If pause_kind is True, all the entries of the same kind wait as well (the reposerver is likely unavailable,
+    #   no need to try every entry)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def retry_later(self, entry_id: int, pause_kind: bool = True):
+        with self.locked():
+            index = self.load_index()
+
+            for entry in index['entries']:
+                if entry['id'] != entry_id:
+                    continue
+
+                entry['attempts'] += 1
+
+                # Random delay between half and the full backoff delay, so that hosts do not all retry at the same time
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (entry['attempts'] - 1))
+                entry['next_attempt'] = time.time() + random.uniform(delay / 2, delay)
+
+                if pause_kind:
+                    index['paused_until'][entry['kind']] = entry['next_attempt']
+                break
+
+            self.save_index(index)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if an entry is still pending, by id or by key
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_pending(self, entry_id: int) -> bool:
+        with self.locked():
+            index = self.load_index()
+
+        return any(entry['id'] == entry_id for entry in index['entries'])
+
+
+    def has_key(self, key: str) -> bool:
+        with self.locked():
+            index = self.load_index()
+
+        return any(entry['key'] == key for entry in index['entries'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the time of the next attempt for the entries of a kind, None if there is no entry
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_next_attempt(self, kind: str):
+        with self.locked():
+            index = self.load_index()
+
+        next_attempts = [entry['next_attempt'] for entry in index['entries'] if entry['kind'] == kind]
+
+        if len(next_attempts) == 0:
+            return None
+
+        return max(min(next_attempts), index['paused_until'].get(kind, 0))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Rewrite the spool with the pending entries only, when most of it is made of sent entries
+    #   The new spool is written to a new file, it replaces the old one when the index referencing it is saved
+    #
+    #-----------------------------------------------------------------------------------------------
+    def compact(self, index: dict):
+        spool_file = self.outbox_dir + '/' + index['spool']
+
+        try:
+            spool_size = os.path.getsize(spool_file)
+        except OSError:
+            return
+
+        pending_size = sum(entry['length'] for entry in index['entries'])
+
+        if spool_size < 1024 * 1024 or spool_size < 2 * pending_size:
+            return
+
+        generation = int(index['spool'].split('.')[1]) + 1
+        new_spool = 'spool.' + str(generation)
+
+        try:
+            with open(spool_file, 'rb') as old_file, open(self.outbox_dir + '/' + new_spool, 'wb') as new_file:
+                for entry in index['entries']:
+                    old_file.seek(entry['offset'])
+                    record = old_file.read(entry['length'])
+                    entry['offset'] = new_file.tell()
+                    new_file.write(record)
+
+                new_file.flush()
+                os.fsync(new_file.fileno())
+        except Exception as e:
+            raise Exception('could not compact outbox spool ' + spool_file + ': ' + str(e))
+
+        index['spool'] = new_spool
+        self.save_index(index)
+
+        # The old spool is not referenced anymore
+        Path(spool_file).unlink()
+
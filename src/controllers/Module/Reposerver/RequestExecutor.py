@@ -0,0 +1,128 @@
+# coding: utf-8
+
+# Import libraries
+import asyncio
+
+class RequestExecutor:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Execute the reposerver requests without blocking the agent event loop
+    #   Requests modifying packages (exclusive) are executed one at a time, read-only requests are executed alongside
+    #   them (one at a time too), so that the agent can still answer while packages are being updated
+    #   Read-only requests reading packages still wait for the packages to be released by an exclusive request
+    #   (the package manager cannot be queried during an update)
+    #   Requests waiting for their slot are queued (bounded queue) and can be cancelled
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, loop, exclusive_executor, read_only_executor, max_queued: int = 10):
+        self.loop = loop
+        self.max_queued = max_queued
+
+        # Slot and thread of each kind of request (True = exclusive, False = read-only)
+        self.slots = {
+            True: asyncio.Lock(),
+            False: asyncio.Lock()
+        }
+        self.executors = {
+            True: exclusive_executor,
+            False: read_only_executor
+        }
+
+        # Held while packages are modified or read by a request, the agent also takes it to read packages by itself
+        self.packages_lock = asyncio.Lock()
+
+        # Queued and running requests, by request id
+        self.jobs = {}
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Submit a request, return its status:
+    #   - 'running' if it is executed now, 'queued' if it is waiting for its slot
+    #   - 'duplicate' if a request with the same id is already queued or running
+    #   - 'rejected' if the queue is full
+    #   Exclusive requests always use the packages, read-only requests only if reads_packages is True
+    #
+    #-----------------------------------------------------------------------------------------------
+    def submit(self, request_id: str, exclusive: bool, reads_packages: bool, function, *args) -> str:
+        if request_id in self.jobs:
+            return 'duplicate'
+
+        uses_packages = exclusive or reads_packages
+
+        # The request waits if another request of the same kind, or another request using the packages, is running
+        # or waiting (slots are only taken once the task has started). The agent may also be reading the packages
+        if any(job['exclusive'] == exclusive or (uses_packages and job['uses_packages']) for job in self.jobs.values()) or (uses_packages and self.packages_lock.locked()):
+            if len([job for job in self.jobs.values() if job['status'] == 'queued']) >= self.max_queued:
+                return 'rejected'
+
+            status = 'queued'
+        else:
+            status = 'running'
+
+        job = {
+            'id': request_id,
+            'exclusive': exclusive,
+            'uses_packages': uses_packages,
+            'status': status
+        }
+
+        self.jobs[request_id] = job
+        job['task'] = self.loop.create_task(self.run(job, function, args))
+
+        return status
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Wait for the slot, then execute the request in the slot thread
+    #
+    #-----------------------------------------------------------------------------------------------
+    async def run(self, job: dict, function, args):
+        try:
+            async with self.slots[job['exclusive']]:
+                if job['uses_packages']:
+                    async with self.packages_lock:
+                        job['status'] = 'running'
+                        await self.loop.run_in_executor(self.executors[job['exclusive']], function, *args)
+                else:
+                    job['status'] = 'running'
+                    await self.loop.run_in_executor(self.executors[job['exclusive']], function, *args)
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            print('[reposerver-agent] Error while executing request id #' + job['id'] + ': ' + str(e))
+
+        finally:
+            # A cancelled job has already been removed (a new request may have been submitted with the same id since)
+            if self.jobs.get(job['id']) is job:
+                del self.jobs[job['id']]
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Cancel a queued request, return False if the request is unknown or already running
+    #
+    #-----------------------------------------------------------------------------------------------
+    def cancel(self, request_id: str) -> bool:
+        if request_id not in self.jobs or self.jobs[request_id]['status'] != 'queued':
+            return False
+
+        # A task cancelled before it has started does not run its cleanup, so the job is removed here
+        job = self.jobs.pop(request_id)
+        job['status'] = 'canceled'
+        job['task'].cancel()
+
+        return True
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Cancel all the queued requests (the agent is stopping), running requests cannot be interrupted
+    #
+    #-----------------------------------------------------------------------------------------------
+    def cancel_all(self):
+        for request_id in list(self.jobs.keys()):
+            self.cancel(request_id)
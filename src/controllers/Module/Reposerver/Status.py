@@ -10,8 +10,11 @@ from src.controllers.System import System
 from src.controllers.App.App import App
 from src.controllers.App.Config import Config
 from src.controllers.Module.Reposerver.Config import Config as ReposerverConfig
+from src.controllers.Module.Reposerver.InventorySnapshot import InventorySnapshot
+from src.controllers.Module.Reposerver.Outbox import Outbox
 from src.controllers.Exit import Exit
 from src.controllers.Package.Package import Package
+from src.controllers.Package.HistoryCursor import HistoryCursor
 from src.controllers.HttpRequest import HttpRequest
 
 class Status:
@@ -20,9 +23,10 @@ class Status:
         self.appController              = App()
         self.configController           = Config()
         self.reposerverConfigController = ReposerverConfig()
-        self.httpRequestController      = HttpRequest(self.reposerverConfigController.get_verify_ssl())
+        self.httpRequestController      = HttpRequest(self.reposerverConfigController.get_verify_ssl(), self.reposerverConfigController.get_compress_requests())
         self.packageController          = Package()
         self.exitController             = Exit()
+        self.outboxController           = Outbox()
 
 
     #-----------------------------------------------------------------------------------------------
@@ -62,8 +66,8 @@ class Status:
             raise Exception('could not build general status data: ' + str(e))
 
         try:
-            self.httpRequestController.quiet = False
-            self.httpRequestController.put(url + '/api/v2/host/status', id, token, data, 5, 10)
+            # A newer general status supersedes a previous one that could not be sent yet
+            self.send('/api/v2/host/status', data, 'general-info')
         except Exception as e:
             raise Exception('error while sending general status to reposerver: ' + str(e))
 
@@ -73,9 +77,10 @@ class Status:
     #-----------------------------------------------------------------------------------------------
     #
     #   Send all packages status
+    #   If full_history is True, the whole packages history and packages lists are sent again, not only the changes
     #
     #-----------------------------------------------------------------------------------------------
-    def send_packages_info(self):
+    def send_packages_info(self, full_history: bool = False):
         msg = False
 
         try:
@@ -92,9 +97,9 @@ class Status:
             self.packageController.update_cache()
 
             # Send all status
-            self.send_packages_history()
-            self.send_available_packages_status()
-            self.send_installed_packages_status()
+            self.send_packages_history(full_history = full_history)
+            self.send_available_packages_status(full_resend = full_history)
+            self.send_installed_packages_status(full_resend = full_history)
         except Exception as e:
             raise Exception('error while sending packages status to reposerver: ' + str(e))
 
@@ -104,14 +109,9 @@ class Status:
     #   Send list of available packages
     #
     #-----------------------------------------------------------------------------------------------
-    def send_available_packages_status(self):
+    def send_available_packages_status(self, full_resend: bool = False):
         list = []
 
-        # Retrieve URL, ID and token
-        url = self.reposerverConfigController.getUrl()
-        id = self.reposerverConfigController.getId()
-        token = self.reposerverConfigController.getToken()
-
         print('\n▪ Building available packages list...')
 
         try:
@@ -146,22 +146,14 @@ class Status:
 
                     del name, version, repository, security
 
-            # Convert to JSON
-            data = {
-                'available_packages': list
-            }
-
         except Exception as e:
             # Raise an exception to be caught in the main function
             raise Exception('error while retrieving available packages: ' + str(e))
 
         # Send available packages to Reposerver
-        print('▪ Sending available packages to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
-
-        self.httpRequestController.quiet = False
-        self.httpRequestController.put(url + '/api/v2/host/packages/available', id, token, data, 5, 10)
+        self.send_packages_list('available', list, full_resend)
 
-        del url, id, token, packages, data, list
+        del packages, list
 
 
     #-----------------------------------------------------------------------------------------------
@@ -169,14 +161,9 @@ class Status:
     #   Send list of installed packages
     #
     #-----------------------------------------------------------------------------------------------
-    def send_installed_packages_status(self):
+    def send_installed_packages_status(self, full_resend: bool = False):
         list = []
 
-        # Retrieve URL, ID and token
-        url = self.reposerverConfigController.getUrl()
-        id = self.reposerverConfigController.getId()
-        token = self.reposerverConfigController.getToken()
-
         print('\n▪ Building installed packages list...')
 
         try:
@@ -194,30 +181,95 @@ class Status:
                         'version': package['version']
                     })
 
-            # Convert to JSON
-            data = {
-                'installed_packages': list
-            }
-
         except Exception as e:
             # Raise an exception to set status to 'error'
             raise Exception('error while retrieving installed packages: ' + str(e))
 
         # Send installed packages to Reposerver
-        print('▪ Sending installed packages to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
+        self.send_packages_list('installed', list, full_resend)
+
+        del packages, list
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send a packages list ('installed' or 'available') to Reposerver
+    #   If delta inventory is enabled, only the changes since the last successful sending are sent, with the hash of the
+    #   whole list so that the reposerver can verify the list it holds. The whole list is sent again if there is no previous
+    #   sending, if the last full sending is older than the configured interval, or if the reposerver rejects the changes
+    #
+    #-----------------------------------------------------------------------------------------------
+    def send_packages_list(self, list_name: str, packages: list, full_resend: bool = False):
+        # Retrieve URL, ID and token
+        url = self.reposerverConfigController.getUrl()
+        id = self.reposerverConfigController.getId()
+        token = self.reposerverConfigController.getToken()
+
+        inventory = self.reposerverConfigController.get_packages_inventory()
+        snapshotController = InventorySnapshot(list_name + '-packages')
 
         self.httpRequestController.quiet = False
-        self.httpRequestController.put(url + '/api/v2/host/packages/installed', id, token, data, 5, 10)
 
-        del url, id, token, packages, data
+        # A newer packages list supersedes a previous one that could not be sent yet
+        key = 'packages-' + list_name
+
+        # Full lists only, remove a previous snapshot that would not be up to date if delta inventory is enabled again later
+        if not inventory['delta']:
+            snapshotController.reset()
+
+            print('▪ Sending ' + list_name + ' packages to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
+            self.send('/api/v2/host/packages/' + list_name, {list_name + '_packages': packages}, key)
+            return
+
+        snapshot = snapshotController.load()
+
+        # Send only the changes since the last sending
+        # If a whole list is still waiting to be sent, the reposerver does not have the snapshot list: replace it instead
+        if not full_resend and not snapshotController.full_sync_needed(snapshot, inventory['full_sync_interval']) and not self.outboxController.has_key(key):
+            delta = snapshotController.get_delta(snapshot, packages)
+
+            data = {
+                list_name + '_packages_delta': delta,
+                'base_hash': snapshot['hash'],
+                'hash': snapshotController.get_hash(packages)
+            }
+
+            print('▪ Sending ' + list_name + ' packages changes (' + str(len(delta['added'])) + ' added, ' + str(len(delta['removed'])) + ' removed, ' + str(len(delta['changed'])) + ' changed) to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
+
+            try:
+                results = self.httpRequestController.put(url + '/api/v2/host/packages/' + list_name + '/delta', id, token, data, 5, 10)
+
+                # The reposerver returns the hash of the list it holds once the changes are applied, it must match
+                if isinstance(results, dict) and 'hash' in results and results['hash'] != data['hash']:
+                    raise Exception('packages list hash mismatch')
+
+                snapshotController.save(packages, snapshot['last_full_sync'])
+                return
+
+            except Exception as e:
+                print('  ' + Fore.YELLOW + '✕' + Style.RESET_ALL + ' Could not send ' + list_name + ' packages changes' + (': ' + str(e) if str(e) != '' else '') + ', sending the whole list')
+
+        # Send the whole list
+        print('▪ Sending ' + list_name + ' packages to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
+
+        data = {
+            list_name + '_packages': packages,
+            'hash': snapshotController.get_hash(packages)
+        }
+
+        # The snapshot is saved once the list has been sent
+        self.send('/api/v2/host/packages/' + list_name, data, key, {'name': list_name + '-packages', 'packages_key': list_name + '_packages', 'last_full_sync': time.time()})
+
+        del url, id, token, inventory, snapshotController, snapshot, data, key
 
 
     #-----------------------------------------------------------------------------------------------
     #
     #   Send packages history (installed, removed, upgraded, downgraded, etc.)
+    #   By default, only the events that have not been sent yet are sent (see HistoryCursor)
     #
     #-----------------------------------------------------------------------------------------------
-    def send_packages_history(self, entries_limit: int = 999999):
+    def send_packages_history(self, entries_limit: int = 999999, full_history: bool = False):
         # Retrieve URL, ID and token
         url = self.reposerverConfigController.getUrl()
         id = self.reposerverConfigController.getId()
@@ -226,11 +278,22 @@ class Status:
         # History parsing will start from the oldest to the newest
         history_order = 'oldest'
 
+        # The history cursor remembers up to where the history has already been sent
+        historyCursorController = HistoryCursor()
+        use_cursor = True
+        cursor = None
+
         print('\n▪ Building packages history...')
 
         # If limit is set (not the default 999999), history parsing will start from the newest to the oldest
+        # In this case the cursor is not used, as the oldest events might not be parsed
         if entries_limit != 999999:
             history_order = 'newest'
+            use_cursor = False
+
+        # Unless a full history resync is requested, only parse the events that have not been sent yet
+        if use_cursor and not full_history:
+            cursor = historyCursorController.load()
 
         try:
             # Retrieve history Ids or files
@@ -246,7 +309,7 @@ class Status:
         # Parse history files / Ids
         try:
             events = {}
-            events['events'] = self.packageController.parse_history(history_entries, entries_limit)
+            events['events'] = self.packageController.parse_history(history_entries, entries_limit, cursor)
 
             # debug only: print pretty json
             # import json
@@ -257,9 +320,93 @@ class Status:
         except Exception as e:
             raise Exception('could not parse packages history: ' + str(e))
 
+        # If there is no new event since the last sending, there is nothing to send
+        if cursor is not None and len(events['events']) == 0:
+            print(' no new history event')
+            historyCursorController.save(self.packageController.get_history_cursor())
+            return
+
         print('▪ Sending packages events to ' + Fore.YELLOW + url + Style.RESET_ALL + ':')
 
-        self.httpRequestController.quiet = False
-        self.httpRequestController.put(url + '/api/v2/host/packages/event', id, token, events, 5, 10)
+        self.send('/api/v2/host/packages/event', events)
+
+        # Events are in the outbox, they will be sent even if the reposerver is unavailable now: the cursor can be saved
+        if use_cursor:
+            historyCursorController.save(self.packageController.get_history_cursor())
+
+        del url, id, token, history_order, history_entries, events, cursor, historyCursorController
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send data to Reposerver through the outbox
+    #   Data is first stored in the outbox, so that it is not lost if the reposerver is unavailable: it is then sent
+    #   again later with an increasing delay, without having to compute it again
+    #   If a key is provided, data still waiting in the outbox with the same key is replaced
+    #   If snapshot is provided, the packages list sent is saved as the inventory snapshot once sent
+    #
+    #-----------------------------------------------------------------------------------------------
+    def send(self, route: str, data, key: str = None, snapshot: dict = None):
+        payload = {
+            'data': data
+        }
+
+        if snapshot is not None:
+            payload['snapshot'] = snapshot
+
+        entry_id = self.outboxController.put('http', route, payload, key)
+
+        self.flush_outbox()
+
+        # Still in the outbox: reposerver is unavailable, or the outbox is being sent by another process
+        if self.outboxController.is_pending(entry_id):
+            print('  ' + Fore.YELLOW + '▪' + Style.RESET_ALL + ' Data queued, it will be sent later')
+
+        del payload, entry_id
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Send the data waiting in the outbox, oldest first
+    #   Stop at the first failure: the reposerver is likely unavailable, the remaining data will be sent later
+    #
+    #-----------------------------------------------------------------------------------------------
+    def flush_outbox(self):
+        # Retrieve URL, ID and token
+        url = self.reposerverConfigController.getUrl()
+        id = self.reposerverConfigController.getId()
+        token = self.reposerverConfigController.getToken()
 
-        del url, id, token, history_order, history_entries, events
+        with self.outboxController.flushing() as flushing:
+            # Another thread or process is already sending the outbox
+            if not flushing:
+                return
+
+            for entry in self.outboxController.get_due('http'):
+                try:
+                    payload = self.outboxController.read(entry['id'])
+                except Exception as e:
+                    # Keep the entry, it is read again later
+                    self.outboxController.retry_later(entry['id'], pause_kind = False)
+                    print('  ' + Fore.YELLOW + '✕' + Style.RESET_ALL + ' ' + str(e))
+                    continue
+
+                # Already sent or superseded meanwhile
+                if payload is None:
+                    continue
+
+                try:
+                    self.httpRequestController.quiet = False
+                    self.httpRequestController.put(url + entry['target'], id, token, payload['data'], 5, 10)
+                except Exception as e:
+                    self.outboxController.retry_later(entry['id'])
+                    print('  ' + Fore.YELLOW + '✕' + Style.RESET_ALL + ' Could not send data to ' + entry['target'] + (': ' + str(e) if str(e) != '' else '') + ', it will be sent again later')
+                    return
+
+                self.outboxController.ack(entry['id'])
+
+                # Remember the packages list that has been sent (delta inventory)
+                if 'snapshot' in payload:
+                    InventorySnapshot(payload['snapshot']['name']).save(payload['data'][payload['snapshot']['packages_key']], payload['snapshot']['last_full_sync'])
+
+        del url, id, token
@@ -3,9 +3,13 @@
 # Import libraries
 import subprocess
 import glob
+import gzip
 import os
 import re
+import shlex
+import shutil
 import sys
+import tempfile
 import time
 import fcntl
 from pathlib import Path
@@ -14,37 +18,154 @@ from colorama import Fore, Style
 
 # Import classes
 from src.controllers.LogToFile import LogToFile
+from src.controllers.Package.AptCache import AptCache
+from src.controllers.Package.PackageNameIndex import PackageNameIndex, is_pattern
+from src.controllers.Lock import get_file_locks, get_process_name, wait_for_process_exit
 from src.controllers.App.Utils import Utils
 from src.controllers.Status import update_status, save_status, restore_status
 
+# Apt history log line, e.g. "Start-Date: 2024-05-02  10:10:12"
+HISTORY_LINE_REGEX = re.compile(r'^([A-Za-z-]+): (.*)$')
+
+# Package entry of an apt history log action line, e.g. "libc6:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8)"
+HISTORY_PACKAGE_REGEX = re.compile(r'([^\s,()]+) \(([^)]*)\)')
+
+# Apt history log action lines: (line key, action, event key)
+HISTORY_ACTIONS = [
+    ('Install', 'install', 'installed'),
+    ('Upgrade', 'upgrade', 'upgraded'),
+    ('Remove', 'remove', 'removed'),
+    ('Purge', 'purge', 'purged'),
+    ('Downgrade', 'downgrade', 'downgraded'),
+    ('Reinstall', 'reinstall', 'reinstalled')
+]
+
+# Architectures to remove from package names
+HISTORY_ARCHITECTURES = {
+    'amd64', 'i386', 'all', 'arm64', 'armhf', 'armel', 'ppc64el', 's390x', 'mips', 'mips64el', 'mipsel',
+    'powerpc', 'powerpcspe', 'riscv64', 's390', 'sparc', 'sparc64'
+}
+
+# Dpkg and apt lock files
+DPKG_LOCK_FILES = [
+    '/var/lib/dpkg/lock-frontend',
+    '/var/lib/dpkg/lock',
+    '/var/cache/apt/archives/lock',
+    '/var/lib/apt/lists/lock'
+]
+
+# Dpkg status database, and the fields to retrieve from it
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+DPKG_STATUS_FIELDS = {b'Package', b'Status', b'Version', b'Architecture'}
+
 class Apt:
-    def __init__(self):
+    def __init__(self, cache_session: AptCache = None):
         # Define some default options
         self.dist_upgrade = False
         self.keep_oldconf = True
 
+        # Maximum number of packages to update in a single apt transaction (0 = one package at a time)
+        self.transaction_chunk_size = 0
+
+        # Number of parallel downloads per host when downloading the packages before installing them (0 = download-ahead disabled)
+        self.download_parallelism = 0
+
+        # Maximum time to wait for the dpkg lock to be released, in seconds
+        self.lock_timeout = 60
+
+        # Packages excluded from the update (package name => pinned version, empty if not installed) and the temporary preferences directory
+        # used to apply them (see get_exclusion_options())
+        self.exclusions = {}
+        self.exclusions_dir = None
+
+        # Long-lived apt cache session, shared by all the queries of the run
+        # If no session is provided (e.g. Apt used outside of Package), use a dedicated one
+        if cache_session is None:
+            cache_session = AptCache()
+
+        self.aptCacheSession = cache_session
+
+        # Index description resolved for each package file of the cache (package file path => description)
+        self.index_description_by_package_file = {}
+
+        # Cursor resulting from the last history parsing (see parse_history())
+        self.history_cursor = None
+
+        # Native architecture of the system (see get_native_architecture())
+        self.native_architecture = None
+
+        # Security classification of each package file of the cache (package file path => True/False)
+        self.security_by_package_file = {}
+
+        # Upgrade simulations results, for dist upgrade or not (see simulate_upgrade())
+        self.upgrade_simulations = {}
+
+        # Sorted index of installed package names, used to expand glob patterns (see get_installed_name_index())
+        self.installed_name_index = None
+        self.installed_name_index_signature = None
+
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Return a set of package names that have a security update available
-    #   Opens the cache once and simulates an upgrade to check all candidates
+    #   Simulate an upgrade and return the packages that would be upgraded or installed, with their candidate
+    #   version, repository, security classification and download size
+    #   The result is kept until the apt cache changes, so that it is computed only once per run
     #
     #-----------------------------------------------------------------------------------------------
-    def get_security_packages_set(self):
-        security_set = set()
+    def simulate_upgrade(self, dist_upgrade: bool = False):
+        # Get apt cache
+        aptcache = self.aptCacheSession.get()
+
+        # Return the previous simulation if the cache has not changed since
+        if dist_upgrade in self.upgrade_simulations:
+            if self.upgrade_simulations[dist_upgrade]['signature'] == self.aptCacheSession.signature:
+                return self.upgrade_simulations[dist_upgrade]['packages']
+
+        packages = []
 
         try:
-            aptcache = apt.Cache()
-            aptcache.open(None)
-            aptcache.upgrade(True)
+            # Simulate an upgrade
+            aptcache.upgrade(dist_upgrade)
 
+            # Loop through all packages marked for upgrade or install
             for pkg in aptcache.get_changes():
+                # Skip malformed entries without candidate version
                 if not pkg.candidate:
                     continue
-                if self.is_security_update(pkg):
-                    security_set.add(pkg.name)
 
-            aptcache.close()
+                packages.append({
+                    'name': pkg.name,
+                    'current_version': pkg.installed.version if pkg.installed else '',
+                    'target_version': pkg.candidate.version,
+                    'repository': self.get_version_repository(aptcache, pkg.candidate),
+                    'security': self.is_security_update(pkg),
+                    'download_size': pkg.candidate.size,
+                    'upgradable': pkg.is_upgradable
+                })
+        finally:
+            # Reset the changes marked by the upgrade simulation, the cache is shared with other queries
+            aptcache.clear()
+
+        self.upgrade_simulations[dist_upgrade] = {
+            'signature': self.aptCacheSession.signature,
+            'packages': packages
+        }
+
+        return packages
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return a set of package names that have a security update available
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_security_packages_set(self):
+        security_set = set()
+
+        try:
+            for package in self.simulate_upgrade(True):
+                if package['security']:
+                    security_set.add(package['name'])
         except Exception:
             pass
 
@@ -61,21 +182,8 @@ class Apt:
             if not pkg.candidate:
                 return False
 
-            for origin in pkg.candidate.origins:
-                archive = str(getattr(origin, 'archive', '') or '').lower()
-                label = str(getattr(origin, 'label', '') or '').lower()
-                site = str(getattr(origin, 'site', '') or '').lower()
-                origin_name = str(getattr(origin, 'origin', '') or '').lower()
-
-                if '-security' in archive:
-                    return True
-                if 'security' in label:
-                    return True
-                if 'security.debian.org' in site:
-                    return True
-                if 'debian-security' in origin_name:
-                    return True
-                if 'ubuntuesm' in origin_name:
+            for pkgfile, _ in pkg.candidate._cand.file_list:
+                if self.is_security_package_file(pkgfile):
                     return True
 
             return False
@@ -83,6 +191,39 @@ class Apt:
             return False
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if a package file (i.e. a repository index) comes from a security repository
+    #   Package files are shared by all the packages coming from the same repository, so each one is classified only once
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_security_package_file(self, pkgfile):
+        if pkgfile.filename in self.security_by_package_file:
+            return self.security_by_package_file[pkgfile.filename]
+
+        archive = str(pkgfile.archive or '').lower()
+        label = str(pkgfile.label or '').lower()
+        site = str(pkgfile.site or '').lower()
+        origin_name = str(pkgfile.origin or '').lower()
+
+        security = False
+
+        if '-security' in archive:
+            security = True
+        elif 'security' in label:
+            security = True
+        elif 'security.debian.org' in site:
+            security = True
+        elif 'debian-security' in origin_name:
+            security = True
+        elif 'ubuntuesm' in origin_name:
+            security = True
+
+        self.security_by_package_file[pkgfile.filename] = security
+
+        return security
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Return the current version of a package
@@ -92,16 +233,12 @@ class Apt:
         try:
             self.wait_for_dpkg_lock()
 
-            # Open apt cache
-            aptcache = apt.Cache()
-            aptcache.open(None)
+            # Get apt cache (only reopened if dpkg status has changed, e.g. after a package update)
+            aptcache = self.aptCacheSession.get()
 
             # Get the package from the cache
             pkg = aptcache[package]
 
-            # Close the cache
-            aptcache.close()
-
             # If the package is not installed, return an empty string
             if not pkg.is_installed:
                 return ''
@@ -113,39 +250,82 @@ class Apt:
             raise Exception('could not get current version of package ' + package + ': ' + str(e))
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the source repository URL of a package version, resolved from the package file index of the opened cache
+    #   e.g. 'http://archive.ubuntu.com/ubuntu' (same as the first field of 'apt show' APT-Sources line)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_version_repository(self, aptcache, version):
+        for description in self.get_version_index_descriptions(aptcache, version):
+            return description.split()[0].strip()
+
+        return 'Unknown'
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the descriptions of the package indexes (repositories) providing a package version
+    #   e.g. ['http://archive.ubuntu.com/ubuntu focal-updates/main amd64 Packages']
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_version_index_descriptions(self, aptcache, version):
+        descriptions = []
+
+        for pkgfile, _ in version._cand.file_list:
+            # Package files are shared by all the packages coming from the same repository, resolve each one only once
+            # Package files are identified by their lists file path, which stays the same when the cache is reopened
+            if pkgfile.filename not in self.index_description_by_package_file:
+                index = aptcache._list.find_index(pkgfile)
+
+                # Package files without index (e.g. /var/lib/dpkg/status) are not repositories
+                if index is not None and index.describe:
+                    self.index_description_by_package_file[pkgfile.filename] = index.describe
+                else:
+                    self.index_description_by_package_file[pkgfile.filename] = None
+
+            if self.index_description_by_package_file[pkgfile.filename]:
+                descriptions.append(self.index_description_by_package_file[pkgfile.filename])
+
+        return descriptions
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Return the source repository of a package and its version
     #
     #-----------------------------------------------------------------------------------------------
     def get_source_repository(self, package, version):
-        repository = 'Unknown'
-
         try:
-            result = subprocess.run(
-                # ['/usr/bin/apt-cache policy ' + package + ' | /usr/bin/grep "' + version + '" -A1 | /usr/bin/grep -E "http(s)?://"'],
-                ['/usr/bin/apt show ' + package + '=' + version + ' 2>/dev/null | /usr/bin/grep "APT-Sources"'],
-                stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-                stderr = subprocess.PIPE,
-                universal_newlines = True, # Alias of 'text = True'
-                shell = True
-            )
+            aptcache = self.aptCacheSession.get()
 
-            # If the command failed, it means that no result matching the package and version was found
-            # In this case, we return the repository as 'Unknown'
-            if result.returncode != 0:
-                # raise Exception('no result matching package and version')
-                return repository
-
-            # If the command succeeded, get the repository URL from the output
-            if result.stdout:
-                # The output is in the format " 500 http://archive.ubuntu.com/ubuntu focal-updates/main amd64 Packages"
-                # We want to extract the URL, which is the first part of the line
-                repository = result.stdout.split()[1].strip()
+            # If the package or the version is not known from the cache, return the repository as 'Unknown'
+            if package not in aptcache:
+                return 'Unknown'
+
+            pkg_version = aptcache[package].versions.get(version)
+
+            if pkg_version is None:
+                return 'Unknown'
+
+            return self.get_version_repository(aptcache, pkg_version)
         except Exception as e:
             raise Exception('could not get source repository for package ' + package + ' version ' + version + ': ' + str(e))
 
-        return repository
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the source repositories of a list of packages and their target versions, in a single pass
+    #   e.g. [{'name': 'curl', 'target_version': '7.88.1-10'}] => {'curl': 'http://deb.debian.org/debian'}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_source_repositories(self, packages: list):
+        repositories = {}
+
+        for package in packages:
+            repositories[package['name']] = self.get_source_repository(package['name'], package['target_version'])
+
+        return repositories
 
 
     #-----------------------------------------------------------------------------------------------
@@ -155,16 +335,12 @@ class Apt:
     #-----------------------------------------------------------------------------------------------
     def get_available_version(self, package):
         try:
-            # Open apt cache
-            aptcache = apt.Cache()
-            aptcache.open(None)
+            # Get apt cache
+            aptcache = self.aptCacheSession.get()
 
             # Get the package from the cache
             pkg = aptcache[package]
 
-            # Close the cache
-            aptcache.close()
-
             # If the package is not installed, return an empty string
             if not pkg.is_installed:
                 return ''
@@ -182,13 +358,20 @@ class Apt:
     #
     #-----------------------------------------------------------------------------------------------
     def get_installed_packages(self):
-        list = []
+        # Read installed packages directly from the dpkg status database, which is much faster than loading the whole apt cache
+        try:
+            return self.get_dpkg_installed_packages()
 
-        # Open cache
-        aptcache = apt.Cache()
-        aptcache.open(None)
+        # If the dpkg status database could not be read, fallback to the apt cache
+        except OSError:
+            pass
+
+        list = []
 
         try:
+            # Get apt cache
+            aptcache = self.aptCacheSession.get()
+
             # Loop through all installed packages
             for pkg in aptcache:
                 # If the package is installed, add it to the list of installed packages
@@ -196,13 +379,11 @@ class Apt:
                     list.append({
                         'name': pkg.name,
                         'version': pkg.installed.version,
+                        'arch': pkg.installed.architecture
                     })
 
-            # Sort the list by package name
+            # Sort the list by package name
             list.sort(key=lambda x: x['name'])
-
-            # Close the cache
-            aptcache.close()
         except Exception as e:
             raise Exception('could not get installed packages: ' + str(e))
 
@@ -211,51 +392,125 @@ class Apt:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Return list of available apt packages, sorted by name
+    #   Return list of installed packages read from the dpkg status database, sorted by name
+    #   The file is read stanza by stanza (one stanza per package, separated by an empty line), e.g.
+    #       Package: curl
+    #       Status: install ok installed
+    #       Architecture: amd64
+    #       Version: 7.88.1-10+deb12u5
     #
     #-----------------------------------------------------------------------------------------------
-    def get_available_packages(self, dist_upgrade: bool = False):
+    def get_dpkg_installed_packages(self):
         list = []
+        stanza = {}
+
+        # Packages of a foreign architecture are named 'name:arch', like python-apt does
+        native_architecture = self.get_native_architecture()
+
+        with open(DPKG_STATUS_FILE, 'rb', buffering = 1024 * 1024) as file:
+            for line in file:
+                # An empty line ends the current stanza
+                if line.strip() == b'':
+                    if stanza:
+                        self.add_dpkg_installed_package(list, stanza, native_architecture)
+                        stanza = {}
+                    continue
 
-        # Open cache
-        aptcache = apt.Cache()
-        aptcache.open(None)
+                # Ignore continuation lines (e.g. multi-line Description or Conffiles)
+                if line[:1] in (b' ', b'\t'):
+                    continue
 
-        # Simulate an upgrade to get the list of available packages
-        aptcache.upgrade(dist_upgrade)
+                key, _, value = line.partition(b':')
 
-        # Loop through all packages marked for upgrade
-        for pkg in aptcache.get_changes():
-            # Skip malformed entries without installed/candidate versions
-            if not pkg.candidate or not pkg.installed:
-                continue
+                if key in DPKG_STATUS_FIELDS:
+                    stanza[key] = value.strip().decode('utf-8', errors = 'replace')
 
-            repository = 'Unknown'
-            security = False
+        # Last stanza of the file, if not terminated by an empty line
+        if stanza:
+            self.add_dpkg_installed_package(list, stanza, native_architecture)
 
-            # Get the repository URL
-            repository = self.get_source_repository(pkg.name, pkg.candidate.version)
+        # Sort the list by package name
+        list.sort(key=lambda x: x['name'])
 
-            # Check if candidate comes from a security repository
-            security = self.is_security_update(pkg)
+        return list
 
-            # If the package is upgradable, add it to the list of available packages
-            if pkg.is_upgradable:
-                myPackage = {
-                    'name': pkg.name,
-                    'current_version': pkg.installed.version,
-                    'target_version': pkg.candidate.version,
-                    'repository': repository,
-                    'security': security
-                }
 
-                list.append(myPackage)
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Add a dpkg status stanza to the list of installed packages, if the package is installed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def add_dpkg_installed_package(self, list: list, stanza: dict, native_architecture: str):
+        name = stanza.get(b'Package', '')
+        version = stanza.get(b'Version', '')
+        arch = stanza.get(b'Architecture', '')
 
-        # Sort the list by package name
-        list.sort(key=lambda x: x['name'])
+        # The Status field is in the format "want flag state", e.g. "install ok installed"
+        # Packages that are not installed or whose only configuration files remain are ignored
+        status = stanza.get(b'Status', '').split()
+
+        if len(status) != 3 or status[2] in ('not-installed', 'config-files'):
+            return
+
+        if name == '' or version == '':
+            return
+
+        if arch not in ('', 'all', native_architecture):
+            name = name + ':' + arch
+
+        list.append({
+            'name': name,
+            'version': version,
+            'arch': arch
+        })
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the native architecture of the system, e.g. 'amd64'
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_native_architecture(self):
+        if self.native_architecture is None:
+            result = subprocess.run(
+                ['dpkg', '--print-architecture'],
+                stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+                stderr = subprocess.PIPE,
+                universal_newlines = True # Alias of 'text = True'
+            )
+
+            if result.returncode != 0:
+                raise Exception('could not retrieve native architecture: ' + result.stderr)
 
-        # Close the cache
-        aptcache.close()
+            self.native_architecture = result.stdout.strip()
+
+        return self.native_architecture
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return list of available apt packages, sorted by name
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_available_packages(self, dist_upgrade: bool = False):
+        list = []
+
+        # Simulate an upgrade to get the list of available packages
+        for package in self.simulate_upgrade(dist_upgrade):
+            # Skip packages that are not installed (new dependencies) or not upgradable
+            if package['current_version'] == '' or not package['upgradable']:
+                continue
+
+            list.append({
+                'name': package['name'],
+                'current_version': package['current_version'],
+                'target_version': package['target_version'],
+                'repository': package['repository'],
+                'security': package['security']
+            })
+
+        # Sort the list by package name
+        list.sort(key=lambda x: x['name'])
 
         return list
 
@@ -267,60 +522,174 @@ class Apt:
     #-----------------------------------------------------------------------------------------------
     def is_installed(self, package):
         try:
-            # Open apt cache
-            aptcache = apt.Cache()
-            aptcache.open(None)
+            # Get apt cache
+            aptcache = self.aptCacheSession.get()
 
-            # Get the package from the cache
-            for pkg in aptcache:
-                if pkg.name == package:
-                    return True
+            # Direct lookup by name instead of iterating over the whole cache
+            if package not in aptcache:
+                return False
 
-            return False
+            return aptcache[package].is_installed
 
         except Exception as e:
             raise Exception('could not check if package ' + package + ' is installed: ' + str(e))
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the sorted index of installed package names, kept until the apt cache changes
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_installed_name_index(self):
+        self.aptCacheSession.get()
+
+        if self.installed_name_index is None or self.installed_name_index_signature != self.aptCacheSession.signature:
+            self.installed_name_index = PackageNameIndex([package['name'] for package in self.get_installed_packages()])
+            self.installed_name_index_signature = self.aptCacheSession.signature
+
+        return self.installed_name_index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Resolve a list of package names or glob patterns (e.g. nginx*) in a single pass: installed or not,
+    #   current version, available version and source repository of the available version
+    #   e.g. ['curl'] => [{'name': 'curl', 'installed': True, 'current_version': '7.88.1-10', 'target_version': '7.88.1-10+deb12u5', 'repository': 'http://deb.debian.org/debian'}]
+    #
+    #-----------------------------------------------------------------------------------------------
+    def resolve_packages(self, names: list):
+        resolved = []
+
+        try:
+            self.wait_for_dpkg_lock()
+
+            # Get apt cache
+            aptcache = self.aptCacheSession.get()
+
+            # Expand glob patterns against installed packages names, only if there are any
+            if any(is_pattern(name) for name in names):
+                names = self.get_installed_name_index().expand_all(names)
+
+            for name in names:
+                package = {
+                    'name': name,
+                    'installed': False,
+                    'current_version': '',
+                    'target_version': '',
+                    'repository': 'Unknown'
+                }
+
+                if name in aptcache and aptcache[name].is_installed:
+                    pkg = aptcache[name]
+
+                    package['installed'] = True
+                    package['current_version'] = pkg.installed.version
+
+                    if pkg.candidate:
+                        package['target_version'] = pkg.candidate.version
+                        package['repository'] = self.get_version_repository(aptcache, pkg.candidate)
+
+                resolved.append(package)
+        except Exception as e:
+            raise Exception('could not resolve packages: ' + str(e))
+
+        return resolved
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the process holding one of the dpkg or apt locks, as a (lock file, PID, process name) tuple,
+    #   or None if no lock is held. PID is None if the holder could not be identified (e.g. OFD lock)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_dpkg_lock_holder(self):
+        for lock_file in DPKG_LOCK_FILES:
+            if not os.path.exists(lock_file):
+                continue
+
+            locks = get_file_locks(lock_file)
+
+            # Locks are listed in /proc/locks, no need to touch the lock file
+            if locks is not None:
+                # dpkg and apt use fcntl() record locks (POSIX, or OFDLCK whose PID is not known), flock() locks do not block them
+                locks = [(lock_type, pid) for lock_type, pid in locks if lock_type in ['POSIX', 'OFDLCK']]
+
+                if len(locks) == 0:
+                    continue
+
+                for _, pid in locks:
+                    if pid > 0:
+                        return (lock_file, pid, get_process_name(pid))
+
+                return (lock_file, None, '')
+
+            # /proc/locks is not readable, test the lock directly (opened in read-write mode, not to truncate the file)
+            try:
+                fd = os.open(lock_file, os.O_RDWR)
+            except OSError:
+                continue
+
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            except OSError:
+                return (lock_file, None, '')
+            finally:
+                os.close(fd)
+
+        return None
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Wait for dpkg lock to be released
-    #   Default timeout is 60 seconds
-    #
-    #-----------------------------------------------------------------------------------------------
-    def wait_for_dpkg_lock(self, timeout: int = 60):
-        lock_files = [
-            '/var/lib/dpkg/lock',
-            '/var/lib/dpkg/lock-frontend',
-            '/var/cache/apt/archives/lock',
-            '/var/lib/apt/lists/lock'
-        ]
-
-        # Save status message
-        save_status()
-
-        start_time = time.time()
-
-        while time.time() - start_time < timeout:
-            locks_held = False
-            for lock_file in lock_files:
-                if os.path.exists(lock_file):
-                    try:
-                        with open(lock_file, 'w') as handle:
-                            fcntl.lockf(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except IOError:
-                        locks_held = True
-                        break
+    #   Default timeout is the package manager lock timeout from the configuration (60 seconds)
+    #   The holder of the lock is reported in the status line, and its exit is waited for instead of polling the lock files
+    #
+    #-----------------------------------------------------------------------------------------------
+    def wait_for_dpkg_lock(self, timeout: int = None):
+        if timeout is None:
+            timeout = self.lock_timeout
 
-            if not locks_held:
-                # Restore status message
-                restore_status()
-                return
+        deadline = time.monotonic() + timeout
+        status_saved = False
+
+        try:
+            while True:
+                holder = self.get_dpkg_lock_holder()
+
+                if holder is None:
+                    return
+
+                lock_file, pid, process_name = holder
+
+                if pid is not None:
+                    holder_message = lock_file + ' held by ' + (process_name or 'process') + ' (PID ' + str(pid) + ')'
+                else:
+                    holder_message = lock_file + ' held by another process'
+
+                if time.monotonic() >= deadline:
+                    raise Exception('Could not acquire dpkg lock within ' + str(timeout) + ' seconds: ' + holder_message)
+
+                # Save status message
+                if not status_saved:
+                    save_status()
+                    status_saved = True
 
-            update_status("Waiting for dpkg lock to be released")
-            time.sleep(2)
+                update_status('Waiting for dpkg lock to be released: ' + holder_message)
 
-        raise Exception(f'Could not acquire dpkg lock within {timeout} seconds')
+                # Wait for the holder to exit, but check the lock again at least every second as the holder could also
+                # release it without exiting (e.g. unattended-upgrades between two steps)
+                wait_time = min(1, max(deadline - time.monotonic(), 0))
+
+                if pid is not None:
+                    wait_for_process_exit(pid, wait_time)
+                else:
+                    time.sleep(wait_time)
+        finally:
+            # Restore status message
+            if status_saved:
+                restore_status()
 
 
     #-----------------------------------------------------------------------------------------------
@@ -333,7 +702,10 @@ class Apt:
             # Wait for the lock to be released
             self.wait_for_dpkg_lock()
 
-            # Delete everything under /var/cache/apt/
+            # Close the cache session, its files are about to be deleted
+            self.aptCacheSession.close()
+
+            # Delete everything under /var/cache/apt/
             try:
                 subprocess.run(
                     ['rm -rf /var/cache/apt/*'],
@@ -363,11 +735,8 @@ class Apt:
                 # Wait for the lock to be released
                 self.wait_for_dpkg_lock()
 
-                aptcache = apt.Cache()
-                aptcache.clear()
-                aptcache.close()
-                
-                del aptcache
+                # Reopen the cache session to regenerate the apt cache
+                self.aptCacheSession.get()
             except Exception as e:
                 raise Exception('could not clear apt cache: ' + str(e))
         except Exception as e:
@@ -377,17 +746,29 @@ class Apt:
     #-----------------------------------------------------------------------------------------------
     #
     #   Update apt cache and return the updated cache
+    #   If a list of packages is provided, only the sources providing these packages are refreshed
     #
     #-----------------------------------------------------------------------------------------------
-    def update_cache(self):
+    def update_cache(self, packages: list = None):
+        sources_dir = None
+
         # Force complete cleanup and refresh using command line apt update
         try:
             # Wait for dpkg lock first
             self.wait_for_dpkg_lock()
-            
+
+            cmd = ["apt-get", "update"]
+
+            # Partial refresh, only the sources providing the packages are configured, and the lists of the other sources are kept
+            if packages:
+                sources_dir = self.get_partial_sources_dir(packages)
+
+                if sources_dir is not None:
+                    cmd += ['-o', 'Dir::Etc::SourceList=/dev/null', '-o', 'Dir::Etc::SourceParts=' + sources_dir, '-o', 'APT::Get::List-Cleanup=0']
+
             # Use apt update command directly for more reliable cache refresh
             subprocess.run(
-                ["apt-get", "update"],
+                cmd,
                 stdout = subprocess.PIPE,
                 stderr = subprocess.PIPE,
                 universal_newlines = True,
@@ -398,17 +779,15 @@ class Apt:
             raise Exception('could not update apt cache via command line: ' + e.stderr)
         except Exception as e:
             raise Exception('could not update apt cache: ' + str(e))
+        finally:
+            if sources_dir is not None:
+                shutil.rmtree(sources_dir, ignore_errors = True)
 
-        # Now open a fresh apt cache
+        # Now reopen the cache session so that it reflects the new package lists
         try:
             self.wait_for_dpkg_lock()
-            aptcache = apt.Cache()
-            aptcache.open(None)
-            
-            # Force a complete refresh of the cache object
-            aptcache.close()
-            aptcache.clear()
-            aptcache.open(None)
+            self.aptCacheSession.invalidate()
+            aptcache = self.aptCacheSession.get()
 
         except Exception as e:
             raise Exception('could not open fresh apt cache: ' + str(e))
@@ -418,76 +797,377 @@ class Apt:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Get list of excluded packages (hold)
+    #   Return the sources files (repositories configuration)
     #
     #-----------------------------------------------------------------------------------------------
-    def get_exclusion(self):
-        result = subprocess.run(
-            ["apt-mark", "showhold"],
-            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-            stderr = subprocess.PIPE,
-            universal_newlines = True # Alias of 'text = True'
-        )
-
-        if result.returncode != 0:
-            raise Exception('could not get excluded (holded) packages list:' + result.stderr)
-
-        return result.stdout.splitlines()
+    def get_sources_files(self):
+        return ['/etc/apt/sources.list'] + glob.glob('/etc/apt/sources.list.d/*.list') + glob.glob('/etc/apt/sources.list.d/*.sources')
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Exclude (hold) specified package
+    #   Return the repositories providing a list of packages (or glob patterns), from the opened cache, as (URI, suite/component)
+    #   e.g. ['curl'] => {('http://deb.debian.org/debian', 'bookworm/main'), ('http://security.debian.org/debian-security', 'bookworm-security/main')}
     #
     #-----------------------------------------------------------------------------------------------
-    def exclude(self, package):
-        result = subprocess.run(
-            ["apt-mark", "hold", package],
-            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-            stderr = subprocess.PIPE,
-            universal_newlines = True # Alias of 'text = True'
-        )
-
-        if result.returncode != 0:
-            raise Exception('could not exclude ' + package + ' package from update: ' + result.stderr)
+    def get_packages_repositories(self, packages: list):
+        repositories = set()
+        aptcache = self.aptCacheSession.get()
 
+        if any(is_pattern(name) for name in packages):
+            packages = self.get_installed_name_index().expand_all(packages)
 
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Remove all package exclusions (unhold)
-    #
-    #-----------------------------------------------------------------------------------------------
-    def remove_all_exclusions(self):
-        # Retrieve the list of packages on hold
-        list = self.get_exclusion()
+        for name in packages:
+            if name not in aptcache:
+                continue
 
-        # Quit if there are no packages on hold
-        if list == '':
-            return
+            # All the versions known for the package, a newer version could come from another repository than the candidate one
+            for version in aptcache[name].versions:
+                for description in self.get_version_index_descriptions(aptcache, version):
+                    description = description.split()
 
-        # Unhold all packages
-        for package in list:
-            result = subprocess.run(
-                ["apt-mark", "unhold", package],
-                stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-                stderr = subprocess.PIPE,
-                universal_newlines = True # Alias of 'text = True'
-            )
+                    if len(description) >= 2:
+                        repositories.add((description[0].rstrip('/'), description[1]))
 
-            if result.returncode != 0:
-                raise Exception('could not unhold packages: ' + package)
+        return repositories
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Update packages
+    #   Return the repositories declared in a sources file, as (URI, suite/component) like get_packages_repositories()
+    #   One-line (.list) and deb822 (.sources) formats are read, e.g.
+    #       deb [signed-by=/usr/share/keyrings/debian.gpg] http://deb.debian.org/debian bookworm main contrib
+    #       => {('http://deb.debian.org/debian', 'bookworm/main'), ('http://deb.debian.org/debian', 'bookworm/contrib')}
+    #   A flat repository (suite ending with '/', no component) is returned as (URI, suite)
     #
     #-----------------------------------------------------------------------------------------------
-    def update(self, packagesList, exit_on_package_update_error: bool = True, dry_run: bool = False):
-        counter = 0
-        update_status_msg = 'Updating packages'
+    def get_sources_file_repositories(self, file: str):
+        repositories = set()
 
-        # If dry-run, add it to the status message
+        # List of (URIs, suites, components)
+        entries = []
+
+        with open(file, 'r') as stream:
+            content = stream.read()
+
+        if file.endswith('.sources'):
+            for stanza in re.split(r'\n[ \t]*\n', content):
+                fields = {}
+                key = None
+
+                for line in stanza.splitlines():
+                    if line.strip() == '' or line.startswith('#'):
+                        continue
+
+                    # Continuation line of a multi-line field
+                    if line[0] in (' ', '\t'):
+                        if key is not None:
+                            fields[key] += ' ' + line.strip()
+                        continue
+
+                    key, _, value = line.partition(':')
+                    key = key.strip().lower()
+                    fields[key] = value.strip()
+
+                if 'deb' not in fields.get('types', '').split() or fields.get('enabled', 'yes').lower() == 'no':
+                    continue
+
+                entries.append((fields.get('uris', '').split(), fields.get('suites', '').split(), fields.get('components', '').split()))
+        else:
+            for line in content.splitlines():
+                # Remove comments and options (e.g. [arch=amd64 signed-by=...])
+                line = re.sub(r'\[[^\]]*\]', ' ', line.split('#', 1)[0])
+                words = line.split()
+
+                if len(words) < 3 or words[0] != 'deb':
+                    continue
+
+                entries.append(([words[1]], [words[2]], words[3:]))
+
+        for uris, suites, components in entries:
+            for uri in uris:
+                for suite in suites:
+                    if suite.endswith('/'):
+                        repositories.add((uri.rstrip('/'), suite))
+
+                    for component in components:
+                        repositories.add((uri.rstrip('/'), suite + '/' + component))
+
+        return repositories
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Create a temporary sources directory containing only the sources files that provide a list of packages
+    #   Sources files are linked as is, so that their options (e.g. signed-by) are kept
+    #   Return None if the sources could not be determined, a full refresh must then be done
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_partial_sources_dir(self, packages: list):
+        repositories = self.get_packages_repositories(packages)
+
+        if len(repositories) == 0:
+            return None
+
+        sources_files = []
+
+        for file in self.get_sources_files():
+            try:
+                if len(self.get_sources_file_repositories(file) & repositories) > 0:
+                    sources_files.append(file)
+            except OSError:
+                continue
+
+        if len(sources_files) == 0:
+            return None
+
+        try:
+            sources_dir = tempfile.mkdtemp(prefix = 'linupdate-sources-')
+        except Exception as e:
+            raise Exception('could not create temporary sources directory: ' + str(e))
+
+        try:
+            for file in sources_files:
+                # Files in a sources directory must end with .list or .sources
+                if file == '/etc/apt/sources.list':
+                    link = sources_dir + '/00-sources.list'
+                else:
+                    link = sources_dir + '/' + os.path.basename(file)
+
+                os.symlink(file, link)
+        except Exception as e:
+            shutil.rmtree(sources_dir, ignore_errors = True)
+            raise Exception('could not create temporary sources directory: ' + str(e))
+
+        return sources_dir
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the time of the last successful package lists refresh, by linupdate or by apt itself (e.g. apt daily timer)
+    #   The lists files can not be used for that, their modification time is the one of the repository, not of the refresh
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_package_lists_mtime(self):
+        try:
+            return os.stat('/var/lib/apt/periodic/update-success-stamp').st_mtime
+        except OSError:
+            return None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get list of excluded packages
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_exclusion(self):
+        return list(self.exclusions.keys())
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Exclude specified package
+    #   The exclusion only applies to the apt commands run by linupdate (see get_exclusion_options()),
+    #   nothing is written on the system (no hold), so no exclusion can be left behind after a crash
+    #
+    #-----------------------------------------------------------------------------------------------
+    def exclude(self, package):
+        try:
+            # Pin the package to its current version
+            self.exclusions[package] = self.get_current_version(package)
+        except Exception as e:
+            raise Exception('could not exclude ' + package + ' package from update: ' + str(e))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove all package exclusions
+    #
+    #-----------------------------------------------------------------------------------------------
+    def remove_all_exclusions(self):
+        self.exclusions = {}
+
+        # Remove the temporary preferences directory, if any
+        if self.exclusions_dir is not None:
+            shutil.rmtree(self.exclusions_dir, ignore_errors = True)
+            self.exclusions_dir = None
+
+        self.remove_legacy_exclusions()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the exclusions left on the system by previous linupdate versions, once
+    #   Previous versions excluded packages by holding them (apt-mark hold) and unheld all the packages on hold on
+    #   each run: holds still present after an upgrade of linupdate would otherwise block these packages forever
+    #
+    #-----------------------------------------------------------------------------------------------
+    def remove_legacy_exclusions(self):
+        migration_file = Utils().get_state_file('legacy-exclusions.migrated.json')
+
+        if Utils().load_state_file(migration_file) is not None:
+            return
+
+        result = subprocess.run(
+            ["apt-mark", "showhold"],
+            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+            stderr = subprocess.PIPE,
+            universal_newlines = True # Alias of 'text = True'
+        )
+
+        if result.returncode != 0:
+            raise Exception('could not get packages on hold: ' + result.stderr)
+
+        packages = result.stdout.split()
+
+        if len(packages) > 0:
+            result = subprocess.run(
+                ["apt-mark", "unhold"] + packages,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+                universal_newlines = True
+            )
+
+            if result.returncode != 0:
+                raise Exception('could not unhold packages ' + ', '.join(packages) + ': ' + result.stderr)
+
+        Utils().save_state_file(migration_file, {'date': time.time()})
+
+        del result, packages
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the apt options to apply the package exclusions to an apt command
+    #   Excluded packages are pinned to their current version in a temporary preferences parts directory, which
+    #   also contains the system preferences parts (/etc/apt/preferences.d)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_exclusion_options(self):
+        if len(self.exclusions) == 0:
+            return ''
+
+        try:
+            # Create the temporary preferences parts directory
+            if self.exclusions_dir is None:
+                self.exclusions_dir = tempfile.mkdtemp(prefix = 'linupdate-apt-preferences.')
+
+                # Keep the system preferences parts
+                for file in glob.glob('/etc/apt/preferences.d/*'):
+                    os.symlink(file, self.exclusions_dir + '/' + os.path.basename(file))
+
+            # Write the excluded packages pins
+            with open(self.exclusions_dir + '/zz-linupdate-exclusions.pref', 'w') as file:
+                for package, version in self.exclusions.items():
+                    file.write('Package: ' + package + '\n')
+
+                    # A package that is not installed must not be installed either (e.g. as a new dependency)
+                    if version == '':
+                        file.write('Pin: version *\n')
+                        file.write('Pin-Priority: -1\n\n')
+                    else:
+                        file.write('Pin: version ' + version + '\n')
+                        file.write('Pin-Priority: 1001\n\n')
+        except Exception as e:
+            raise Exception('could not apply package exclusions: ' + str(e))
+
+        return ' -o Dir::Etc::PreferencesParts=' + shlex.quote(self.exclusions_dir)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the size to download to install a list of packages in their target version, including dependencies
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_download_size(self, packagesList):
+        aptcache = self.aptCacheSession.get()
+
+        try:
+            with aptcache.actiongroup():
+                for pkg in packagesList:
+                    if pkg['name'] not in aptcache:
+                        continue
+
+                    version = aptcache[pkg['name']].versions.get(pkg['target_version'])
+
+                    if version is None:
+                        continue
+
+                    aptcache[pkg['name']].candidate = version
+                    aptcache[pkg['name']].mark_install()
+
+            return aptcache.required_download
+        finally:
+            # Reset the changes, the cache is shared with other queries
+            aptcache.clear()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Download all the packages to update (and their dependencies) into the apt cache before installing any of them,
+    #   so that installs run from the local cache and a network failure aborts the run before any package has changed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def download_ahead(self, packagesList):
+        packages = [pkg for pkg in packagesList if pkg['install'] == True]
+
+        if len(packages) == 0:
+            return
+
+        update_status('Downloading packages')
+
+        archives_dir = '/var/cache/apt/archives'
+
+        # Verify there is enough space to download the packages
+        try:
+            download_size = self.get_download_size(packages)
+            free_space = shutil.disk_usage(archives_dir).free
+        except Exception as e:
+            raise Exception('could not compute packages download size: ' + str(e))
+
+        print('\n▪ Downloading ' + str(len(packages)) + ' packages (' + str(round(download_size / 1024 / 1024, 1)) + ' MB) before installing them')
+
+        if download_size > free_space:
+            raise Exception('not enough space in ' + archives_dir + ' to download packages: ' + str(round(download_size / 1024 / 1024, 1)) + ' MB needed, ' + str(round(free_space / 1024 / 1024, 1)) + ' MB available')
+
+        self.wait_for_dpkg_lock()
+
+        # Download only (-d)
+        # Note: apt opens a single connection per mirror (mirrors are downloaded from in parallel), the number of parallel
+        # downloads only applies to dnf
+        cmd = 'DEBIAN_FRONTEND=noninteractive /usr/bin/apt-get install -d -y -q'
+        cmd += ' ' + ' '.join(shlex.quote(pkg['name'] + '=' + pkg['target_version']) for pkg in packages)
+
+        # Apply package exclusions
+        cmd += self.get_exclusion_options()
+
+        result = subprocess.run(
+            [cmd],
+            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+            stderr = subprocess.PIPE,
+            universal_newlines = True, # Alias of 'text = True'
+            shell = True
+        )
+
+        # Abort the update if the packages could not be downloaded, nothing has been installed yet
+        if result.returncode != 0:
+            raise Exception('could not download packages: ' + result.stderr)
+
+        print(Fore.GREEN + '✔ ' + Style.RESET_ALL + 'Packages downloaded')
+
+        del result
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Update packages
+    #
+    #-----------------------------------------------------------------------------------------------
+    def update(self, packagesList, exit_on_package_update_error: bool = True, dry_run: bool = False):
+        counter = 0
+        update_status_msg = 'Updating packages'
+
+        # If dry-run, add it to the status message
         if dry_run:
             update_status_msg += ' (dry run)'
 
@@ -508,6 +1188,15 @@ class Apt:
             }
         }
 
+        # If download-ahead is enabled, download all the packages before installing any of them
+        if self.download_parallelism > 0 and not dry_run:
+            self.download_ahead(packagesList)
+
+        # If transaction mode is enabled, update packages by chunks, each chunk in a single apt transaction
+        if self.transaction_chunk_size > 0:
+            self.update_transaction(packagesList, exit_on_package_update_error, dry_run, update_status_msg, log)
+            return
+
         # Count the number of packages to update
         packages_to_update_count = 0
         for pkg in packagesList:
@@ -552,7 +1241,10 @@ class Apt:
                     continue
 
                 # Define the command to update the package
-                cmd = 'DEBIAN_FRONTEND=noninteractive /usr/bin/apt-get install ' + pkg['name'] + '=' + pkg['target_version'] +  ' -y'
+                cmd = 'DEBIAN_FRONTEND=noninteractive /usr/bin/apt-get install ' + shlex.quote(pkg['name'] + '=' + pkg['target_version']) + ' -y'
+
+                # Apply package exclusions
+                cmd += self.get_exclusion_options()
 
                 # If --keep-oldconf is True, then keep the old configuration files
                 if self.keep_oldconf:
@@ -562,37 +1254,14 @@ class Apt:
                 if dry_run == True:
                     cmd += ' --dry-run'
 
-                popen = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True,
-                    shell = True
-                )
-
-                # Print lines as they are read
-                for line in popen.stdout:
-                    # Deal with carriage return
-                    parts = line.split('\r')
-                    for part in parts[:-1]:
-                        sys.stdout.write('\r' + '| ' + part.strip() + '\n')
-                        sys.stdout.flush()
-                    buffer = parts[-1]
-                    sys.stdout.write('\r' + '| ' + buffer.strip() + '\n')
-                    sys.stdout.flush()
-
-                # Deal with the carriage return of the last line
-                sys.stdout.write('\r')
-
-                # Wait for the command to finish
-                popen.wait()
+                returncode = self.run_update_command(cmd)
 
                 # Get log content
                 with open(log, 'r') as file:
                     log_content = Utils().clean_log(file.read())
 
                 # If command failed, either raise an exception or print a warning
-                if popen.returncode != 0:
+                if returncode != 0:
                     # Add the package to the list of failed packages
                     self.summary['update']['failed']['count'] += 1
 
@@ -611,9 +1280,6 @@ class Apt:
                         print(Fore.RED + '✕ ' + Style.RESET_ALL + 'Error while updating ' + pkg['name'] + '.')
                         continue
 
-                # Close the pipe
-                popen.stdout.close()
-
                 # If command succeeded, increment the success counter
                 self.summary['update']['success']['count'] += 1
 
@@ -626,7 +1292,164 @@ class Apt:
                 # Print a success message
                 print(Fore.GREEN + '✔ ' + Style.RESET_ALL + pkg['name'] + ' updated successfully.')
 
-        del log, packagesList, pkg, cmd, popen, line, parts, buffer, log_content
+        del log, packagesList, pkg, cmd, returncode, log_content
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Update packages by chunks, each chunk being installed in a single apt transaction
+    #   Success or failure is then attributed to each package by checking its installed version
+    #
+    #-----------------------------------------------------------------------------------------------
+    def update_transaction(self, packagesList, exit_on_package_update_error: bool, dry_run: bool, update_status_msg: str, log: str):
+        counter = 0
+
+        # Retrieve the packages to update
+        packages = [pkg for pkg in packagesList if pkg['install'] == True]
+
+        # Split the packages into chunks, to limit the number of packages impacted if a transaction fails
+        chunks = [packages[i:i + self.transaction_chunk_size] for i in range(0, len(packages), self.transaction_chunk_size)]
+
+        for chunk in chunks:
+            update_status(update_status_msg + ' (' + str(counter + 1) + '-' + str(counter + len(chunk)) + '/' + str(len(packages)) + ')')
+            counter += len(chunk)
+
+            # Before updating, check if packages are already in the latest version, if so, skip them
+            # It means that they have been updated previously by another package, probably because they were a dependency
+            chunk_to_update = []
+
+            for pkg in chunk:
+                if self.get_current_version(pkg['name']) == pkg['target_version']:
+                    print('\n' + Fore.GREEN + '✔ ' + Style.RESET_ALL + pkg['name'] + ' is already up to date (updated with another package).')
+
+                    # Mark the package as already updated
+                    self.summary['update']['success']['count'] += 1
+
+                    # Also add the package to the list of successful packages
+                    self.summary['update']['success']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': 'Already up to date (updated with another package).'
+                    }
+                    continue
+
+                chunk_to_update.append(pkg)
+
+            if len(chunk_to_update) == 0:
+                continue
+
+            # If log file exists, remove it
+            if Path(log).is_file():
+                Path(log).unlink()
+
+            with LogToFile(log):
+                print('\n▪ Updating ' + str(len(chunk_to_update)) + ' packages in a single transaction:')
+
+                for pkg in chunk_to_update:
+                    print('  ' + Fore.GREEN + pkg['name'] + Style.RESET_ALL + ' (' + pkg['current_version'] + ' → ' + pkg['target_version'] + ')')
+
+                # Define the command to update the packages
+                cmd = 'DEBIAN_FRONTEND=noninteractive /usr/bin/apt-get install ' + ' '.join(shlex.quote(pkg['name'] + '=' + pkg['target_version']) for pkg in chunk_to_update) + ' -y'
+
+                # Apply package exclusions
+                cmd += self.get_exclusion_options()
+
+                # If --keep-oldconf is True, then keep the old configuration files
+                if self.keep_oldconf:
+                    cmd += ' -o Dpkg::Options::=--force-confdef -o Dpkg::Options::=--force-confold'
+
+                # If --dry-run is True, then simulate the update
+                if dry_run == True:
+                    cmd += ' --dry-run'
+
+                returncode = self.run_update_command(cmd)
+
+            # Get log content
+            with open(log, 'r') as file:
+                log_content = Utils().clean_log(file.read())
+
+            # Attribute the result of the transaction to each package
+            failed_packages = []
+
+            for pkg in chunk_to_update:
+                # With dry-run, nothing is installed, so rely on the transaction result
+                if dry_run == True:
+                    success = returncode == 0
+
+                # Else, the package is updated if its installed version is now the target version
+                # (a failed transaction can still have updated some packages before failing)
+                else:
+                    success = self.get_current_version(pkg['name']) == pkg['target_version']
+
+                # Retrieve the lines of the transaction log related to the package
+                package_log = Utils().get_package_log_slice(log_content, pkg['name'], not success)
+
+                if success:
+                    self.summary['update']['success']['count'] += 1
+
+                    # Add the package to the list of successful packages
+                    self.summary['update']['success']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': package_log if package_log != '' else 'Updated in a transaction with other packages.'
+                    }
+
+                    print(Fore.GREEN + '✔ ' + Style.RESET_ALL + pkg['name'] + ' updated successfully.')
+                else:
+                    self.summary['update']['failed']['count'] += 1
+
+                    # Add the package to the list of failed packages, with the whole transaction log if no related lines were found
+                    self.summary['update']['failed']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': package_log if package_log != '' else log_content
+                    }
+
+                    print(Fore.RED + '✕ ' + Style.RESET_ALL + 'Error while updating ' + pkg['name'] + '.')
+
+                    failed_packages.append(pkg['name'])
+
+            # If error is critical, raise an exception to quit
+            if len(failed_packages) > 0 and exit_on_package_update_error == True:
+                raise Exception('Error while updating ' + ', '.join(failed_packages) + '.')
+
+            del chunk_to_update, cmd, returncode, log_content, failed_packages
+
+        del packages, chunks
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Execute an apt update command, print its output as it is read and return its exit code
+    #
+    #-----------------------------------------------------------------------------------------------
+    def run_update_command(self, cmd: str):
+        popen = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            shell = True
+        )
+
+        # Print lines as they are read
+        for line in popen.stdout:
+            # Deal with carriage return
+            parts = line.split('\r')
+            for part in parts[:-1]:
+                sys.stdout.write('\r' + '| ' + part.strip() + '\n')
+                sys.stdout.flush()
+            buffer = parts[-1]
+            sys.stdout.write('\r' + '| ' + buffer.strip() + '\n')
+            sys.stdout.flush()
+
+        # Deal with the carriage return of the last line
+        sys.stdout.write('\r')
+
+        # Wait for the command to finish
+        popen.wait()
+
+        # Close the pipe
+        popen.stdout.close()
+
+        return popen.returncode
 
 
     #-----------------------------------------------------------------------------------------------
@@ -652,223 +1475,230 @@ class Apt:
     #-----------------------------------------------------------------------------------------------
     #
     #   Parse all apt history log files and return a list of events (JSON)
+    #   If a cursor is provided, only the events that were not parsed yet are returned
+    #   The new cursor is then available in self.history_cursor
     #
     #-----------------------------------------------------------------------------------------------
-    def parse_history(self, history_files: list, entries_limit: int):
+    def parse_history(self, history_files: list, entries_limit: int, cursor: dict = None):
         # Initialize a limit counter which will be incremented until it reaches the entries_limit
         limit_counter = 0
 
         # Initialize a list of events
         events = []
 
+        # Retrieve the cursor of the previous parsing, if any:
+        # - files: inode of each history file => offset up to where it has been parsed, size, mtime and if it has been fully parsed
+        # - last_start_date: Start-Date of the newest event already parsed
+        incremental = cursor is not None and cursor.get('type') == 'apt'
+        files_cursor = cursor.get('files', {}) if incremental else {}
+        last_start_date = cursor.get('last_start_date', '') if incremental else ''
+
+        new_files_cursor = {}
+        new_last_start_date = last_start_date
+
         # Parse each apt history files
         for history_file in history_files:
+            # Quit if the limit of entries to send has been reached
+            if limit_counter > entries_limit:
+                break
+
+            stat = os.stat(history_file)
+            inode = str(stat.st_ino)
+
             # If file is empty (e.g. file has been rotated), ignore it
-            if os.stat(history_file).st_size == 0:
+            if stat.st_size == 0:
                 continue
 
-            # Retrieve all Start-Date in the history file
-            result = subprocess.run(
-                ['zgrep "^Start-Date:*" ' + history_file],
-                stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-                stderr = subprocess.PIPE,
-                universal_newlines = True, # Alias of 'text = True'
-                shell = True
-            )
+            offset = 0
+            resume = False
+            file_cursor = files_cursor.get(inode)
 
-            # Quit if an error occurred
-            if result.returncode != 0:
-                raise Exception('no result matching the pattern "Start-Date" in file ' + history_file)
-
-            # Split the result into a list
-            start_dates = result.stdout.strip().split('\n')
-
-            for start_date in start_dates:
-                # Reset all variables for each event
-                installed_packages = ''
-                upgraded_packages = ''
-                removed_packages = ''
-                purged_packages = ''
-                downgraded_packages = ''
-                reinstalled_packages = ''
-                installed_packages_json = ''
-                upgraded_packages_json = ''
-                removed_packages_json = ''
-                purged_packages_json = ''
-                downgraded_packages_json = ''
-                reinstalled_packages_json = ''
-
-                # Quit if the limit of entries to send has been reached
-                if limit_counter > entries_limit:
-                    break
-
-                # Retrieve the event block : from the start date (START_DATE) to the next empty line
-                # If the file is compressed, we must use zcat to read it
+            if file_cursor is not None:
+                # Compressed files are not written anymore, if it has already been fully parsed, ignore it
                 if history_file.endswith('.gz'):
-                    result = subprocess.run(
-                        ['zcat ' + history_file + ' | sed -n "/' + start_date + '/,/^$/p"'],
-                        stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-                        stderr = subprocess.PIPE,
-                        universal_newlines = True, # Alias of 'text = True'
-                        shell = True
-                    )
-
-                # If the file is not compressed, we can use sed directly
-                else:
-                    result = subprocess.run(
-                        ['sed -n "/' + start_date + '/,/^$/p" ' + history_file],
-                        stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-                        stderr = subprocess.PIPE,
-                        universal_newlines = True, # Alias of 'text = True'
-                        shell = True
-                    )
-
-                if result.returncode != 0:
-                    raise Exception('no event found for date "' + start_date + '" in file ' + history_file)
-
-                # Retrieve event block lines
-                event = result.stdout.strip()
-
-                # From the retrieved event block, we can get the start date and time and the end date and time
-                # If the event block does not contain a Start-Date or an End-Date, ignore the event (the event might be
-                # incomplete because the log file was being written at the same time)
-                if not re.search(r'^Start-Date: (.+)', event):
-                    continue
-                if not re.search(r'End-Date: (.+)', event):
-                    continue
+                    if file_cursor.get('complete') and file_cursor.get('size') == stat.st_size and file_cursor.get('mtime') == stat.st_mtime_ns:
+                        new_files_cursor[inode] = file_cursor
+                        continue
 
-                date_start = re.search(r'^Start-Date: (.+)', event).group(1).split()[0].strip()
-                time_start = re.search(r'^Start-Date: (.+)', event).group(1).split()[1].strip()
-                date_end = re.search(r'End-Date: (.+)', event).group(1).split()[0].strip()
-                time_end = re.search(r'End-Date: (.+)', event).group(1).split()[1].strip()
+                # The inode is kept when logrotate renames the file (history.log => history.log.1), so resume from the last offset
+                # If the file is smaller than the offset, it has been truncated, so parse it from the beginning
+                elif file_cursor.get('offset', 0) <= stat.st_size:
+                    offset = file_cursor.get('offset', 0)
+                    resume = True
 
-                # Retrieve the event command, ignore event if no command found
-                if not re.search(r'Commandline: (.+)', event):
-                    continue
+            position = offset
+            complete = True
 
-                command = re.search(r'Commandline: (.+)', event).group(1).strip()
-
-                # Retrieve packages installed, removed, upgraded, downgraded, etc.
-                if re.search(r'Install: (.+)', event):
-                    installed_packages = re.search(r'Install: (.+)', event).group(1).strip()
-                if re.search(r'Upgrade: (.+)', event):
-                    upgraded_packages = re.search(r'Upgrade: (.+)', event).group(1).strip()
-                if re.search(r'Remove: (.+)', event):
-                    removed_packages = re.search(r'Remove: (.+)', event).group(1).strip()
-                if re.search(r'Purge: (.+)', event):
-                    purged_packages = re.search(r'Purge: (.+)', event).group(1).strip()
-                if re.search(r'Downgrade: (.+)', event):
-                    downgraded_packages = re.search(r'Downgrade: (.+)', event).group(1).strip()
-                if re.search(r'Reinstall: (.+)', event):
-                    reinstalled_packages = re.search(r'Reinstall: (.+)', event).group(1).strip()
-
-                # Parse packages lists and convert them to JSON
-                if installed_packages != '':
-                    installed_packages_json = self.parse_packages_line_to_json(installed_packages, 'install')
-
-                if upgraded_packages != '':
-                    upgraded_packages_json = self.parse_packages_line_to_json(upgraded_packages, 'upgrade')
-
-                if removed_packages != '':
-                    removed_packages_json = self.parse_packages_line_to_json(removed_packages, 'remove')
-
-                if purged_packages != '':
-                    purged_packages_json = self.parse_packages_line_to_json(purged_packages, 'purge')
-
-                if downgraded_packages != '':
-                    downgraded_packages_json = self.parse_packages_line_to_json(downgraded_packages, 'downgrade')
-
-                if reinstalled_packages != '':
-                    reinstalled_packages_json = self.parse_packages_line_to_json(reinstalled_packages, 'reinstall')
-
-                # Create the event JSON object
-                event = {
-                    'date_start': date_start,
-                    'time_start': time_start,
-                    'date_end': date_end,
-                    'time_end': time_end,
-                    'command': command
-                }
-
-                if installed_packages_json != '':
-                    event['installed'] = installed_packages_json
+            try:
+                for event, event_end_position in self.read_history_events(history_file, offset):
+                    # Quit if the limit of entries to send has been reached
+                    if limit_counter > entries_limit:
+                        complete = False
+                        break
 
-                if upgraded_packages_json != '':
-                    event['upgraded'] = upgraded_packages_json
+                    position = event_end_position
 
-                if removed_packages_json != '':
-                    event['removed'] = removed_packages_json
+                    # Ignore incomplete events
+                    if event is None:
+                        continue
 
-                if purged_packages_json != '':
-                    event['purged'] = purged_packages_json
+                    start_date = event['date_start'] + ' ' + event['time_start']
 
-                if downgraded_packages_json != '':
-                    event['downgraded'] = downgraded_packages_json
+                    # Files that are not resumed from an offset (e.g. history.log compressed by logrotate) may contain
+                    # events that have already been parsed, ignore them
+                    if incremental and not resume and start_date <= last_start_date:
+                        continue
 
-                if reinstalled_packages_json != '':
-                    event['reinstalled'] = reinstalled_packages_json
+                    # Add the event to the list of events
+                    events.append(event)
 
-                # Add the event to the list of events
-                events.append(event)
+                    limit_counter += 1
 
-                limit_counter += 1
+                    if start_date > new_last_start_date:
+                        new_last_start_date = start_date
+            except Exception as e:
+                raise Exception('could not parse apt history file ' + history_file + ': ' + str(e))
 
-                del installed_packages, upgraded_packages, removed_packages, purged_packages
-                del downgraded_packages, reinstalled_packages, installed_packages_json
-                del upgraded_packages_json, removed_packages_json, purged_packages_json
-                del downgraded_packages_json, reinstalled_packages_json, event
-                del date_start, time_start, date_end, time_end
-                del command
+            new_files_cursor[inode] = {
+                'offset': position,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'complete': complete
+            }
 
-            del history_file, result, start_dates
+        # Files that do not exist anymore are removed from the cursor
+        self.history_cursor = {
+            'type': 'apt',
+            'files': new_files_cursor,
+            'last_start_date': new_last_start_date
+        }
 
-        del history_files
+        del history_files, files_cursor, new_files_cursor
 
         return events
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Parse a string of one or multiple package(s) into a list of JSON objects
+    #   Read an apt history log file (compressed or not) in a single pass, starting from offset (uncompressed files only)
+    #   An event block starts with a Start-Date line and ends with an empty line
+    #   Yield each event (JSON, or None if the event block is incomplete) and the offset right after its block
     #
     #-----------------------------------------------------------------------------------------------
-    def parse_packages_line_to_json(self, packages: str, action: str):
-        packages_json = []
+    def read_history_events(self, history_file: str, offset: int = 0):
+        block = {}
 
-        # If there is more than one package on the same line
-        # e.g.
-        # libc6-i386:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc6:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc6:i386 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc-dev-bin:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc6-dbg:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc6-dev:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8)
-        if re.search(r"\),", packages):
-            # Split all the packages from the same line into a list
-            packages = re.sub(r"\),", "\n", packages).split('\n')
-
-        # Else if there is only one package on the same line, just split the line into a list
+        # If the file is compressed, read it through gzip
+        if history_file.endswith('.gz'):
+            file = gzip.open(history_file, 'rb')
+            position = 0
         else:
-            packages = packages.split('\n')
+            file = open(history_file, 'rb')
+            file.seek(offset)
+            position = offset
+
+        with file:
+            for line in file:
+                line_position = position
+                position += len(line)
+
+                line = line.decode('utf-8', errors = 'replace').strip()
+
+                # An empty line ends the current event block
+                if line == '':
+                    if block:
+                        yield self.build_history_event(block), position
+                        block = {}
+                    continue
 
-        # For all packages in the list, retrieve the name and the version
-        for package in packages:
-            # First, remove extra spaces
-            package = package.strip()
+                match = HISTORY_LINE_REGEX.match(line)
+
+                if not match:
+                    continue
+
+                key = match.group(1)
+
+                # A Start-Date line always starts a new event block, even if the previous one was not terminated
+                if key == 'Start-Date':
+                    if block:
+                        yield self.build_history_event(block), line_position
+
+                    block = {}
+
+                # Keep the first occurrence of each key
+                if key not in block:
+                    block[key] = match.group(2).strip()
+
+        # Last event block of the file, if not terminated by an empty line
+        # The event might be incomplete because the log file was being written at the same time, in this case it is
+        # not yielded so that it is parsed again from its beginning next time
+        if block:
+            event = self.build_history_event(block)
+
+            if event is not None:
+                yield event, position
 
-            # Then, split the package into name and version
-            name = package.split(' ')[0]
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Build an event (JSON) from an apt history event block
+    #   Return None if the event block is incomplete
+    #
+    #-----------------------------------------------------------------------------------------------
+    def build_history_event(self, block: dict):
+        # If the event block does not contain a Start-Date, an End-Date or a command, ignore the event
+        if 'Start-Date' not in block or 'End-Date' not in block or 'Commandline' not in block:
+            return None
+
+        start = block['Start-Date'].split()
+        end = block['End-Date'].split()
+
+        if len(start) < 2 or len(end) < 2 or block['Commandline'] == '':
+            return None
+
+        # Create the event JSON object
+        event = {
+            'date_start': start[0],
+            'time_start': start[1],
+            'date_end': end[0],
+            'time_end': end[1],
+            'command': block['Commandline']
+        }
+
+        # Parse packages installed, removed, upgraded, downgraded, etc. and convert them to JSON
+        for key, action, event_key in HISTORY_ACTIONS:
+            if block.get(key, '') != '':
+                event[event_key] = self.parse_packages_line_to_json(block[key], action)
+
+        return event
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Parse a string of one or multiple package(s) into a list of JSON objects
+    #   e.g.
+    #   libc6-i386:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8), libc6:amd64 (2.35-0ubuntu3.7, 2.35-0ubuntu3.8)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def parse_packages_line_to_json(self, packages: str, action: str):
+        packages_json = []
+
+        # Each package is in the format "name[:arch] (version[, version|automatic])"
+        for match in HISTORY_PACKAGE_REGEX.finditer(packages):
+            name = match.group(1)
+            versions = match.group(2).split(',')
 
             # Depending on the action, the version to retrieve is on a different position
-            if action == 'install' or action == 'remove' or action == 'purge' or action == 'reinstall':
-                version = package.split(' ')[1]
             if action == 'upgrade' or action == 'downgrade':
-                version = package.split(' ')[2]
+                version = versions[1].strip() if len(versions) > 1 else ''
+            else:
+                version = versions[0].strip()
 
-            # Remove parenthesis, commas, colons and spaces from name and version
-            for char in ['(', ')', ',', ' ']:
-                name = name.replace(char, '')
-                version = version.replace(char, '')
+            # Remove architecture from name
+            name, _, arch = name.partition(':')
 
-            # Also remove architecture from name
-            for arch in [':amd64', ':i386', ':all', ':arm64', ':armhf', ':armel', ':ppc64el', ':s390x', ':mips', ':mips64el', ':mipsel', ':powerpc', ':powerpcspe', ':riscv64', ':s390', ':sparc', ':sparc64']:
-                if arch in name:
-                    name = name.replace(arch, '')
+            if arch != '' and arch not in HISTORY_ARCHITECTURES:
+                name = name + ':' + arch
 
             # If package name is empty (should not happen), ignore it
             if name == '':
@@ -884,8 +1714,6 @@ class Apt:
                 'version': version
             })
 
-            del name, version, char, arch
-
         del packages, action
 
         # Return the list of packages as JSON
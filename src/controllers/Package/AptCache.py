@@ -0,0 +1,88 @@
+# coding: utf-8
+
+# Import libraries
+import os
+import apt
+
+class AptCache:
+    def __init__(self):
+        self.cache = None
+        self.signature = None
+
+        # Files that are rewritten by dpkg and apt when the installed or available packages change
+        # If one of them changes, the cache must be reopened
+        self.watched_files = [
+            '/var/lib/dpkg/status',
+            '/var/cache/apt/pkgcache.bin'
+        ]
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return a signature of the watched files (inode, size and modification time)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_signature(self):
+        signature = []
+
+        for file in self.watched_files:
+            try:
+                stat = os.stat(file)
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                # File could be missing (e.g. pkgcache.bin disabled or cache has been cleared)
+                signature.append(None)
+
+        return tuple(signature)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the apt cache, open it if not opened yet or reopen it if the watched files have changed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get(self):
+        signature = self.get_signature()
+
+        try:
+            # Open cache if not opened yet
+            if self.cache is None:
+                self.cache = apt.Cache()
+
+            # Reopen cache if dpkg status or apt package cache have changed since the last opening
+            elif signature != self.signature:
+                self.cache.open(None)
+        except Exception as e:
+            self.cache = None
+            self.signature = None
+            raise Exception('could not open apt cache: ' + str(e))
+
+        # Opening the cache can regenerate pkgcache.bin, so retrieve the signature again
+        self.signature = self.get_signature()
+
+        return self.cache
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Force the cache to be reopened on next access
+    #
+    #-----------------------------------------------------------------------------------------------
+    def invalidate(self):
+        self.signature = None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Close the cache
+    #
+    #-----------------------------------------------------------------------------------------------
+    def close(self):
+        if self.cache is not None:
+            try:
+                self.cache.close()
+            except Exception:
+                pass
+
+        self.cache = None
+        self.signature = None
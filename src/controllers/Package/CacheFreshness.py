@@ -0,0 +1,95 @@
+# coding: utf-8
+
+# Import libraries
+import os
+import time
+import hashlib
+
+# Import classes
+from src.controllers.App.Utils import Utils
+
+class CacheFreshness:
+    def __init__(self, name: str = 'packages-cache'):
+        # The stamp remembers when the package lists have last been refreshed, by any linupdate process (CLI or agent)
+        self.stamp_file = Utils().get_state_file(name + '.refresh.json')
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return a signature of the sources files (repositories configuration)
+    #   If a source is added, removed or modified, the signature changes and the package lists must be refreshed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_sources_signature(self, sources_files: list) -> str:
+        signature = hashlib.sha1()
+
+        for file in sorted(sources_files):
+            try:
+                stat = os.stat(file)
+                signature.update((file + ' ' + str(stat.st_size) + ' ' + str(stat.st_mtime_ns) + '\n').encode())
+            except OSError:
+                continue
+
+        return signature.hexdigest()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load the stamp, return None if there is no stamp yet (or if it is unreadable, meaning a refresh)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load(self):
+        return Utils().load_state_file(self.stamp_file, ['last_refresh', 'sources'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the package lists are recent enough to be reused:
+    #   - refreshed less than ttl minutes ago, by linupdate (stamp) or by the package manager itself (lists_mtime,
+    #     the time of the last successful refresh recorded by the package manager, e.g. apt update-success-stamp
+    #     written by apt daily timer)
+    #   - and sources have not changed since the last refresh by linupdate
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_fresh(self, ttl: int, sources_files: list, lists_mtime: float = None) -> bool:
+        # A ttl of 0 means always refresh
+        if ttl <= 0:
+            return False
+
+        stamp = self.load()
+
+        if stamp is None:
+            return False
+
+        if stamp['sources'] != self.get_sources_signature(sources_files):
+            return False
+
+        last_refresh = stamp['last_refresh']
+
+        if lists_mtime is not None:
+            last_refresh = max(last_refresh, lists_mtime)
+
+        return not Utils().is_expired(last_refresh, ttl * 60)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save the stamp after a refresh
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save(self, sources_files: list):
+        stamp = {
+            'last_refresh': time.time(),
+            'sources': self.get_sources_signature(sources_files)
+        }
+
+        Utils().save_state_file(self.stamp_file, stamp)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the stamp, next refresh will not be skipped
+    #
+    #-----------------------------------------------------------------------------------------------
+    def reset(self):
+        Utils().remove_state_file(self.stamp_file)
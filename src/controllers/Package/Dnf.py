@@ -2,10 +2,16 @@
 
 # Import libraries
 import os
+import glob
 import subprocess
 import time
 import re
-import configparser
+import shlex
+import shutil
+import sqlite3
+from datetime import datetime
+from contextlib import closing
+from functools import cmp_to_key
 from pathlib import Path
 from dateutil import parser as dateutil_parser
 from colorama import Fore, Style
@@ -13,12 +19,133 @@ from colorama import Fore, Style
 # Import classes
 from src.controllers.LogToFile import LogToFile
 from src.controllers.App.Utils import Utils
+from src.controllers.Package.PackageNameIndex import PackageNameIndex, is_pattern
+from src.controllers.Lock import get_process_name, is_process_running, wait_for_process_exit
 from src.controllers.Status import update_status, save_status, restore_status
 
+# Rpm database files, depending on the rpm version and the distribution
+RPMDB_FILES = [
+    '/var/lib/rpm/rpmdb.sqlite',
+    '/var/lib/rpm/rpmdb.sqlite-wal',
+    '/var/lib/rpm/Packages',
+    '/usr/lib/sysimage/rpm/rpmdb.sqlite',
+    '/usr/lib/sysimage/rpm/rpmdb.sqlite-wal'
+]
+
+# Total download size in dnf transaction summary, e.g. "Total download size: 12 M" (dnf4) or "Need to download 12 MiB." (dnf5)
+DOWNLOAD_SIZE_REGEX = re.compile(r'(?:Total download size:|Need to download) ([0-9.]+) ?([kKMG]?)i?B?')
+
+# Download size units
+DOWNLOAD_SIZE_UNITS = {'': 1, 'k': 1024, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Dnf transaction history databases (dnf5 first, as dnf4 database can remain after an upgrade to dnf5)
+HISTORY_DATABASES = [
+    ('/usr/lib/sysimage/libdnf5/transaction_history.sqlite', 'dnf5'),
+    ('/var/lib/dnf/history.sqlite', 'dnf4')
+]
+
+# Dnf4 transaction item actions => history operation ('Downgraded', 'Upgraded', 'Obsoleted', 'Reinstalled' and
+# 'Reason Change' items are ignored, like with 'dnf history info')
+HISTORY_DNF4_ACTIONS = {
+    1: 'install',
+    2: 'downgrade',
+    6: 'upgrade',
+    8: 'remove',
+    9: 'reinstall'
+}
+
+# Dnf5 transaction item actions => history operation ('Replaced' and 'Reason Change' items are ignored)
+HISTORY_DNF5_ACTIONS = {
+    'Install': 'install',
+    'Downgrade': 'downgrade',
+    'Upgrade': 'upgrade',
+    'Remove': 'remove',
+    'Reinstall': 'reinstall'
+}
+
+# Segments of a rpm version compared by rpmvercmp (other characters are separators)
+RPM_VERSION_SEGMENT_REGEX = re.compile(r'[0-9]+|[a-zA-Z]+|~|\^')
+
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Compare two rpm versions (or version-release) like rpmvercmp: return 1 if version1 is newer, -1 if version2 is
+#   newer, 0 if they are equal
+#   Numeric segments are newer than alphabetic ones, '~' sorts before anything (e.g. 1.0~rc1 < 1.0) and '^' after
+#   the end of a version but before any other segment (e.g. 1.0 < 1.0^git1 < 1.0.1)
+#
+#-----------------------------------------------------------------------------------------------
+def compare_rpm_versions(version1: str, version2: str) -> int:
+    if version1 == version2:
+        return 0
+
+    segments1 = RPM_VERSION_SEGMENT_REGEX.findall(version1)
+    segments2 = RPM_VERSION_SEGMENT_REGEX.findall(version2)
+
+    for i in range(max(len(segments1), len(segments2))):
+        segment1 = segments1[i] if i < len(segments1) else None
+        segment2 = segments2[i] if i < len(segments2) else None
+
+        if segment1 == '~' or segment2 == '~':
+            if segment1 != '~':
+                return 1
+            if segment2 != '~':
+                return -1
+            continue
+
+        if segment1 == '^' or segment2 == '^':
+            if segment1 is None:
+                return -1
+            if segment2 is None:
+                return 1
+            if segment1 != '^':
+                return 1
+            if segment2 != '^':
+                return -1
+            continue
+
+        if segment1 is None:
+            return -1
+        if segment2 is None:
+            return 1
+
+        if segment1.isdigit() and segment2.isdigit():
+            if int(segment1) != int(segment2):
+                return 1 if int(segment1) > int(segment2) else -1
+        elif segment1.isdigit():
+            return 1
+        elif segment2.isdigit():
+            return -1
+        elif segment1 != segment2:
+            return 1 if segment1 > segment2 else -1
+
+    return 0
+
 class Dnf:
     def __init__(self):
         self.dnf_command = '/usr/bin/dnf --disableplugin subscription-manager'
 
+        # Maximum number of packages to update in a single dnf transaction (0 = one package at a time)
+        self.transaction_chunk_size = 0
+
+        # Number of parallel downloads when downloading the packages before installing them (0 = download-ahead disabled)
+        self.download_parallelism = 0
+
+        # Maximum time to wait for the dnf lock to be released, in seconds
+        self.lock_timeout = 60
+
+        # Packages excluded from the update (see get_exclusion_options())
+        self.exclusions = []
+
+        # Cursor resulting from the last history parsing (see parse_history())
+        self.history_cursor = None
+
+        # Installed packages and available updates, indexed by 'name.arch' (see get_installed_index() and get_upgrades_index())
+        self.installed_index = None
+        self.installed_index_signature = None
+        self.upgrades_index = None
+        self.upgrades_index_signature = None
+
 
     #-----------------------------------------------------------------------------------------------
     #
@@ -63,15 +190,93 @@ class Dnf:
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Return the current version of a package
+    #   Return a signature of the rpm database files (inode, size and modification time)
+    #   If the signature changes, packages have been installed, updated or removed
     #
     #-----------------------------------------------------------------------------------------------
-    def get_current_version(self, package):
-        # Get the current version of the package
-        # Use rpm instead of dnf because dnf returns exit code 0 even when the package is not installed
-        # e.g. rpm -q --qf="%{version}-%{release}.%{arch}" wget
+    def get_rpmdb_signature(self):
+        signature = []
+
+        for file in RPMDB_FILES:
+            try:
+                stat = os.stat(file)
+                signature.append((file, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                continue
+
+        return tuple(signature)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the index of installed packages, built with a single rpm query and kept until the rpm database changes
+    #   Several versions of a package can be installed at the same time (installonly packages, e.g. kernel)
+    #   e.g. {'wget.x86_64': [{'name': 'wget', 'arch': 'x86_64', 'version': '1.21.1-7.el9.x86_64', 'epoch': '0', 'installtime': 1700000000}]}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_installed_index(self):
+        signature = self.get_rpmdb_signature()
+
+        if self.installed_index is not None and signature == self.installed_index_signature:
+            return self.installed_index
+
+        # e.g. rpm -qa --qf="%{name} %{arch} %{epochnum} %{version}-%{release}.%{arch} %{installtime}\n"
+        result = subprocess.run(
+            ['/usr/bin/rpm -qa --qf="%{name} %{arch} %{epochnum} %{version}-%{release}.%{arch} %{installtime}\\n"'],
+            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+            stderr = subprocess.PIPE,
+            universal_newlines = True, # Alias of 'text = True'
+            shell = True
+        )
+
+        # Quit if an error occurred
+        if result.returncode != 0:
+            raise Exception('could not retrieve installed packages from rpm database: ' + result.stderr)
+
+        index = {}
+
+        for line in result.stdout.splitlines():
+            line = line.split()
+
+            if len(line) != 5:
+                continue
+
+            # gpg-pubkey entries are not packages
+            if line[0] == 'gpg-pubkey':
+                continue
+
+            index.setdefault(line[0] + '.' + line[1], []).append({
+                'name': line[0],
+                'arch': line[1],
+                'epoch': line[2],
+                'version': line[3],
+                'installtime': int(line[4]) if line[4].isnumeric() else 0
+            })
+
+        self.installed_index = index
+        self.installed_index_signature = signature
+
+        del result
+
+        return index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the index of available package updates, built with a single repoquery and kept until the rpm database
+    #   or the dnf cache changes
+    #   e.g. {'wget.x86_64': {'name': 'wget', 'arch': 'x86_64', 'version': '1.21.1-8.el9.x86_64', 'repository': 'appstream'}}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_upgrades_index(self):
+        signature = self.get_rpmdb_signature()
+
+        if self.upgrades_index is not None and signature == self.upgrades_index_signature:
+            return self.upgrades_index
+
+        # e.g. dnf repoquery --upgrades --latest-limit 1 -q -a --qf="%{name} %{arch} %{version}-%{release}.%{arch} %{repoid}"
         result = subprocess.run(
-            ['/usr/bin/rpm -q --qf="%{version}-%{release}.%{arch}" ' + package],
+            [self.dnf_command + ' repoquery --upgrades --latest-limit 1 -a -q --qf="%{name} %{arch} %{version}-%{release}.%{arch} %{repoid}"'],
             stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
             stderr = subprocess.PIPE,
             universal_newlines = True, # Alias of 'text = True'
@@ -80,9 +285,110 @@ class Dnf:
 
         # Quit if an error occurred
         if result.returncode != 0:
-            raise Exception('could not retrieve current version of package ' + package + ': ' + result.stderr)
+            raise Exception('could not retrieve available packages list: ' + result.stderr)
+
+        index = {}
+
+        for line in result.stdout.splitlines():
+            line = line.split()
+
+            if len(line) != 4:
+                continue
+
+            index[line[0] + '.' + line[1]] = {
+                'name': line[0],
+                'arch': line[1],
+                'version': line[2],
+                'repository': line[3]
+            }
+
+        self.upgrades_index = index
+        self.upgrades_index_signature = signature
+
+        del result
+
+        return index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Forget the installed packages and available updates indexes, they will be rebuilt on next access
+    #
+    #-----------------------------------------------------------------------------------------------
+    def invalidate_indexes(self):
+        self.installed_index = None
+        self.upgrades_index = None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the entries of an index matching a package name or a 'name.arch'
+    #   Installed packages index values are lists of entries, available updates index values are single entries
+    #
+    #-----------------------------------------------------------------------------------------------
+    def find_in_index(self, index: dict, package: str):
+        if package in index:
+            return list(index[package]) if isinstance(index[package], list) else [index[package]]
+
+        entries = []
+
+        for value in index.values():
+            entries += [entry for entry in (value if isinstance(value, list) else [value]) if entry['name'] == package]
+
+        return entries
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the installed package entry with the newest version (epoch, then version-release)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_newest_entry(self, entries: list):
+        def compare(entry1, entry2):
+            epoch1 = int(entry1['epoch']) if entry1['epoch'].isnumeric() else 0
+            epoch2 = int(entry2['epoch']) if entry2['epoch'].isnumeric() else 0
+
+            if epoch1 != epoch2:
+                return 1 if epoch1 > epoch2 else -1
+
+            # Architecture suffix is not part of the version
+            return compare_rpm_versions(entry1['version'][:-len(entry1['arch']) - 1], entry2['version'][:-len(entry2['arch']) - 1])
+
+        return max(entries, key = cmp_to_key(compare))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the current version of a package
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_current_version(self, package):
+        # Get the current version of the package from the installed packages index
+        # e.g. 1.21.1-7.el9.x86_64
+        entries = self.find_in_index(self.get_installed_index(), package)
+
+        # Quit if the package is not installed
+        if len(entries) == 0:
+            raise Exception('could not retrieve current version of package ' + package + ': package ' + package + ' is not installed')
+
+        # If the package is installed in several versions (e.g. kernel) or for multiple architectures, return the newest one
+        return self.get_newest_entry(entries)['version']
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the installed versions of a list of packages
+    #   e.g. ['wget', 'glibc'] => {'wget': ['1.21.1-7.el9.x86_64'], 'glibc': ['2.34-83.el9.x86_64', '2.34-83.el9.i686']}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_current_versions(self, packages: list):
+        versions = {}
+        index = self.get_installed_index()
+
+        for package in packages:
+            versions[package] = [entry['version'] for entry in self.find_in_index(index, package)]
 
-        return result.stdout.strip()
+        return versions
 
 
     #-----------------------------------------------------------------------------------------------
@@ -93,6 +399,11 @@ class Dnf:
     def get_source_repository(self, package, version):
         repository = 'Unknown'
 
+        # First look for the package in the available updates index
+        for entry in self.find_in_index(self.get_upgrades_index(), package):
+            if entry['version'] == version:
+                return entry['repository']
+
         try:
             result = subprocess.run(
                 [self.dnf_command + ' repoquery --upgrades --latest-limit 1 -q -a --qf="%{repoid}" ' + package + '-' + version],
@@ -115,27 +426,85 @@ class Dnf:
         return repository
 
 
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the source repositories of a list of packages and their target versions, with a single repoquery
+    #   e.g. [{'name': 'curl', 'target_version': '7.76.1-29.el9.x86_64'}] => {'curl': 'baseos'}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_source_repositories(self, packages: list):
+        repositories = {}
+
+        if len(packages) == 0:
+            return repositories
+
+        # Default to 'Unknown' for packages that are not found
+        for package in packages:
+            repositories[package['name']] = 'Unknown'
+
+        # First look for the packages in the available updates index, only query the remaining ones
+        index = self.get_upgrades_index()
+        remaining_packages = []
+
+        for package in packages:
+            for entry in self.find_in_index(index, package['name']):
+                if entry['version'] == package['target_version']:
+                    repositories[package['name']] = entry['repository']
+
+            if repositories[package['name']] == 'Unknown':
+                remaining_packages.append(package)
+
+        packages = remaining_packages
+
+        if len(packages) == 0:
+            return repositories
+
+        try:
+            result = subprocess.run(
+                [self.dnf_command + ' repoquery --upgrades --latest-limit 1 -q --qf="%{name} %{repoid}" ' + ' '.join(shlex.quote(package['name'] + '-' + package['target_version']) for package in packages)],
+                stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+                stderr = subprocess.PIPE,
+                universal_newlines = True, # Alias of 'text = True'
+                shell = True
+            )
+
+            # Quit if an error occurred
+            if result.returncode != 0:
+                raise Exception('error while parsing dnf repoquery output: ' + result.stderr)
+
+            # Output is in the format "name repoid"
+            for line in result.stdout.splitlines():
+                line = line.split()
+
+                if len(line) != 2:
+                    continue
+
+                if line[0] in repositories:
+                    repositories[line[0]] = line[1]
+        except Exception as e:
+            raise Exception('could not get source repositories: ' + str(e))
+
+        return repositories
+
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Return the available version of a package
     #
     #-----------------------------------------------------------------------------------------------
     def get_available_version(self, package):
-        # Get the available version of the package
-        # e.g. dnf repoquery --upgrades --latest-limit 1 --qf="%{version}-%{release}.%{arch}" wget
-        result = subprocess.run(
-            [self.dnf_command + ' repoquery --upgrades --latest-limit 1 --qf="%{version}-%{release}.%{arch}" ' + package],
-            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-            stderr = subprocess.PIPE,
-            universal_newlines = True, # Alias of 'text = True'
-            shell = True
-        )
+        # Get the available version of the package from the available updates index
+        # e.g. 1.21.1-8.el9.x86_64
+        try:
+            entries = self.find_in_index(self.get_upgrades_index(), package)
+        except Exception as e:
+            raise Exception('could not retrieve available version of package ' + package + ': ' + str(e))
 
-        # Quit if an error occurred
-        if result.returncode != 0:
-            raise Exception('could not retrieve available version of package ' + package + ': ' + result.stderr)
+        # If there is no update available for the package, return an empty string
+        if len(entries) == 0:
+            return ''
 
-        return result.stdout.strip()
+        return entries[0]['version']
 
 
     #-----------------------------------------------------------------------------------------------
@@ -146,10 +515,163 @@ class Dnf:
     def get_installed_packages(self):
         list = []
 
-        # Get list of installed packages
-        # e.g. dnf repoquery -q -a --qf="%{name} %{version}-%{release}.%{arch} %{repoid}" --upgrades
+        try:
+            # Get list of installed packages from the installed packages index, including all the installed versions
+            for entries in self.get_installed_index().values():
+                for package in entries:
+                    version = package['version']
+
+                    # Add epoch if it is not equal to 0
+                    # e.g: zlib-devel 1.2.11-41.el9.x86_64 or NetworkManager 1:1.46.0-8.el9.x86_64
+                    if package['epoch'] != '0':
+                        version = package['epoch'] + ':' + version
+
+                    list.append({
+                        'name': package['name'],
+                        'version': version
+                    })
+
+                    del version
+
+            # Sort the list by package name
+            list.sort(key=lambda x: x['name'])
+
+        except Exception as e:
+            raise Exception('could not get installed packages: ' + str(e))
+
+        return list
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return list of available dnf packages, sorted by name
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_available_packages(self, useless_dist_upgrade: bool = False):
+        list = []
+        security_package_names = self.get_security_update_package_names()
+
+        # Get list of packages to update and list of installed packages, both indexed by 'name.arch'
+        upgrades_index = self.get_upgrades_index()
+        installed_index = self.get_installed_index()
+
+        for key, package in upgrades_index.items():
+            # Retrieve current version, from the same architecture if installed, else from any architecture
+            if key in installed_index:
+                current_version = self.get_newest_entry(installed_index[key])['version']
+            else:
+                current_version = self.get_current_version(package['name'])
+
+            list.append({
+                'name': package['name'],
+                'current_version': current_version,
+                'target_version': package['version'],
+                'repository': package['repository'],
+                'security': package['name'] in security_package_names
+            })
+
+            del current_version
+
+        # Sort the list by package name
+        list.sort(key=lambda x: x['name'])
+
+        del upgrades_index, installed_index
+
+        return list
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if a package is installed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_installed(self, package):
+        # Check if the package is in the installed packages index
+        return len(self.find_in_index(self.get_installed_index(), package)) > 0
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Resolve a list of package names or glob patterns (e.g. nginx*) in a single pass: installed or not,
+    #   current version, available version and source repository of the available version
+    #   e.g. ['wget'] => [{'name': 'wget', 'installed': True, 'current_version': '1.21.1-7.el9.x86_64', 'target_version': '1.21.1-8.el9.x86_64', 'repository': 'appstream'}]
+    #
+    #-----------------------------------------------------------------------------------------------
+    def resolve_packages(self, names: list):
+        resolved = []
+
+        try:
+            installed_index = self.get_installed_index()
+            upgrades_index = self.get_upgrades_index()
+
+            # Group index entries by package name, to avoid scanning the indexes for each package
+            installed_by_name = {}
+            upgrades_by_name = {}
+
+            for entries in installed_index.values():
+                for entry in entries:
+                    installed_by_name.setdefault(entry['name'], []).append(entry)
+
+            for entry in upgrades_index.values():
+                upgrades_by_name.setdefault(entry['name'], []).append(entry)
+
+            # Expand glob patterns against installed packages names, only if there are any
+            if any(is_pattern(name) for name in names):
+                names = PackageNameIndex(installed_by_name.keys()).expand_all(names)
+
+            for name in names:
+                package = {
+                    'name': name,
+                    'installed': False,
+                    'current_version': '',
+                    'target_version': '',
+                    'repository': 'Unknown'
+                }
+
+                # Package can be a name or a 'name.arch'
+                if name in installed_index:
+                    installed_entries = installed_index[name]
+                else:
+                    installed_entries = installed_by_name.get(name, [])
+
+                if name in upgrades_index:
+                    upgrades_entries = [upgrades_index[name]]
+                else:
+                    upgrades_entries = upgrades_by_name.get(name, [])
+
+                if len(installed_entries) > 0:
+                    package['installed'] = True
+
+                    # If the package is installed in several versions (e.g. kernel) or for multiple architectures, use the newest one
+                    package['current_version'] = self.get_newest_entry(installed_entries)['version']
+
+                    if len(upgrades_entries) > 0:
+                        package['target_version'] = upgrades_entries[0]['version']
+                        package['repository'] = upgrades_entries[0]['repository']
+
+                resolved.append(package)
+
+            del installed_index, upgrades_index, installed_by_name, upgrades_by_name
+        except Exception as e:
+            raise Exception('could not resolve packages: ' + str(e))
+
+        return resolved
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Clear dnf cache
+    #
+    #-----------------------------------------------------------------------------------------------
+    def clear_cache(self):
+        # Check if dnf lock is present
+        self.check_lock()
+
+        # Available updates will have to be retrieved again
+        self.invalidate_indexes()
+
         result = subprocess.run(
-            [self.dnf_command + ' repoquery --installed -a --qf="%{name} %{epoch}:%{version}-%{release}.%{arch}"'],
+            [self.dnf_command + ' clean all'],
             stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
             stderr = subprocess.PIPE,
             universal_newlines = True, # Alias of 'text = True'
@@ -158,231 +680,278 @@ class Dnf:
 
         # Quit if an error occurred
         if result.returncode != 0:
-            raise Exception('could not get installed packages: ' + result.stderr)
+            raise Exception('Error while clearing dnf cache: ' + result.stderr)
 
-        try:
-            # Split all lines and parse them
-            for line in result.stdout.split('\n'):
-                if line == '':
-                    continue
+        del result
 
-                # Split package name and version
-                # e.g: zlib-devel 0:1.2.11-41.el9.x86_64
-                package = line.split()
 
-                name = package[0]
-                version = package[1]
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Update dnf cache
+    #
+    #-----------------------------------------------------------------------------------------------
+    def update_cache(self, packages: list = None):
+        # Useless because dnf update command already updates the cache (expired metadata only)
+        # Only make sure that available updates will be retrieved again
+        self.invalidate_indexes()
 
-                # Remove epoch if it is equal to 0
-                if version.startswith('0:'):
-                    version = version[2:]
+        if not packages:
+            return
 
-                list.append({
-                    'name': name,
-                    'version': version
-                })
+        # If a list of packages is provided, force the refresh of the repositories providing these packages only,
+        # even if their metadata has not expired yet
+        repositories = self.get_packages_repositories(packages)
 
-                del package, name, version
+        if len(repositories) == 0:
+            return
 
-            # Sort the list by package name
-            list.sort(key=lambda x: x['name'])
+        result = subprocess.run(
+            [self.dnf_command + ' makecache --refresh -q ' + ' '.join('--repo=' + shlex.quote(repository) for repository in sorted(repositories))],
+            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+            stderr = subprocess.PIPE,
+            universal_newlines = True, # Alias of 'text = True'
+            shell = True
+        )
 
-        except Exception as e:
-            raise Exception('could not get installed packages: ' + str(e))
+        # Quit if an error occurred
+        if result.returncode != 0:
+            raise Exception('Error while refreshing dnf cache: ' + result.stderr)
 
         del result
 
-        return list
-
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Return list of available dnf packages, sorted by name
+    #   Return the repositories ids providing a list of packages (or glob patterns), from the metadata already in cache
+    #   e.g. ['curl'] => {'baseos'}
     #
     #-----------------------------------------------------------------------------------------------
-    def get_available_packages(self, useless_dist_upgrade: bool = False):
-        list = []
-        security_package_names = self.get_security_update_package_names()
+    def get_packages_repositories(self, packages: list):
+        repositories = set()
 
-        # Get list of packages to update sorted by name
-        # e.g. dnf repoquery --upgrades --latest-limit 1 -q -a --qf="%{name} %{version}-%{release}.%{arch} %{repoid}"
+        # -C: only use the metadata already in cache, do not refresh it
         result = subprocess.run(
-            [self.dnf_command + ' repoquery --upgrades --latest-limit 1 -a -q --qf="%{name} %{version}-%{release}.%{arch} %{repoid}"'],
+            [self.dnf_command + ' repoquery -C -q --qf="%{repoid}" ' + ' '.join(shlex.quote(package) for package in packages)],
             stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
             stderr = subprocess.PIPE,
             universal_newlines = True, # Alias of 'text = True'
             shell = True
         )
 
-        # Quit if an error occurred
+        # If there is no usable metadata in cache, no repository can be selected
         if result.returncode != 0:
-            raise Exception('could not retrieve available packages list: ' + result.stderr)
+            return repositories
 
-        # Split all lines and parse them
-        for line in result.stdout.split('\n'):
-            if line == '':
-                continue
+        for line in result.stdout.splitlines():
+            line = line.strip()
+
+            # Installed packages are not from a repository
+            if line and not line.startswith('@'):
+                repositories.add(line)
+
+        del result
+
+        return repositories
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the sources files (repositories configuration)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_sources_files(self):
+        return ['/etc/dnf/dnf.conf'] + glob.glob('/etc/yum.repos.d/*.repo')
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the time of the last metadata refresh by dnf makecache (e.g. dnf-makecache timer), if known
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_package_lists_mtime(self):
+        try:
+            return os.stat('/var/cache/dnf/last_makecache').st_mtime
+        except OSError:
+            return None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Get list of excluded packages
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_exclusion(self):
+        return list(self.exclusions)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Exclude specified package
+    #   The exclusion only applies to the dnf commands run by linupdate (see get_exclusion_options()),
+    #   /etc/dnf/dnf.conf is not modified, so no exclusion can be left behind after a crash
+    #
+    #-----------------------------------------------------------------------------------------------
+    def exclude(self, package):
+        if package not in self.exclusions:
+            self.exclusions.append(package)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove all package exclusions
+    #
+    #-----------------------------------------------------------------------------------------------
+    def remove_all_exclusions(self):
+        self.exclusions = []
+
+        self.remove_legacy_exclusions()
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the exclusions left on the system by previous linupdate versions, once
+    #   Previous versions excluded packages with an 'exclude' option in /etc/dnf/dnf.conf [main] section and removed it
+    #   on each run: an option still present after an upgrade of linupdate would otherwise block these packages forever
+    #   Only the option lines are removed, the rest of the file (including comments) is kept as is
+    #
+    #-----------------------------------------------------------------------------------------------
+    def remove_legacy_exclusions(self):
+        migration_file = Utils().get_state_file('legacy-exclusions.migrated.json')
+
+        if Utils().load_state_file(migration_file) is not None:
+            return
+
+        dnf_conf = '/etc/dnf/dnf.conf'
+
+        if Path(dnf_conf).is_file():
+            try:
+                with open(dnf_conf, 'r') as file:
+                    lines = file.readlines()
+
+                content = []
+                section = None
+
+                for line in lines:
+                    if re.match(r'^\s*\[.+\]', line):
+                        section = line.strip()[1:-1].strip()
 
-            package = line.split(' ')
+                    # Skip the option and its continuation lines
+                    elif section == 'main' and re.match(r'^exclude\s*=', line):
+                        section = 'main:exclude'
+                        continue
 
-            # Retrieve current version
-            current_version = self.get_current_version(package[0])
+                    elif section == 'main:exclude':
+                        if line[:1] in (' ', '\t') and line.strip() != '':
+                            continue
+                        section = 'main'
 
-            list.append({
-                'name': package[0],
-                'current_version': current_version,
-                'target_version': package[1],
-                'repository': package[2],
-                'security': package[0] in security_package_names
-            })
+                    content.append(line)
 
-            del package, current_version
+                if content != lines:
+                    with open(dnf_conf + '.tmp', 'w') as file:
+                        file.writelines(content)
 
-        del result
+                    shutil.copymode(dnf_conf, dnf_conf + '.tmp')
+                    os.replace(dnf_conf + '.tmp', dnf_conf)
+            except Exception as e:
+                raise Exception('could not remove previous exclusions from ' + dnf_conf + ': ' + str(e))
 
-        return list
+        Utils().save_state_file(migration_file, {'date': time.time()})
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Return True if a package is installed
+    #   Return the dnf options to apply the package exclusions to a dnf command
     #
     #-----------------------------------------------------------------------------------------------
-    def is_installed(self, package):
-        # Check if the package is installed
-        # e.g. dnf list installed wget
-        result = subprocess.run(
-            ['/usr/bin/rpm -q ' + package],
-            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
-            stderr = subprocess.PIPE,
-            universal_newlines = True, # Alias of 'text = True'
-            shell = True
-        )
-
-        # If return code is not 0, package is not installed
-        if result.returncode != 0:
-            return False
+    def get_exclusion_options(self):
+        if len(self.exclusions) == 0:
+            return ''
 
-        return True
+        return ' --exclude=' + shlex.quote(','.join(self.exclusions))
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Clear dnf cache
+    #   Return the size to download to install a list of packages in their target version, including dependencies
+    #   Return None if it could not be determined from the transaction summary
     #
     #-----------------------------------------------------------------------------------------------
-    def clear_cache(self):
-        # Check if dnf lock is present
-        self.check_lock
-
+    def get_download_size(self, packagesList):
+        # Only display the transaction summary (--assumeno)
         result = subprocess.run(
-            [self.dnf_command + ' clean all'],
+            [self.dnf_command + ' update --assumeno ' + ' '.join(shlex.quote(pkg['name'] + '-' + pkg['target_version']) for pkg in packagesList) + self.get_exclusion_options()],
             stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
             stderr = subprocess.PIPE,
             universal_newlines = True, # Alias of 'text = True'
             shell = True
         )
 
-        # Quit if an error occurred
-        if result.returncode != 0:
-            raise Exception('Error while clearing dnf cache: ' + result.stderr)
-
-        del result
+        match = DOWNLOAD_SIZE_REGEX.search(result.stdout)
 
+        if not match:
+            return None
 
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Update dnf cache
-    #
-    #-----------------------------------------------------------------------------------------------
-    def update_cache(self):
-        # Useless because dnf update command already updates the cache
-        return
+        return int(float(match.group(1)) * DOWNLOAD_SIZE_UNITS[match.group(2)])
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Get list of excluded packages
+    #   Download all the packages to update (and their dependencies) into the dnf cache before installing any of them,
+    #   so that installs run from the local cache and a network failure aborts the run before any package has changed
     #
     #-----------------------------------------------------------------------------------------------
-    def get_exclusion(self):
-        # Get dnf.conf file content
-        try:
-            # Parse the content of dnf.conf, it's like a ini file
-            dnf_config = configparser.ConfigParser()
-            dnf_config.read('/etc/dnf/dnf.conf')
-        except Exception as e:
-            raise Exception('could not retrieve /etc/dnf/dnf.conf content: ' + str(e))
-
-        # If exclude is not present in the file, return an empty list
-        if not dnf_config.has_option('main', 'exclude'):
-            return []
+    def download_ahead(self, packagesList):
+        packages = [pkg for pkg in packagesList if pkg['install'] == True]
 
-        exclude = dnf_config.get('main', 'exclude').split(' ')
+        if len(packages) == 0:
+            return
 
-        del dnf_config
+        update_status('Downloading packages')
 
-        # Else return the list of excluded packages
-        return exclude
+        # dnf5 cache directory, or dnf4 cache directory
+        if os.path.isdir('/var/cache/libdnf5'):
+            cache_dir = '/var/cache/libdnf5'
+        else:
+            cache_dir = '/var/cache/dnf'
 
-
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Exclude specified package
-    #
-    #-----------------------------------------------------------------------------------------------
-    def exclude(self, package):
-        # Get dnf.conf file content
+        # Verify there is enough space to download the packages
         try:
-            # Parse the content of dnf.conf, it's like a ini file
-            dnf_config = configparser.ConfigParser()
-            dnf_config.read('/etc/dnf/dnf.conf')
+            download_size = self.get_download_size(packages)
+            free_space = shutil.disk_usage(cache_dir).free
         except Exception as e:
-            raise Exception('could not retrieve /etc/dnf/dnf.conf content: ' + str(e))
-
-        # If exclude is not present in the file, add it
-        if not dnf_config.has_option('main', 'exclude'):
-            dnf_config.set('main', 'exclude', '')
+            raise Exception('could not compute packages download size: ' + str(e))
 
-        # Add the package to the list of excluded packages
-        dnf_config.set('main', 'exclude', dnf_config.get('main', 'exclude') + ' ' + package)
+        if download_size is None:
+            print('\n▪ Downloading ' + str(len(packages)) + ' packages before installing them')
+        else:
+            print('\n▪ Downloading ' + str(len(packages)) + ' packages (' + str(round(download_size / 1024 / 1024, 1)) + ' MB) before installing them')
 
-        # Write the new content to the file
-        try:
-            with open('/etc/dnf/dnf.conf', 'w') as configfile:
-                dnf_config.write(configfile)
+            if download_size > free_space:
+                raise Exception('not enough space in ' + cache_dir + ' to download packages: ' + str(round(download_size / 1024 / 1024, 1)) + ' MB needed, ' + str(round(free_space / 1024 / 1024, 1)) + ' MB available')
 
-            del dnf_config
-        except Exception as e:
-            raise Exception('could not write to /etc/dnf/dnf.conf: ' + str(e))
+        # Download only, with parallel downloads
+        cmd = self.dnf_command + ' update -y -q --downloadonly --setopt=max_parallel_downloads=' + str(self.download_parallelism)
+        cmd += ' ' + ' '.join(shlex.quote(pkg['name'] + '-' + pkg['target_version']) for pkg in packages)
 
+        # Apply package exclusions
+        cmd += self.get_exclusion_options()
 
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Remove all package exclusions
-    #
-    #-----------------------------------------------------------------------------------------------
-    def remove_all_exclusions(self):
-        # Get dnf.conf file content
-        try:
-            # Parse the content of dnf.conf, it's like a ini file
-            dnf_config = configparser.ConfigParser()
-            dnf_config.read('/etc/dnf/dnf.conf')
-        except Exception as e:
-            raise Exception('could not retrieve /etc/dnf/dnf.conf content: ' + str(e))
+        result = subprocess.run(
+            [cmd],
+            stdout = subprocess.PIPE, # subprocess.PIPE & subprocess.PIPE are alias of 'capture_output = True'
+            stderr = subprocess.PIPE,
+            universal_newlines = True, # Alias of 'text = True'
+            shell = True
+        )
 
-        # Remove the exclude option from the file
-        if dnf_config.has_option('main', 'exclude'):
-            dnf_config.remove_option('main', 'exclude')
+        # Abort the update if the packages could not be downloaded, nothing has been installed yet
+        if result.returncode != 0:
+            raise Exception('could not download packages: ' + result.stderr)
 
-        # Write the new content to the file
-        try:
-            with open('/etc/dnf/dnf.conf', 'w') as configfile:
-                dnf_config.write(configfile)
+        print(Fore.GREEN + '✔ ' + Style.RESET_ALL + 'Packages downloaded')
 
-            del dnf_config
-        except Exception as e:
-            raise Exception('could not write to /etc/dnf/dnf.conf: ' + str(e))
+        del result
 
 
     #-----------------------------------------------------------------------------------------------
@@ -415,6 +984,15 @@ class Dnf:
             }
         }
 
+        # If download-ahead is enabled, download all the packages before installing any of them
+        if self.download_parallelism > 0 and not dry_run:
+            self.download_ahead(packagesList)
+
+        # If transaction mode is enabled, update packages by chunks, each chunk in a single dnf transaction
+        if self.transaction_chunk_size > 0:
+            self.update_transaction(packagesList, exit_on_package_update_error, dry_run, update_status_msg, log)
+            return
+
         # Count the number of packages to update
         packages_to_update_count = 0
         for pkg in packagesList:
@@ -461,6 +1039,9 @@ class Dnf:
                 # Define the command to update the package
                 cmd = self.dnf_command + ' update ' + pkg['name'] + '-' + pkg['target_version'] + ' -y'
 
+                # Apply package exclusions
+                cmd += self.get_exclusion_options()
+
                 # If dry_run is True, add the --setopt tsflags=test option to simulate the update
                 if dry_run == True:
                     cmd += ' --setopt tsflags=test'
@@ -526,24 +1107,187 @@ class Dnf:
 
         del log
 
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Update packages by chunks, each chunk being updated in a single dnf transaction
+    #   Success or failure is then attributed to each package by checking its installed versions in the rpm database
+    #
+    #-----------------------------------------------------------------------------------------------
+    def update_transaction(self, packagesList, exit_on_package_update_error: bool, dry_run: bool, update_status_msg: str, log: str):
+        counter = 0
+
+        # Retrieve the packages to update
+        packages = [pkg for pkg in packagesList if pkg['install'] == True]
+
+        # Split the packages into chunks, to limit the number of packages impacted if a transaction fails
+        chunks = [packages[i:i + self.transaction_chunk_size] for i in range(0, len(packages), self.transaction_chunk_size)]
+
+        for chunk in chunks:
+            update_status(update_status_msg + ' (' + str(counter + 1) + '-' + str(counter + len(chunk)) + '/' + str(len(packages)) + ')')
+            counter += len(chunk)
+
+            # Before updating, check if packages are already in the latest version, if so, skip them
+            # It means that they have been updated previously by another package, probably because they were a dependency
+            current_versions = self.get_current_versions([pkg['name'] for pkg in chunk])
+            chunk_to_update = []
+
+            for pkg in chunk:
+                if pkg['target_version'] in current_versions[pkg['name']]:
+                    print('\n' + Fore.GREEN + '✔ ' + Style.RESET_ALL + pkg['name'] + ' is already up to date (updated with another package).')
+
+                    # Mark the package as already updated
+                    self.summary['update']['success']['count'] += 1
+
+                    # Also add the package to the list of successful packages
+                    self.summary['update']['success']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': 'Already up to date (updated with another package).'
+                    }
+                    continue
+
+                chunk_to_update.append(pkg)
+
+            if len(chunk_to_update) == 0:
+                continue
+
+            # If log file exists, remove it
+            if Path(log).is_file():
+                Path(log).unlink()
+
+            with LogToFile(log):
+                print('\n▪ Updating ' + str(len(chunk_to_update)) + ' packages in a single transaction:')
+
+                for pkg in chunk_to_update:
+                    print('  ' + Fore.GREEN + pkg['name'] + Style.RESET_ALL + ' (' + pkg['current_version'] + ' → ' + pkg['target_version'] + ')')
+
+                # Define the command to update the packages
+                cmd = self.dnf_command + ' update ' + ' '.join(shlex.quote(pkg['name'] + '-' + pkg['target_version']) for pkg in chunk_to_update) + ' -y'
+
+                # Apply package exclusions
+                cmd += self.get_exclusion_options()
+
+                # If dry_run is True, add the --setopt tsflags=test option to simulate the update
+                if dry_run == True:
+                    cmd += ' --setopt tsflags=test'
+
+                popen = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    bufsize=1,
+                    universal_newlines=True,
+                    shell = True
+                )
+
+                # Print lines as they are read
+                for line in popen.stdout:
+                    line = line.replace('\r', '')
+                    print('| ' + line, end='')
+                    del line
+
+                # Wait for the command to finish
+                popen.wait()
+
+                # Close the pipe
+                popen.stdout.close()
+
+            # Get log content
+            with open(log, 'r') as file:
+                log_content = Utils().clean_log(file.read())
+
+            # Attribute the result of the transaction to each package
+            # A package is updated if its target version is now installed (with dry-run, nothing is installed, so rely on the transaction result)
+            if dry_run != True:
+                current_versions = self.get_current_versions([pkg['name'] for pkg in chunk_to_update])
+
+            failed_packages = []
+
+            for pkg in chunk_to_update:
+                if dry_run == True:
+                    success = popen.returncode == 0
+                else:
+                    success = pkg['target_version'] in current_versions[pkg['name']]
+
+                # Retrieve the lines of the transaction log related to the package
+                package_log = Utils().get_package_log_slice(log_content, pkg['name'], not success)
+
+                if success:
+                    self.summary['update']['success']['count'] += 1
+
+                    # Add the package to the list of successful packages
+                    self.summary['update']['success']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': package_log if package_log != '' else 'Updated in a transaction with other packages.'
+                    }
+
+                    print(Fore.GREEN + '✔ ' + Style.RESET_ALL + pkg['name'] + ' updated successfully.')
+                else:
+                    self.summary['update']['failed']['count'] += 1
+
+                    # Add the package to the list of failed packages, with the whole transaction log if no related lines were found
+                    self.summary['update']['failed']['packages'][pkg['name']] = {
+                        'version': pkg['target_version'],
+                        'log': package_log if package_log != '' else log_content
+                    }
+
+                    print(Fore.RED + '✕ ' + Style.RESET_ALL + 'Error while updating ' + pkg['name'] + '.')
+
+                    failed_packages.append(pkg['name'])
+
+            # If error is critical, raise an exception to quit
+            if len(failed_packages) > 0 and exit_on_package_update_error == True:
+                raise Exception('Error while updating ' + ', '.join(failed_packages) + '.')
+
+            del current_versions, chunk_to_update, cmd, popen, log_content, failed_packages
+
+        del packages, chunks
+
     #-----------------------------------------------------------------------------------------------
     #
     #   Wait for DNF lock to be released
+    #   Default timeout is the package manager lock timeout from the configuration (60 seconds)
     #
     #-----------------------------------------------------------------------------------------------
-    def check_lock(self):
-        # Save status message
-        save_status()
+    def check_lock(self, timeout: int = None):
+        if timeout is None:
+            timeout = self.lock_timeout
+
+        pid_file = '/var/run/dnf.pid'
+        deadline = time.monotonic() + timeout
+        status_saved = False
 
-        # If dnf lock is present, wait until it is released
-        if os.path.isfile('/var/run/dnf.pid'):
-            update_status("Waiting for dnf lock to be released")
+        try:
+            while os.path.isfile(pid_file):
+                try:
+                    with open(pid_file, 'r') as file:
+                        pid = file.read().strip()
+                except OSError:
+                    # The pid file has been removed in the meantime
+                    return
+
+                # Stale pid file (e.g. dnf has been killed), the lock is not held anymore
+                if not pid.isnumeric() or not is_process_running(int(pid)):
+                    return
+
+                holder_message = pid_file + ' held by ' + (get_process_name(int(pid)) or 'process') + ' (PID ' + pid + ')'
+
+                if time.monotonic() >= deadline:
+                    raise Exception('Could not acquire dnf lock within ' + str(timeout) + ' seconds: ' + holder_message)
 
-            while os.path.isfile('/var/run/dnf.pid'):
-                time.sleep(2)
+                # Save status message
+                if not status_saved:
+                    save_status()
+                    status_saved = True
 
-        # Restore status message
-        restore_status()
+                update_status('Waiting for dnf lock to be released: ' + holder_message)
+
+                # Wait for the holder to exit
+                wait_for_process_exit(int(pid), max(deadline - time.monotonic(), 0))
+        finally:
+            # Restore status message
+            if status_saved:
+                restore_status()
 
 
     #-----------------------------------------------------------------------------------------------
@@ -552,6 +1296,24 @@ class Dnf:
     #
     #-----------------------------------------------------------------------------------------------
     def get_history(self, order):
+        # If the history database is available, read history IDs from it
+        database, database_version = self.get_history_database()
+
+        if database is not None:
+            try:
+                with closing(self.open_history_database(database)) as connection:
+                    ids = [str(row[0]) for row in connection.execute('SELECT id FROM trans ORDER BY id DESC')]
+
+                # If order is oldest, then sort by date in ascending order
+                if order == 'oldest':
+                    ids.reverse()
+
+                return ids
+
+            # If the database could not be read (e.g. unknown schema), fallback to dnf history command
+            except sqlite3.Error:
+                pass
+
         # Get history IDs
         result = subprocess.run(
             [self.dnf_command + " history list | tail -n +3 | awk '{print $1}'"],
@@ -580,21 +1342,46 @@ class Dnf:
     #-----------------------------------------------------------------------------------------------
     #
     #   Parse all dnf history IDs and return a list of events (JSON)
+    #   If a cursor is provided, only the transactions newer than the last parsed one are returned
+    #   The new cursor is then available in self.history_cursor
     #
     #-----------------------------------------------------------------------------------------------
-    def parse_history(self, ids: list, entries_limit: int):
+    def parse_history(self, ids: list, entries_limit: int, cursor: dict = None):
+        # If the history database is available, read all transactions from it at once
+        database, database_version = self.get_history_database()
+
+        if database is not None:
+            try:
+                return self.parse_history_database(database, database_version, ids, entries_limit, cursor)
+
+            # If the database could not be read (e.g. unknown schema), fallback to dnf history command
+            except sqlite3.Error:
+                pass
+
         # Initialize a limit counter which will be incremented until it reaches the entries_limit
         limit_counter = 0
 
         # Initialize a list of events
         events = []
 
+        # Retrieve the last transaction Id parsed by the previous parsing, if any
+        last_id = 0
+
+        if cursor is not None and cursor.get('type') == 'dnf':
+            last_id = int(cursor.get('last_id', 0))
+
+        new_last_id = last_id
+
         # Parse each ids
         for id in ids:
             # If id is not a number, skip it, might be a parsing error
             if not id.isnumeric():
                 continue
 
+            # Skip transactions that have already been parsed
+            if int(id) <= last_id:
+                continue
+
             installed_packages_json = []
             installed_dependencies_json = []
             upgraded_packages_json = []
@@ -824,11 +1611,201 @@ class Dnf:
 
             limit_counter += 1
 
+            if int(id) > new_last_id:
+                new_last_id = int(id)
+
             del event, date_time, command, packages_altered, date_time_parsed, date, time
             del installed_packages_json, installed_dependencies_json
             del upgraded_packages_json, removed_packages_json
             del downgraded_packages_json, reinstalled_packages_json
 
+        self.history_cursor = {
+            'type': 'dnf',
+            'last_id': new_last_id
+        }
+
         del limit_counter, ids
 
         return events
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the path and the version (dnf4 or dnf5) of the dnf history database, or None if there is none
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_history_database(self):
+        for database, database_version in HISTORY_DATABASES:
+            if Path(database).is_file():
+                return database, database_version
+
+        return None, None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Open the dnf history database in read-only mode
+    #
+    #-----------------------------------------------------------------------------------------------
+    def open_history_database(self, database: str):
+        return sqlite3.connect('file:' + database + '?mode=ro', uri = True)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Parse dnf history from the history database and return a list of events (JSON), same as parse_history()
+    #   All transactions newer than the cursor are retrieved with their packages in two queries
+    #
+    #-----------------------------------------------------------------------------------------------
+    def parse_history_database(self, database: str, database_version: str, ids: list, entries_limit: int, cursor: dict = None):
+        # Initialize a limit counter which will be incremented until it reaches the entries_limit
+        limit_counter = 0
+
+        # Initialize a list of events
+        events = []
+
+        # Retrieve the last transaction Id parsed by the previous parsing, if any
+        last_id = 0
+
+        if cursor is not None and cursor.get('type') == 'dnf':
+            last_id = int(cursor.get('last_id', 0))
+
+        new_last_id = last_id
+
+        # Retrieve transactions and their packages
+        transactions = self.read_history_database(database, database_version, last_id)
+
+        # Parse each ids, in the requested order
+        for id in ids:
+            # If id is not a number, skip it, might be a parsing error
+            if not id.isnumeric():
+                continue
+
+            # Skip transactions that have already been parsed
+            if int(id) <= last_id:
+                continue
+
+            # Quit if the limit of entries to send has been reached
+            if limit_counter > entries_limit:
+                break
+
+            # Skip transactions without any package altered (e.g. reason change only)
+            if int(id) not in transactions or not transactions[int(id)]['packages']:
+                continue
+
+            transaction = transactions[int(id)]
+
+            # Convert date to %Y-%m-%d format (local time, like 'dnf history info')
+            date_time = datetime.fromtimestamp(transaction['date'])
+
+            # Create the event JSON object
+            event = {
+                'date_start': date_time.strftime('%Y-%m-%d'),
+                'time_start': date_time.strftime('%H:%M:%S'),
+                'date_end': '',
+                'time_end': '',
+                'command': transaction['command'],
+                'installed': [],
+                'dep_installed': [],
+                'upgraded': [],
+                'removed': [],
+                'downgraded': [],
+                'reinstalled': []
+            }
+
+            for operation, package in transaction['packages']:
+                if operation == 'install':
+                    event['installed'].append(package)
+
+                elif operation == 'upgrade':
+                    event['upgraded'].append(package)
+
+                elif operation == 'reinstall':
+                    event['reinstalled'].append(package)
+
+                # Repository is not sent for removed and downgraded packages
+                elif operation == 'remove':
+                    event['removed'].append({'name': package['name'], 'version': package['version']})
+
+                elif operation == 'downgrade':
+                    event['downgraded'].append({'name': package['name'], 'version': package['version']})
+
+            # Add the event to the list of events
+            events.append(event)
+
+            limit_counter += 1
+
+            if int(id) > new_last_id:
+                new_last_id = int(id)
+
+            del transaction, date_time, event
+
+        self.history_cursor = {
+            'type': 'dnf',
+            'last_id': new_last_id
+        }
+
+        del limit_counter, ids, transactions
+
+        return events
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Read all transactions newer than since_id from the history database
+    #   e.g. {42: {'date': 1700000000, 'command': 'update curl -y', 'packages': [('upgrade', {'name': 'curl', 'version': '7.76.1-29.el9.x86_64', 'repo': '@baseos'})]}}
+    #
+    #-----------------------------------------------------------------------------------------------
+    def read_history_database(self, database: str, database_version: str, since_id: int = 0):
+        transactions = {}
+
+        # Columns and actions differ between dnf4 and dnf5 databases
+        if database_version == 'dnf5':
+            transactions_query = 'SELECT id, dt_begin, description FROM trans WHERE id > ? ORDER BY id'
+            packages_query = (
+                'SELECT ti.trans_id, action.name, rpm.name, rpm.epoch, rpm.version, rpm.release, rpm.arch, repo.repoid '
+                'FROM trans_item ti '
+                'JOIN trans_item_action action ON action.id = ti.action_id '
+                'JOIN rpm ON rpm.item_id = ti.item_id '
+                'LEFT JOIN repo ON repo.id = ti.repo_id '
+                'WHERE ti.trans_id > ? '
+                'ORDER BY ti.trans_id, rpm.name'
+            )
+            actions = HISTORY_DNF5_ACTIONS
+        else:
+            transactions_query = 'SELECT id, dt_begin, cmdline FROM trans WHERE id > ? ORDER BY id'
+            packages_query = (
+                'SELECT ti.trans_id, ti.action, rpm.name, rpm.epoch, rpm.version, rpm.release, rpm.arch, repo.repoid '
+                'FROM trans_item ti '
+                'JOIN rpm ON rpm.item_id = ti.item_id '
+                'LEFT JOIN repo ON repo.id = ti.repo_id '
+                'WHERE ti.trans_id > ? '
+                'ORDER BY ti.trans_id, rpm.name'
+            )
+            actions = HISTORY_DNF4_ACTIONS
+
+        with closing(self.open_history_database(database)) as connection:
+            for id, date, command in connection.execute(transactions_query, (since_id,)):
+                transactions[id] = {
+                    'date': date,
+                    'command': (command or '').strip(),
+                    'packages': []
+                }
+
+            for id, action, name, epoch, version, release, arch, repoid in connection.execute(packages_query, (since_id,)):
+                if id not in transactions or action not in actions:
+                    continue
+
+                # Version is in the same format as 'dnf history info', e.g. 7.76.1-29.el9.x86_64 or 1:1.46.0-8.el9.x86_64
+                package_version = version + '-' + release + '.' + arch
+
+                if epoch:
+                    package_version = str(epoch) + ':' + package_version
+
+                transactions[id]['packages'].append((actions[action], {
+                    'name': name,
+                    'version': package_version,
+                    'repo': '@' + (repoid or '')
+                }))
+
+        return transactions
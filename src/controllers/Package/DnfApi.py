@@ -0,0 +1,171 @@
+# coding: utf-8
+
+# Import libraries
+import dnf
+
+# Import classes
+from src.controllers.Package.Dnf import Dnf
+
+class DnfApi(Dnf):
+    def __init__(self):
+        super().__init__()
+
+        # dnf Base, with its sack (installed packages and repositories metadata) loaded once and kept in memory
+        self.base = None
+        self.base_signature = None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the dnf Base, load it if not loaded yet or reload it if the rpm database has changed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_base(self):
+        signature = self.get_rpmdb_signature()
+
+        if self.base is not None and signature == self.base_signature:
+            return self.base
+
+        self.close_base()
+
+        try:
+            base = dnf.Base()
+
+            # Read /etc/dnf/dnf.conf (including excluded packages) and repositories, like the dnf command does
+            base.conf.read()
+            base.conf.substitutions.update_from_etc(base.conf.installroot)
+            base.read_all_repos()
+
+            # Load installed packages and repositories metadata (metadata is refreshed if expired)
+            base.fill_sack(load_system_repo = True, load_available_repos = True)
+        except Exception as e:
+            raise Exception('could not load dnf packages metadata: ' + str(e))
+
+        self.base = base
+        self.base_signature = signature
+
+        return self.base
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Close the dnf Base
+    #
+    #-----------------------------------------------------------------------------------------------
+    def close_base(self):
+        if self.base is not None:
+            try:
+                self.base.close()
+            except Exception:
+                pass
+
+        self.base = None
+        self.base_signature = None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the index of installed packages, read from the sack
+    #   If the sack cannot be loaded (e.g. a repository is unreachable), fallback to the rpm database query, which does
+    #   not need any repository metadata
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_installed_index(self):
+        signature = self.get_rpmdb_signature()
+
+        if self.installed_index is not None and signature == self.installed_index_signature:
+            return self.installed_index
+
+        try:
+            base = self.get_base()
+        except Exception:
+            return super().get_installed_index()
+
+        index = {}
+
+        for pkg in base.sack.query().installed():
+            # gpg-pubkey entries are not packages
+            if pkg.name == 'gpg-pubkey':
+                continue
+
+            # Several versions of a package can be installed at the same time (installonly packages, e.g. kernel)
+            index.setdefault(pkg.name + '.' + pkg.arch, []).append({
+                'name': pkg.name,
+                'arch': pkg.arch,
+                'epoch': str(pkg.epoch),
+                'version': pkg.version + '-' + pkg.release + '.' + pkg.arch,
+                'installtime': pkg.installtime
+            })
+
+        self.installed_index = index
+        self.installed_index_signature = signature
+
+        return index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the index of available package updates, read from the sack
+    #   If the sack cannot be loaded, fallback to the dnf command
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_upgrades_index(self):
+        signature = self.get_rpmdb_signature()
+
+        if self.upgrades_index is not None and signature == self.upgrades_index_signature:
+            return self.upgrades_index
+
+        try:
+            base = self.get_base()
+        except Exception:
+            return super().get_upgrades_index()
+
+        index = {}
+
+        # Same as 'dnf repoquery --upgrades --latest-limit 1'
+        for pkg in base.sack.query().available().upgrades().latest():
+            index[pkg.name + '.' + pkg.arch] = {
+                'name': pkg.name,
+                'arch': pkg.arch,
+                'version': pkg.version + '-' + pkg.release + '.' + pkg.arch,
+                'repository': pkg.reponame
+            }
+
+        self.upgrades_index = index
+        self.upgrades_index_signature = signature
+
+        return index
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return package names that currently have a security update available, read from the sack advisories
+    #   If the sack cannot be loaded, fallback to the dnf command
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_security_update_package_names(self):
+        names = set()
+
+        try:
+            base = self.get_base()
+        except Exception:
+            return super().get_security_update_package_names()
+
+        try:
+            for pkg in base.sack.query().available().upgrades().latest().filter(advisory_type = 'security'):
+                names.add(pkg.name)
+        except Exception:
+            # If advisory metadata is unavailable, keep compatibility and return an empty set
+            return names
+
+        return names
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Forget the indexes and the dnf Base, they will be reloaded on next access (e.g. after a cache update)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def invalidate_indexes(self):
+        super().invalidate_indexes()
+        self.close_base()
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+# Import classes
+from src.controllers.Package.PackageMatcher import PackageMatcher
+
+class Exclusion:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Compile the exclusion patterns once (packages to always exclude and packages to exclude on major update)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, exclude_always: list, exclude_on_major_update: list):
+        self.alwaysMatcher = PackageMatcher(exclude_always or [])
+        self.onMajorUpdateMatcher = PackageMatcher(exclude_on_major_update or [])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the available version is a major update of the current version
+    #   (the first digit of the current and available versions is different)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_major_update(self, current_version: str, target_version: str) -> bool:
+        return str(current_version).split('.')[0] != str(target_version).split('.')[0]
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the package must be excluded
+    #
+    #-----------------------------------------------------------------------------------------------
+    def is_excluded(self, package: dict) -> bool:
+        if self.alwaysMatcher.match(package['name']):
+            return True
+
+        if self.onMajorUpdateMatcher.match(package['name']):
+            if self.is_major_update(package['current_version'], package['target_version']):
+                return True
+
+        return False
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the install decision for each package of the list, in the same order
+    #   Decision is None for packages that are already marked as not to install
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_decisions(self, packages: list, ignore_exclusions: bool = False) -> list:
+        decisions = []
+
+        for package in packages:
+            # Ignore package if it is already marked as not to install
+            if 'install' in package and not package['install']:
+                decisions.append(None)
+                continue
+
+            if not ignore_exclusions and self.is_excluded(package):
+                decisions.append({'install': False, 'install_decision_message': '✕ (excluded)'})
+            else:
+                decisions.append({'install': True, 'install_decision_message': ''})
+
+        return decisions
@@ -0,0 +1,39 @@
+# coding: utf-8
+
+# Import classes
+from src.controllers.App.Utils import Utils
+
+class HistoryCursor:
+    def __init__(self, name: str = 'packages-history'):
+        # The cursor remembers up to where the packages history has already been parsed and sent
+        self.cursor_file = Utils().get_state_file(name + '.cursor.json')
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load the cursor, return None if there is no cursor yet (or if it is unreadable, meaning a full resync)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load(self):
+        return Utils().load_state_file(self.cursor_file)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save the cursor
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save(self, cursor: dict):
+        if cursor is None:
+            return
+
+        Utils().save_state_file(self.cursor_file, cursor)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the cursor, next history parsing will be a full resync
+    #
+    #-----------------------------------------------------------------------------------------------
+    def reset(self):
+        Utils().remove_state_file(self.cursor_file)
@@ -3,8 +3,8 @@
 # https://github.com/excid3/python-apt/blob/master/doc/examples/inst.py
 
 # Import libraries
-import re
-import time
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 from tabulate import tabulate
 from colorama import Fore, Style
@@ -13,8 +13,12 @@ from colorama import Fore, Style
 from src.controllers.System import System
 from src.controllers.App.Config import Config
 from src.controllers.Exit import Exit
+from src.controllers.Lock import Lock
 from src.controllers.App.Utils import Utils
 from src.controllers.Status import update_status, save_status, restore_status
+from src.controllers.Package.Exclusion import Exclusion
+from src.controllers.Package.CacheFreshness import CacheFreshness
+from src.controllers.Package.PrestageManifest import PrestageManifest
 
 class Package:
     def __init__(self):
@@ -23,22 +27,44 @@ class Package:
         self.exitController      = Exit()
 
         # Locks
-        self.cache_clear_lock = '/tmp/linupdate.clear-cache.lock'
-        self.available_packages_lock = '/tmp/linupdate.available-packages.lock'
-        self.installed_packages_lock = '/tmp/linupdate.installed-packages.lock'
+        # Packages lock is shared by the processes reading installed or available packages, and exclusive while the
+        # cache is being updated or cleared, or while packages are being updated
+        self.packages_lock = '/tmp/linupdate.packages.lock'
         self.update_running_lock = '/tmp/linupdate.update-running.lock'
 
+        # Last package lists refresh, shared by all linupdate processes
+        self.cacheFreshness = CacheFreshness()
+
+        # Pending updates downloaded in advance by the service
+        self.prestageManifest = PrestageManifest()
+
         # Import libraries depending on the OS family
 
         # If Debian, import apt
         if (self.systemController.get_os_family() == 'Debian'):
             from src.controllers.Package.Apt import Apt
-            self.myPackageManagerController = Apt()
+            from src.controllers.Package.AptCache import AptCache
+
+            # Open a single apt cache session, shared by all the apt queries of this run
+            self.aptCacheSession = AptCache()
+            self.myPackageManagerController = Apt(self.aptCacheSession)
 
         # If Redhat, import yum
         if (self.systemController.get_os_family() == 'Redhat'):
-            from src.controllers.Package.Dnf import Dnf
-            self.myPackageManagerController = Dnf()
+            # Use the dnf python API to query packages in-process if available,
+            # otherwise fallback to the dnf command
+            try:
+                from src.controllers.Package.DnfApi import DnfApi
+                self.myPackageManagerController = DnfApi()
+            except ImportError:
+                from src.controllers.Package.Dnf import Dnf
+                self.myPackageManagerController = Dnf()
+
+        # Maximum time to wait for the package manager lock (dpkg/dnf) to be released
+        self.myPackageManagerController.lock_timeout = self.appConfigController.get_package_manager_lock_timeout()
+
+        # Maximum time to wait for the packages lock to be released (it is held for the whole duration of an update)
+        self.packages_lock_timeout = self.appConfigController.get_packages_lock_timeout()
 
     #-----------------------------------------------------------------------------------------------
     #
@@ -52,49 +78,23 @@ class Package:
             excludeAlways = configuration['update']['packages']['exclude']['always']
             excludeOnMajorUpdate = configuration['update']['packages']['exclude']['on_major_update']
 
-            # Loop through the list of packages to update
-            for package in self.packagesToUpdateList:
-                install = True
-                install_decision_message = ''
+            # Compile the exclusion patterns once, then get the install decision of every package in one pass
+            exclusion = Exclusion(excludeAlways, excludeOnMajorUpdate)
+            decisions = exclusion.get_decisions(self.packagesToUpdateList, ignore_exclusions)
 
-                # Ignore package if it is already marked as not to install
-                if 'install' in package and not package['install']:
+            for package, decision in zip(self.packagesToUpdateList, decisions):
+                # Package is already marked as not to install
+                if decision is None:
                     continue
 
-                # Check for exclusions and exclude packages only if the ignore_exclusions parameter is False
-                if not ignore_exclusions:
-                    # If the package is in the list of packages to exclude (on major update), check if the available version is a major update
-                    if excludeOnMajorUpdate:
-                        # There can be regex in the excludeOnMajorUpdate list (e.g. apache.*), so we need to convert it to a regex pattern
-                        # https://www.geeksforgeeks.org/python-check-if-string-matches-regex-list/
-                        regex = '(?:% s)' % '|'.join(excludeOnMajorUpdate)
-
-                        # Check if the package name matches the regex pattern
-                        if re.match(regex, package['name']):
-                            # Retrieve the first digit of the current and available versions
-                            # If the first digit is different then it is a major update, exclude the package
-                            if package['current_version'].split('.')[0] != package['target_version'].split('.')[0]:
-                                self.myPackageManagerController.exclude(package['name'])
-                                install = False
-                                install_decision_message = '✕ (excluded)'
-
-                    # If the package is in the list of packages to exclude (always), exclude it
-                    if excludeAlways:
-                        # There can be regex in the excludeAlways list (e.g. apache.*), so we need to convert it to a regex pattern
-                        # https://www.geeksforgeeks.org/python-check-if-string-matches-regex-list/
-                        regex = '(?:% s)' % '|'.join(excludeAlways)
-
-                        # Check if the package name matches the regex pattern
-                        if re.match(regex, package['name']):
-                            self.myPackageManagerController.exclude(package['name'])
-                            install = False
-                            install_decision_message = '✕ (excluded)'
-
-                # Edit self.packagesToUpdateList and add excluded key to the package
-                self.packagesToUpdateList[self.packagesToUpdateList.index(package)]['install'] = install
-                self.packagesToUpdateList[self.packagesToUpdateList.index(package)]['install_decision_message'] = install_decision_message
-
-            del configuration, excludeAlways, excludeOnMajorUpdate
+                if not decision['install']:
+                    self.myPackageManagerController.exclude(package['name'])
+
+                # Add install decision to the package
+                package['install'] = decision['install']
+                package['install_decision_message'] = decision['install_decision_message']
+
+            del configuration, excludeAlways, excludeOnMajorUpdate, exclusion, decisions
         except Exception as e:
             raise Exception('error while excluding packages: ' + str(e))
 
@@ -121,28 +121,13 @@ class Package:
         try:
             update_status("Getting installed packages")
 
-            # Create a lock file to indicate that the installed packages are being retrieved, to prevent other processes to access the cache while it is being updated
-            try:
-                if not Path(self.installed_packages_lock).is_file():
-                    Path(self.installed_packages_lock).touch()
-            except Exception as e:
-                raise Exception('could not create installed packages lock file: ' + str(e))
-
-            # Wait for the cache to be cleared if it is being cleared
-            self.wait_for_cache_clear_lock()
-
-            # Wait for update to finish if it is running
-            self.wait_for_update_running_lock()
-
-            # Get a list of installed packages
-            return self.myPackageManagerController.get_installed_packages()
+            # Other processes can read packages at the same time, but wait for the cache to be cleared or for an update to finish
+            with self.acquire_packages_lock(exclusive = False):
+                # Get a list of installed packages
+                return self.myPackageManagerController.get_installed_packages()
 
         except Exception as e:
             raise Exception('error while getting installed packages: ' + str(e))
-        finally:
-            # Remove the lock file
-            if Path(self.installed_packages_lock).is_file():
-                Path(self.installed_packages_lock).unlink()
 
 
     #-----------------------------------------------------------------------------------------------
@@ -154,53 +139,50 @@ class Package:
         try:
             update_status('Getting available packages')
 
-            # Create a lock file to indicate that the available packages are being retrieved, to prevent other processes to access the cache while it is being updated
-            try:
-                if not Path(self.available_packages_lock).is_file():
-                    Path(self.available_packages_lock).touch()
-            except Exception as e:
-                raise Exception('could not create available packages lock file: ' + str(e))
-
-            # Wait for the cache to be cleared if it is being cleared
-            self.wait_for_cache_clear_lock()
-
-            # Wait for update to finish if it is running
-            self.wait_for_update_running_lock()
-
-            # Get a list of available packages
-            return self.myPackageManagerController.get_available_packages(dist_upgrade)
+            # Other processes can read packages at the same time, but wait for the cache to be cleared or for an update to finish
+            with self.acquire_packages_lock(exclusive = False):
+                # Get a list of available packages
+                return self.myPackageManagerController.get_available_packages(dist_upgrade)
 
         except Exception as e:
             raise Exception('error while retrieving available packages: ' + str(e))
-        finally:
-            # Remove the lock file
-            if Path(self.available_packages_lock).is_file():
-                Path(self.available_packages_lock).unlink()
 
 
     #-----------------------------------------------------------------------------------------------
     #
     #   Update package cache
+    #   Package lists refreshed less than package_lists_ttl minutes ago (by any linupdate process or by the package manager
+    #   itself) are reused, unless the refresh is forced or the sources have changed
+    #   Only inventory and status refreshes reuse recent package lists, updates and pre-staging always force the refresh
+    #   If a list of packages is provided, only the sources providing these packages are refreshed
     #
     #-----------------------------------------------------------------------------------------------
-    def update_cache(self):
+    def update_cache(self, force: bool = False, packages: list = None):
         try:
             update_status('Updating cache')
 
-            # Do not clear while update is running
-            self.wait_for_update_running_lock()
+            # Do not update while an update is running, or while another process is reading packages or clearing the cache
+            # This also prevents two processes from refreshing the package lists at the same time
+            with self.acquire_packages_lock(exclusive = True):
+                sources_files = self.myPackageManagerController.get_sources_files()
+
+                # Reuse recent package lists
+                if not force:
+                    ttl = self.appConfigController.get_package_lists_ttl()
 
-            # Do not clear while another process is getting available packages
-            self.wait_for_available_packages_lock()
+                    if self.cacheFreshness.is_fresh(ttl, sources_files, self.myPackageManagerController.get_package_lists_mtime()):
+                        return
 
-            # Do not clear while another process is getting installed packages
-            self.wait_for_installed_packages_lock()
+                # Partial refresh, the other sources are not refreshed so the refresh time is not saved
+                if packages:
+                    self.myPackageManagerController.update_cache(packages)
+                    return
 
-            # Do not clear while another process is clearing the cache
-            self.wait_for_cache_clear_lock()
+                # Update cache
+                self.myPackageManagerController.update_cache()
 
-            # Update cache
-            self.myPackageManagerController.update_cache()
+                # Remember when the package lists have been refreshed
+                self.cacheFreshness.save(sources_files)
 
         except Exception as e:
             raise Exception('error while updating package cache: ' + str(e))
@@ -215,32 +197,68 @@ class Package:
         try:
             update_status('Clearing cache')
 
-            # Do not clear while update is running
-            self.wait_for_update_running_lock()
+            # Do not clear while an update is running, or while another process is reading packages or clearing the cache
+            with self.acquire_packages_lock(exclusive = True):
+                self.myPackageManagerController.clear_cache()
 
-            # Do not clear while another process is getting available packages
-            self.wait_for_available_packages_lock()
+                # Package lists have been removed, they must be refreshed on next cache update
+                self.cacheFreshness.reset()
 
-            # Do not clear while another process is getting installed packages
-            self.wait_for_installed_packages_lock()
+                # Pre-staged packages have been removed too
+                self.prestageManifest.reset()
+        except Exception as e:
+            raise Exception('error while clearing package cache: ' + str(e))
 
-            # Do not clear while another process is clearing the cache
-            self.wait_for_cache_clear_lock()
 
-            # Create a lock file to indicate that the cache is being cleared, to prevent other processes to access the cache while it is being cleared
-            try:
-                if not Path(self.cache_clear_lock).is_file():
-                    Path(self.cache_clear_lock).touch()
-            except Exception as e:
-                raise Exception('could not create cache clear lock file: ' + str(e))
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Pre-stage pending updates: refresh the package lists, download the packages to update into the cache
+    #   and record them in a manifest, so that the next update can go straight to installation
+    #   Executed in background by the service, nothing is installed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def prestage(self):
+        try:
+            # Retrieve configuration
+            configuration = self.appConfigController.get_conf()
+
+            # Start without any exclusion (exclusions are only kept in memory for the current run)
+            self.remove_all_exclusions()
+
+            # Refresh the package lists and retrieve the pending updates
+            self.update_cache(force = True)
+            self.packagesToUpdateList = self.get_available_packages()
+
+            # Excluded packages will not be installed by the next update, do not download them
+            self.exclude(False)
+
+            packages = [package for package in self.packagesToUpdateList if package['install']]
+
+            # Nothing to download, remove a previous manifest that may not be accurate anymore
+            if len(packages) == 0:
+                self.prestageManifest.reset()
+                return packages
+
+            # Download the packages, other processes can still read packages meanwhile
+            # The number of parallel downloads is configured even if download-ahead is disabled for updates
+            self.myPackageManagerController.download_parallelism = configuration['update']['download_ahead']['parallel_downloads']
+
+            with self.acquire_packages_lock(exclusive = False):
+                self.myPackageManagerController.download_ahead(packages)
+
+            # Record the pre-staged packages
+            self.prestageManifest.save(packages, self.cacheFreshness.get_sources_signature(self.myPackageManagerController.get_sources_files()))
+
+            del configuration
+
+            return packages
 
-            self.myPackageManagerController.clear_cache()
         except Exception as e:
-            raise Exception('error while clearing package cache: ' + str(e))
+            raise Exception('error while pre-staging pending updates: ' + str(e))
+
         finally:
-            # Remove the lock file
-            if Path(self.cache_clear_lock).is_file():
-                Path(self.cache_clear_lock).unlink()
+            # Remove all exclusions
+            self.remove_all_exclusions()
 
 
     #-----------------------------------------------------------------------------------------------
@@ -288,15 +306,29 @@ class Package:
             # Retrieve the exit_on_package_update_error option
             exit_on_package_update_error = configuration['update']['exit_on_package_update_error']
 
-            # Remove all exclusions before starting (could be some left from a previous run that failed)
+            # Start without any exclusion (exclusions are only kept in memory for the current run)
             self.remove_all_exclusions()
 
             # Clear cache
             if clear_cache:
                 self.clear_cache()
 
-            # Update cache
-            self.update_cache()
+            # If pending updates have recently been pre-staged by the service, the package lists have been refreshed at that time
+            # and the packages are already downloaded: go straight to installation (unless the cache has just been cleared)
+            prestage_manifest = None
+
+            if not clear_cache:
+                prestage_manifest = self.prestageManifest.get_valid(configuration['update']['prestage']['max_age'], self.cacheFreshness.get_sources_signature(self.myPackageManagerController.get_sources_files()))
+
+            # Update cache, always forced so that packages are not updated from stale package lists
+            # If a list of packages to update has been provided and partial refresh is enabled, only refresh the sources providing them
+            # (not possible if the cache has just been cleared, all the sources must then be refreshed)
+            if prestage_manifest is not None:
+                print(' ▪ Using pending updates pre-staged on ' + datetime.fromtimestamp(prestage_manifest['date']).strftime('%Y-%m-%d %H:%M:%S'))
+            elif len(packages_list) > 0 and self.appConfigController.get_update_partial_refresh() and not clear_cache:
+                self.update_cache(force = True, packages = [package['name'] for package in packages_list])
+            else:
+                self.update_cache(force = True)
 
             # If a list of packages to update has been provided, use it
             if len(packages_list) > 0:
@@ -305,9 +337,18 @@ class Package:
                 # Retrieve the set of packages that have a security update available (single call)
                 security_packages_set = self.myPackageManagerController.get_security_packages_set()
 
-                # For each package in the list, if no current version or target version is provided, retrieve it
-                # This is the case when the user uses the --update parameter
+                # Resolve all the packages of the list at once (glob patterns like nginx* are expanded to the matching installed packages)
+                # Versions and repository provided with the list (reposerver request) are kept as is
+                provided_packages = {}
+
                 for package in packages_list:
+                    provided_packages[package['name']] = package
+
+                resolved_packages = self.myPackageManagerController.resolve_packages(list(provided_packages.keys()))
+
+                for resolved_package in resolved_packages:
+                    package = provided_packages.get(resolved_package['name'], {})
+
                     # Default values
                     current_version = ''
                     target_version = ''
@@ -316,11 +357,8 @@ class Package:
                     install = True
                     install_decision_message = ''
 
-                    # First, check if package is installed, if not skip it
-                    is_installed = self.myPackageManagerController.is_installed(package['name'])
-
                     # If package is not installed, mark it as not to install
-                    if not is_installed:
+                    if not resolved_package['installed']:
                         current_version = '-'
                         target_version = '-'
                         repository = '-'
@@ -328,11 +366,9 @@ class Package:
                         install_decision_message = '✕ Package is not installed'
 
                     # If package is installed, retrieve the current and target versions
-                    if is_installed:
-                        if 'current_version' not in package:
-                            current_version = self.myPackageManagerController.get_current_version(package['name'])
-                        if 'target_version' not in package:
-                            target_version = self.myPackageManagerController.get_available_version(package['name'])
+                    else:
+                        current_version = package.get('current_version', resolved_package['current_version'])
+                        target_version = package.get('target_version', resolved_package['target_version'])
 
                         # If current version or target version have not been found, skip the package
                         if current_version == '' or target_version == '':
@@ -342,16 +378,21 @@ class Package:
                         if current_version == target_version:
                             continue
 
-                        # Retrieve the source repository
-                        if 'repository' not in package:
-                            repository = self.myPackageManagerController.get_source_repository(package['name'], target_version)
+                        # Use the repository resolved for the available version, unless another target version has been provided
+                        # (it is then retrieved afterwards for all those packages at once)
+                        if 'repository' in package:
+                            repository = package['repository']
+                        elif target_version == resolved_package['target_version']:
+                            repository = resolved_package['repository']
+                        else:
+                            repository = None
 
                         # Detect if this is a security update
-                        security = package['name'] in security_packages_set
+                        security = resolved_package['name'] in security_packages_set
 
                     # Add the package to the list
                     packages_list_temp.append({
-                        'name': package['name'],
+                        'name': resolved_package['name'],
                         'current_version': current_version,
                         'target_version': target_version,
                         'repository': repository,
@@ -360,6 +401,19 @@ class Package:
                         'install_decision_message': install_decision_message
                     })
 
+                del provided_packages, resolved_packages
+
+                # Retrieve the source repository of all packages that do not have one yet, in a single call
+                packages_without_repository = [package for package in packages_list_temp if package['repository'] is None]
+
+                if len(packages_without_repository) > 0:
+                    repositories = self.myPackageManagerController.get_source_repositories(packages_without_repository)
+
+                    for package in packages_without_repository:
+                        package['repository'] = repositories.get(package['name'], 'Unknown')
+
+                    del repositories
+
                 self.packagesToUpdateList = packages_list_temp
 
                 del packages_list_temp
@@ -472,19 +526,38 @@ class Package:
                     if not Path(restart_file).is_file():
                         Path(restart_file).touch()
 
-            # Create a temporary file in /tmp to indicate that the update process is running
-            if not Path(self.update_running_lock).is_file():
-                Path(self.update_running_lock).touch()
-
             # Execute the packages update
             self.myPackageManagerController.dist_upgrade = dist_upgrade
             self.myPackageManagerController.keep_oldconf = keep_oldconf
-            self.myPackageManagerController.update(self.packagesToUpdateList, exit_on_package_update_error, dry_run)
+
+            # If transaction mode is enabled, packages are updated by chunks, each chunk in a single transaction
+            if self.appConfigController.get_update_transaction_enabled():
+                self.myPackageManagerController.transaction_chunk_size = self.appConfigController.get_update_transaction_chunk_size()
+            else:
+                self.myPackageManagerController.transaction_chunk_size = 0
+
+            # If download-ahead is enabled, all packages are downloaded before installing any of them
+            if configuration['update']['download_ahead']['enabled']:
+                self.myPackageManagerController.download_parallelism = configuration['update']['download_ahead']['parallel_downloads']
+            else:
+                self.myPackageManagerController.download_parallelism = 0
+
+            # No need to download packages ahead if they have all been pre-staged (they are already in the cache)
+            if prestage_manifest is not None and self.prestageManifest.contains(prestage_manifest, [package for package in self.packagesToUpdateList if package['install']]):
+                self.myPackageManagerController.download_parallelism = 0
+
+            # Indicate that the update process is running, and prevent other processes from reading packages or using the cache until it is finished
+            with Lock(self.update_running_lock, exclusive = True), self.acquire_packages_lock(exclusive = True):
+                self.myPackageManagerController.update(self.packagesToUpdateList, exit_on_package_update_error, dry_run)
+
+            # Pre-staged packages have been installed, next update will refresh the package lists again
+            if not dry_run:
+                self.prestageManifest.reset()
 
             # Update the summary status
             self.summary['update']['status'] = 'done'
 
-            del restart_file, configuration, packages_list, ignore_exclusions
+            del restart_file, configuration, packages_list, ignore_exclusions, prestage_manifest
 
         except Exception as e:
             print('\n' + Fore.RED + ' Packages update failed: ' + str(e) + Style.RESET_ALL)
@@ -494,10 +567,6 @@ class Package:
             # Remove all exclusions
             self.remove_all_exclusions()
 
-            # Remove the update running lock file
-            if Path(self.update_running_lock).is_file():
-                Path(self.update_running_lock).unlink()
-
         # Update the summary with the number of packages updated and failed
         if hasattr(self.myPackageManagerController, 'summary'):
             self.summary['update']['success']['count'] = self.myPackageManagerController.summary['update']['success']['count']
@@ -533,95 +602,45 @@ class Package:
     #   Parse history entries
     #
     #-----------------------------------------------------------------------------------------------
-    def parse_history(self, entries, entries_limit):
-        return self.myPackageManagerController.parse_history(entries, entries_limit)
+    def parse_history(self, entries, entries_limit, cursor: dict = None):
+        return self.myPackageManagerController.parse_history(entries, entries_limit, cursor)
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Wait for a lock file to be released
+    #   Return the history cursor resulting from the last history parsing
     #
     #-----------------------------------------------------------------------------------------------
-    def wait_for_lock(self, lock_file, timeout: int) -> None:
-        start_time = time.time()
-
-        while time.time() - start_time < timeout:
-            locks_held = False
-
-            if Path(lock_file).is_file():
-                locks_held = True
-
-            if not locks_held:
-                return
-
-            time.sleep(2)
-
-        raise Exception('could not acquire lock ' + lock_file + ' within ' + str(timeout) + ' seconds')
+    def get_history_cursor(self):
+        return self.myPackageManagerController.history_cursor
 
 
     #-----------------------------------------------------------------------------------------------
     #
-    #   Wait for update running lock to be released
-    #   Default timeout is 60 seconds
+    #   Acquire the packages lock, shared to read packages or exclusive to update the cache or packages
+    #   Wait for it to be released by other processes if needed (default timeout is main.packages_lock_timeout)
     #
     #-----------------------------------------------------------------------------------------------
-    def wait_for_update_running_lock(self, timeout: int = 60) -> None:
-        # Save status message
-        save_status()
+    @contextmanager
+    def acquire_packages_lock(self, exclusive: bool, timeout: int = None):
+        if timeout is None:
+            timeout = self.packages_lock_timeout
 
-        update_status('Another process is running an update, waiting for it to finish...')
-        self.wait_for_lock(self.update_running_lock, timeout)
-
-        # Restore status message
-        restore_status()
-
-
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Wait for available packages lock to be released
-    #   Default timeout is 60 seconds
-    #
-    #-----------------------------------------------------------------------------------------------
-    def wait_for_available_packages_lock(self, timeout: int = 60) -> None:
-        # Save status message
-        save_status()
-
-        update_status('Waiting for available packages lock to be released...')
-        self.wait_for_lock(self.available_packages_lock, timeout)
-
-        # Restore status message
-        restore_status()
-
-
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Wait for installed packages lock to be released
-    #   Default timeout is 60 seconds
-    #
-    #-----------------------------------------------------------------------------------------------
-    def wait_for_installed_packages_lock(self, timeout: int = 60) -> None:
-        # Save status message
-        save_status()
-
-        update_status('Waiting for installed packages lock to be released...')
-        self.wait_for_lock(self.installed_packages_lock, timeout)
-
-        # Restore status message
-        restore_status()
+        lock = Lock(self.packages_lock, exclusive, timeout)
 
+        try:
+            lock.acquire(timeout = 0)
+        except Exception:
+            # Save status message
+            save_status()
 
-    #-----------------------------------------------------------------------------------------------
-    #
-    #   Wait for cache clear lock to be released
-    #   Default timeout is 60 seconds
-    #
-    #-----------------------------------------------------------------------------------------------
-    def wait_for_cache_clear_lock(self, timeout: int = 60) -> None:
-        # Save status message
-        save_status()
+            update_status('Waiting for packages lock to be released...')
+            lock.acquire()
 
-        update_status('Waiting for cache clear lock to be released...')
-        self.wait_for_lock(self.cache_clear_lock, timeout)
+            # Restore status message
+            restore_status()
 
-        # Restore status message
-        restore_status()
+        try:
+            yield lock
+        finally:
+            lock.release()
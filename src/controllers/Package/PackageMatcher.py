@@ -0,0 +1,93 @@
+# coding: utf-8
+
+# Import libraries
+import re
+
+# Characters that make a pattern a regex rather than a plain package name
+REGEX_CHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Backreferences (e.g. '\1' or '(?P=name)'), they would be renumbered if the regex were joined with others
+REGEX_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+class PackageMatcher:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Compile a list of package patterns (package names or regex, e.g. ['curl', 'php.*', 'nginx$'])
+    #   A package matches if it matches one of the patterns from its beginning, like re.match() does:
+    #   - 'name$' and 'name.*$' are exact names (set lookup)
+    #   - 'name' and 'name.*' are prefixes (startswith)
+    #   - anything else is a regex, all regex are compiled once into a single pattern when possible (no inline flags
+    #     nor backreferences), else each regex is compiled on its own
+    #   A pattern which is not a valid regex is matched as a plain prefix
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, patterns: list):
+        self.exact = set()
+        prefixes = []
+        regexes = []
+
+        for pattern in patterns:
+            pattern = str(pattern).strip()
+
+            if pattern == '':
+                continue
+
+            # 'name.*$' is the same as 'name.*', and 'name.*' is the same as 'name' with re.match()
+            if pattern.endswith('.*$'):
+                literal = pattern[:-3]
+                exact = False
+            elif pattern.endswith('$'):
+                literal = pattern[:-1]
+                exact = True
+            elif pattern.endswith('.*'):
+                literal = pattern[:-2]
+                exact = False
+            else:
+                literal = pattern
+                exact = False
+
+            # Plain package name
+            if not REGEX_CHARACTERS.search(literal):
+                if exact:
+                    self.exact.add(literal)
+                else:
+                    prefixes.append(literal)
+                continue
+
+            # Regex, fallback to a plain prefix if it cannot be compiled
+            try:
+                regexes.append(re.compile(pattern))
+            except re.error:
+                prefixes.append(pattern)
+
+        self.prefixes = tuple(prefixes)
+        self.regexes = regexes
+        self.regex = None
+
+        # Join the regexes into a single one, unless their meaning could change: inline flags (e.g. '(?i)') would apply to
+        # all the regexes (or be rejected, depending on the Python version) and backreferences would be renumbered
+        default_flags = re.compile('').flags
+
+        if len(regexes) > 1 and not any(regex.flags != default_flags or REGEX_BACKREFERENCE.search(regex.pattern) for regex in regexes):
+            try:
+                self.regex = re.compile('(?:' + ')|(?:'.join(regex.pattern for regex in regexes) + ')')
+            except re.error:
+                self.regex = None
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if the package name matches one of the patterns
+    #
+    #-----------------------------------------------------------------------------------------------
+    def match(self, name: str) -> bool:
+        if name in self.exact:
+            return True
+
+        if self.prefixes and name.startswith(self.prefixes):
+            return True
+
+        if self.regex is not None:
+            return self.regex.match(name) is not None
+
+        return any(regex.match(name) for regex in self.regexes)
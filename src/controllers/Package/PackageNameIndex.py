@@ -0,0 +1,82 @@
+# coding: utf-8
+
+# Import libraries
+import bisect
+import fnmatch
+
+# Characters that make a package name a glob pattern (e.g. nginx*)
+GLOB_CHARACTERS = ('*', '?', '[')
+
+#-----------------------------------------------------------------------------------------------
+#
+#   Return True if the package name is a glob pattern
+#
+#-----------------------------------------------------------------------------------------------
+def is_pattern(name: str) -> bool:
+    return any(character in name for character in GLOB_CHARACTERS)
+
+
+class PackageNameIndex:
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Sorted index of package names, used to expand glob patterns without scanning all packages
+    #
+    #-----------------------------------------------------------------------------------------------
+    def __init__(self, names):
+        self.names = sorted(set(names))
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the package names matching a package name or a glob pattern, sorted by name
+    #
+    #-----------------------------------------------------------------------------------------------
+    def expand(self, pattern: str) -> list:
+        if not is_pattern(pattern):
+            position = bisect.bisect_left(self.names, pattern)
+
+            if position < len(self.names) and self.names[position] == pattern:
+                return [pattern]
+
+            return []
+
+        # Only the names starting with the literal part of the pattern can match, e.g. 'nginx' for 'nginx*'
+        prefix = pattern
+
+        for character in GLOB_CHARACTERS:
+            prefix = prefix.split(character)[0]
+
+        names = []
+        position = bisect.bisect_left(self.names, prefix)
+
+        while position < len(self.names) and self.names[position].startswith(prefix):
+            if fnmatch.fnmatchcase(self.names[position], pattern):
+                names.append(self.names[position])
+
+            position += 1
+
+        return names
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Expand a list of package names and glob patterns, keeping the order and removing duplicates
+    #   Patterns that do not match any package are kept as is, so that they can be reported as not installed
+    #
+    #-----------------------------------------------------------------------------------------------
+    def expand_all(self, patterns: list) -> list:
+        names = []
+        seen = set()
+
+        for pattern in patterns:
+            if is_pattern(pattern):
+                matching_names = self.expand(pattern) or [pattern]
+            else:
+                matching_names = [pattern]
+
+            for name in matching_names:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+
+        return names
@@ -0,0 +1,87 @@
+# coding: utf-8
+
+# Import libraries
+import time
+
+# Import classes
+from src.controllers.App.Utils import Utils
+
+class PrestageManifest:
+    def __init__(self, name: str = 'packages-prestage'):
+        # The manifest lists the pending updates that have been downloaded in advance by the service (pre-stage job)
+        self.manifest_file = Utils().get_state_file(name + '.manifest.json')
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Load the manifest, return None if there is no manifest (or if it is unreadable, meaning a regular update)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def load(self):
+        return Utils().load_state_file(self.manifest_file, ['date', 'sources', 'packages'])
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return the manifest if it can be used: not older than max_age hours and sources have not changed since
+    #
+    #-----------------------------------------------------------------------------------------------
+    def get_valid(self, max_age: int, sources_signature: str):
+        manifest = self.load()
+
+        if manifest is None:
+            return None
+
+        if manifest['sources'] != sources_signature:
+            return None
+
+        if Utils().is_expired(manifest['date'], max_age * 3600):
+            return None
+
+        return manifest
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Return True if all the packages to install are in the manifest, in the same versions
+    #
+    #-----------------------------------------------------------------------------------------------
+    def contains(self, manifest: dict, packages: list) -> bool:
+        staged = {}
+
+        for package in manifest['packages']:
+            staged[package['name']] = package['target_version']
+
+        for package in packages:
+            if staged.get(package['name']) != package['target_version']:
+                return False
+
+        return True
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Save the manifest
+    #
+    #-----------------------------------------------------------------------------------------------
+    def save(self, packages: list, sources_signature: str):
+        manifest = {
+            'date': time.time(),
+            'sources': sources_signature,
+            'packages': [{
+                'name': package['name'],
+                'current_version': package['current_version'],
+                'target_version': package['target_version']
+            } for package in packages]
+        }
+
+        Utils().save_state_file(self.manifest_file, manifest)
+
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #   Remove the manifest (pre-staged packages have been installed)
+    #
+    #-----------------------------------------------------------------------------------------------
+    def reset(self):
+        Utils().remove_state_file(self.manifest_file)
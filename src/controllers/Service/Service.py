@@ -2,12 +2,12 @@
 
 # Import libraries
 import subprocess
-import re
 from pathlib import Path
 from colorama import Fore, Style
 
 # Import classes
 from src.controllers.App.Config import Config
+from src.controllers.Package.PackageMatcher import PackageMatcher
 
 class Service:
     def __init__(self):
@@ -39,6 +39,9 @@ class Service:
             print('\n systemctl is not installed, skipping service reload')
             return
 
+        # Compile the updated packages list once, it is matched against each service condition
+        updatedPackagesMatcher = PackageMatcher(list(updated_packages))
+
         print('\nReloading services:')
 
         # Reload services
@@ -48,11 +51,8 @@ class Service:
                 # Split service name and package name
                 service, package = service.split(':')
 
-                # Check if the package is in the list of updated packages
-                regex = '(?:% s)' % '|'.join(updated_packages)
-
                 # If the package is not in the list of updated packages, skip the service
-                if not re.match(regex, package):
+                if not updatedPackagesMatcher.match(package):
                     continue
 
             # If dry-run is enabled, just print the service that would be reloaded
@@ -121,6 +121,9 @@ class Service:
             print('\n systemctl is not installed, skipping service restart')
             return
 
+        # Compile the updated packages list once, it is matched against each service condition
+        updatedPackagesMatcher = PackageMatcher(list(updated_packages))
+
         print('\n Restarting services')
 
         # Restart services
@@ -130,11 +133,8 @@ class Service:
                 # Split service name and package name
                 service, package = service.split(':')
 
-                # Check if the package is in the list of updated packages
-                regex = '(?:% s)' % '|'.join(updated_packages)
-
                 # If the package is not in the list of updated packages, skip the service
-                if not re.match(regex, package):
+                if not updatedPackagesMatcher.match(package):
                     continue
 
             # If dry-run is enabled, just print the service that would be restarted